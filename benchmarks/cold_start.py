@@ -0,0 +1,102 @@
+"""
+Cold-start cost of the Lambda handlers.
+
+Every run starts a fresh interpreter, imports a handler module the way the
+Lambda runtime does (init) and, for getmessages, serves one dashboard
+request against the in-memory AWS stand-in (first request), so clients that
+are only built on first use are paid for too. With --baseline the same is
+measured for the handlers of another git revision.
+
+Usage:
+    python benchmarks/cold_start.py --runs 20
+    python benchmarks/cold_start.py --baseline HEAD~1
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+
+HANDLERS = [
+    ('injection', 'lambda_function.py'),
+    ('processing', 'lamda_function.py'),
+    ('getmessages', 'lambda_function.py')
+]
+
+# Runs in the fresh interpreter, the stand-in is installed before any client can be built
+PROBE = r'''
+import importlib.util, json, os, sys, time
+code, directory, filename, benchmarks = sys.argv[1:5]
+start = time.perf_counter()
+sys.path.insert(0, benchmarks)
+from local_aws import LocalAWS
+LocalAWS({'receipts-table': {'key': ('receipt_id', None), 'indexes': {
+    'email_from-processed_at-index': ('email_from', 'processed_at')}}}).install()
+sys.path[:0] = [os.path.join(code, 'shared'), os.path.join(code, directory)]
+spec = importlib.util.spec_from_file_location('handler', os.path.join(code, directory, filename))
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+loaded = time.perf_counter()
+first = None
+if directory == 'getmessages':
+    event = {'resource': '/api', 'requestContext': {'authorizer': {'claims': {'email': 'user@example.com'}}}}
+    module.lambda_handler(event, None)
+    first = (time.perf_counter() - loaded) * 1000
+print(json.dumps({'init': (loaded - start) * 1000, 'first': first}))
+'''
+
+
+def checkout(revision, target):
+    """Extract the code directory of a git revision"""
+    archive = subprocess.run(['git', '-C', ROOT, 'archive', '--format=tar', revision, 'code'],
+                             check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target, filter='data')
+    return os.path.join(target, 'code')
+
+
+def measure(code, directory, filename, runs):
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='local', AWS_SECRET_ACCESS_KEY='local', AWS_DEFAULT_REGION='us-east-1',
+               TABLE_NAME='receipts-table', OPENROUTER_API_KEY='cold-start', LOG_LEVEL='WARNING',
+               PYTHONDONTWRITEBYTECODE='1')
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE, code, directory, filename, BENCHMARKS],
+                                check=True, capture_output=True, text=True, env=env).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    init = statistics.median(sample['init'] for sample in samples)
+    firsts = [sample['first'] for sample in samples if sample['first'] is not None]
+    return init, statistics.median(firsts) if firsts else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per handler')
+    parser.add_argument('--baseline', help='git revision to compare with')
+    args = parser.parse_args()
+
+    trees = [('current', os.path.join(ROOT, 'code'))]
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.baseline:
+            trees.insert(0, (args.baseline, checkout(args.baseline, tmp)))
+        print(f"median of {args.runs} cold starts, milliseconds")
+        for directory, filename in HANDLERS:
+            for label, code in trees:
+                if not os.path.exists(os.path.join(code, directory, filename)):
+                    continue
+                init, first = measure(code, directory, filename, args.runs)
+                line = f"{directory:<12} {label:<10} init={init:7.1f}"
+                if first is not None:
+                    line += f"  first request={first:7.1f}  total={init + first:7.1f}"
+                print(line)
+
+
+if __name__ == '__main__':
+    main()
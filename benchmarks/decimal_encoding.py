@@ -0,0 +1,106 @@
+"""
+Decimal handling on the API and processing paths.
+
+Compares the previous recursive conversions (decimal_to_float before
+json.dumps in getmessages, convert_floats_to_decimal after parsing the
+model answer in processing) with the single pass versions: json.dumps
+with a Decimal default hook, and json.loads(parse_float=Decimal).
+
+Usage:
+    python benchmarks/decimal_encoding.py --items 100,1000,5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code', 'shared'))
+
+from json_encoding import dumps
+
+
+def decimal_to_float(obj):
+    """Previous getmessages conversion"""
+    if isinstance(obj, list):
+        return [decimal_to_float(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: decimal_to_float(v) for k, v in obj.items()}
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    else:
+        return obj
+
+
+def convert_floats_to_decimal(obj):
+    """Previous processing conversion"""
+    if isinstance(obj, list):
+        return [convert_floats_to_decimal(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: convert_floats_to_decimal(v) for k, v in obj.items()}
+    elif isinstance(obj, float):
+        return Decimal(str(obj))
+    return obj
+
+
+def receipt_data(rng):
+    return {
+        'merchant_name': rng.choice(['Lidl', 'Biedronka', 'Shell', 'Starbucks', 'IKEA']),
+        'date': f'2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        'time': f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}',
+        'total_amount': Decimal(f'{rng.uniform(1, 500):.2f}'),
+        'currency': rng.choice(['EUR', 'USD', 'PLN']),
+        'payment_method': rng.choice(['card', 'cash'])
+    }
+
+
+def dashboard_items(rng, count):
+    """Items as the receipts index query returns them, numbers as Decimal"""
+    return [{
+        'receipt_id': f'{rng.getrandbits(128):032x}',
+        'filename': f'receipt-{index}.jpg',
+        'email_from': 'user@example.com',
+        'processed_at': f'2026-01-{index % 28 + 1:02d}T12:00:{index % 60:02d}.000000Z',
+        'file_size': Decimal(rng.randint(20_000, 3_000_000)),
+        'receipt_data': receipt_data(rng)
+    } for index in range(count)]
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', default='100,1000,5000', help='comma separated item counts')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    print("getmessages response body (ms, best of %d)" % args.repeat)
+    for count in [int(value) for value in args.items.split(',')]:
+        body = {'message': 'Messages retrieved successfully', 'count': count,
+                'items': dashboard_items(rng, count), 'next_token': None}
+        assert json.dumps(decimal_to_float(body)) == dumps(body)
+        before = best_of(lambda: json.dumps(decimal_to_float(body)), args.repeat)
+        after = best_of(lambda: dumps(body), args.repeat)
+        print(f"  {count:>6} items  decimal_to_float+dumps={before:8.2f}  dumps(default=)={after:8.2f}  "
+              f"speedup={before / after:4.1f}x")
+
+    print("model answer parsing (ms per 1000 answers)")
+    answers = [json.dumps(decimal_to_float(receipt_data(rng))) for _ in range(1000)]
+    before = best_of(lambda: [convert_floats_to_decimal(json.loads(answer)) for answer in answers], args.repeat)
+    after = best_of(lambda: [json.loads(answer, parse_float=Decimal) for answer in answers], args.repeat)
+    print(f"  loads+convert_floats_to_decimal={before:8.2f}  loads(parse_float=Decimal)={after:8.2f}  "
+          f"speedup={before / after:4.1f}x")
+
+
+if __name__ == '__main__':
+    main()
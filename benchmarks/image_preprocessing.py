@@ -0,0 +1,101 @@
+"""
+Compare the original attachment path with the image preprocessing stage.
+
+Reports payload size and preprocessing time for every image and, with
+--extract, end-to-end OpenRouter extraction latency for both paths.
+
+Usage:
+    python benchmarks/image_preprocessing.py photo1.jpg photo2.png
+    OPENROUTER_API_KEY=... python benchmarks/image_preprocessing.py --extract photo1.jpg
+"""
+import argparse
+import base64
+import io
+import mimetypes
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code', 'processing'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import image_preprocessing
+from image_preprocessing import prepare_image
+
+
+def synthetic_receipt(width=3024, height=4032):
+    """Phone-photo sized noisy image with receipt-like text lines"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (width, height), (235, 230, 220))
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(42)
+    for y in range(200, height - 200, 60):
+        x = 300
+        while x < width - 600:
+            word = rng.randint(40, 220)
+            draw.rectangle([x, y, x + word, y + 28], fill=(rng.randint(10, 60),) * 3)
+            x += word + rng.randint(20, 60)
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.15)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=95)
+    return output.getvalue()
+
+
+def load_inputs(paths):
+    if not paths:
+        return [('synthetic.jpg', synthetic_receipt(), 'image/jpeg')]
+    inputs = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            inputs.append((os.path.basename(path), f.read(), content_type))
+    return inputs
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help='image files, a synthetic receipt is used when empty')
+    parser.add_argument('--repeat', type=int, default=5, help='preprocessing runs per image')
+    parser.add_argument('--extract', action='store_true', help='also measure OpenRouter extraction latency')
+    args = parser.parse_args()
+
+    if image_preprocessing.Image is None:
+        print('Pillow is not installed, preprocessing is a no-op')
+
+    print(f"Settings: {image_preprocessing.preprocessing_signature()}")
+    print(f"{'file':<24}{'original':>12}{'prepared':>12}{'ratio':>8}{'p50 ms':>10}{'max ms':>10}")
+
+    for filename, data, content_type in load_inputs(args.images):
+        (prepared, mime_type), samples = timed(lambda: prepare_image(data, content_type), args.repeat)
+        original_b64 = len(base64.b64encode(data))
+        prepared_b64 = len(base64.b64encode(prepared))
+        print(f"{filename:<24}{original_b64:>12}{prepared_b64:>12}{prepared_b64 / original_b64:>8.2f}"
+              f"{statistics.median(samples):>10.1f}{max(samples):>10.1f}")
+
+        if args.extract:
+            import lamda_function
+
+            for label, payload, payload_type in (('original', data, content_type), ('prepared', prepared, mime_type)):
+                image_base64 = base64.b64encode(payload).decode('utf-8')
+                start = time.perf_counter()
+                receipt_info = lamda_function.extract_receipt_info(image_base64, filename, mime_type=payload_type)
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"  extract {label:<9} {elapsed:>8.0f} ms  {receipt_info}")
+
+
+if __name__ == '__main__':
+    main()
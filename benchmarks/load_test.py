@@ -0,0 +1,309 @@
+"""
+Local load test of the injection -> processing -> query path.
+
+Drives the injection, processing and getmessages lambda_handler functions
+in-process against in-memory S3/SQS/DynamoDB/SES (local_aws.py) and the stub
+OpenRouter server. Synthetic SES events and MIME emails with a varying
+number and size of image attachments are generated up front. Reports
+p50/p99 invocation latency per stage, peak memory, AWS call counts and
+messages/sec, so regressions in the hot paths show up without deploying.
+
+Usage:
+    python benchmarks/load_test.py --messages 200 --attachments 1-4 --image-kb 50-400
+    python benchmarks/load_test.py --latency 0.8 --error-rate 0.05 --trace-memory
+    python benchmarks/load_test.py --extras   # signature logo, tracking pixel and a duplicate per email
+    python benchmarks/load_test.py --users 3 --sender-limit 10   # heavy senders are deferred
+    python benchmarks/load_test.py --fast-invalid-rate 0.2   # fast model first, a share of its answers escalated
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from email.message import EmailMessage
+
+from local_aws import LocalAWS
+from stub_openrouter import completion, default_response, start_stub_server
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code')
+
+BUCKET = 'load-test-bucket'
+TABLE = 'receipts-table'
+INDEX = 'email_from-processed_at-index'
+AGGREGATES_TABLE = 'user-aggregates'
+CACHE_TABLE = 'extraction-cache'
+RATE_TABLE = 'rate-limits'
+PROCESSING_QUEUE = 'https://sqs.us-east-1.amazonaws.com/000000000000/processing'
+FAST_MODEL = 'stub-fast'
+
+TABLES = {
+    TABLE: {'key': ('receipt_id', None), 'indexes': {INDEX: ('email_from', 'processed_at')}},
+    AGGREGATES_TABLE: {'key': ('email_from', 'aggregate_key')},
+    CACHE_TABLE: {'key': ('cache_key', None)},
+    RATE_TABLE: {'key': ('limit_key', None)}
+}
+
+
+class Context:
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def tiered_response(invalid_rate, seed):
+    """Stub answers where a share of the fast model's receipts fail validation"""
+    rng = random.Random(seed)
+
+    def respond(payload):
+        response = default_response(payload)
+        if payload.get('model') == FAST_MODEL and rng.random() < invalid_rate:
+            receipts = json.loads(response['choices'][0]['message']['content'])
+            for receipt in receipts if isinstance(receipts, list) else [receipts]:
+                receipt['total_amount'] = 'forty two'
+            response = completion(json.dumps(receipts))
+        return response
+    return respond
+
+
+def load_handler(name, directory, filename):
+    """Import a Lambda module under a unique name, its directory provides sibling modules"""
+    path = os.path.join(CODE, directory)
+    sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(path, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_range(value):
+    low, _, high = value.partition('-')
+    return int(low), int(high or low)
+
+
+def synthetic_image(rng, size, image_format='JPEG', shape=None):
+    """Receipt shaped JPEG of roughly size bytes, noise keeps it from compressing and from hitting the cache"""
+    from PIL import Image
+
+    if shape is None:
+        width = max(160, int((size / 3) ** 0.5))
+        shape = (width, max(160, int(size / 1.5) // width))
+    image = Image.frombytes('L', shape, rng.randbytes(shape[0] * shape[1]))
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=75)
+    return output.getvalue()
+
+
+def add_extras(rng, message, first_image):
+    """What real emails carry besides receipts: an embedded signature logo, a tracking pixel, a duplicate"""
+    message.add_alternative('<p>Thanks</p><img src="cid:logo@example.com"><img src="https://t.example.com/p.gif">',
+                            subtype='html')
+    message.add_attachment(synthetic_image(rng, 0, 'PNG', (240, 80)), maintype='image', subtype='png',
+                           filename='logo.png', disposition='inline', cid='<logo@example.com>')
+    message.add_attachment(synthetic_image(rng, 0, 'GIF', (1, 1)), maintype='image', subtype='gif', filename='pixel.gif')
+    if first_image is not None:
+        message.add_attachment(first_image, maintype='image', subtype='jpeg', filename='forwarded-copy.jpg')
+
+
+def synthetic_email(rng, index, users, attachments, image_kb, extras=False):
+    sender = f'user{rng.randrange(users)}@example.com'
+    message = EmailMessage()
+    message['From'] = f'Load Test <{sender}>'
+    message['To'] = 'receipts@example.com'
+    message['Subject'] = f'Receipts {index}'
+    message.set_content('Please process the attached receipts.')
+    images = []
+    for number in range(rng.randint(*attachments)):
+        images.append(synthetic_image(rng, rng.randint(*image_kb) * 1024))
+    if extras:
+        add_extras(rng, message, images[0] if images else None)
+    for number, data in enumerate(images):
+        message.add_attachment(data, maintype='image', subtype='jpeg', filename=f'receipt-{index}-{number}.jpg')
+    return sender, message.as_bytes()
+
+
+def ses_record(index, sender, object_key):
+    """SQS record of the SES notification published through SNS"""
+    body = {
+        'mail': {
+            'messageId': f'load-{index:06d}',
+            'timestamp': '2026-01-15T12:00:00.000Z',
+            'commonHeaders': {
+                'from': [f'Load Test <{sender}>'],
+                'to': ['receipts@example.com'],
+                'subject': f'Receipts {index}'
+            }
+        },
+        'receipt': {'action': {'type': 'S3', 'bucketName': BUCKET, 'objectKey': object_key}}
+    }
+    return {'messageId': f'injection-{index}', 'receiptHandle': f'handle-{index}', 'body': json.dumps(body)}
+
+
+def queue_record(message):
+    return {
+        'messageId': message['MessageId'],
+        'receiptHandle': message['ReceiptHandle'],
+        'body': message['Body'],
+        'messageAttributes': {},
+        'eventSourceARN': 'arn:aws:sqs:us-east-1:000000000000:processing'
+    }
+
+
+def chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+class Stage:
+    def __init__(self, name, local, trace_memory):
+        self.name = name
+        self.local = local
+        self.trace_memory = trace_memory
+        self.samples = []
+        self.failures = 0
+        self.elapsed = 0.0
+        self.peak_memory = 0
+
+    def __enter__(self):
+        self.calls_before = self.local.snapshot()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            self.memory_before = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.calls = self.local.snapshot() - self.calls_before
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1] - self.memory_before
+
+    def invoke(self, handler, event, context, quiet):
+        start = time.perf_counter()
+        output = io.StringIO() if quiet else sys.stdout
+        with contextlib.redirect_stdout(output):
+            response = handler(event, context)
+        self.samples.append((time.perf_counter() - start) * 1000)
+        self.failures += len(response.get('batchItemFailures', []))
+        return response
+
+    def report(self, messages):
+        ordered = sorted(self.samples)
+        p99 = ordered[min(len(ordered) - 1, int(round(0.99 * (len(ordered) - 1))))]
+        line = (f"{self.name:<11} invocations={len(self.samples):<5} p50={statistics.median(ordered):8.1f} ms"
+                f"  p99={p99:8.1f} ms  messages/s={messages / self.elapsed:8.1f}  failures={self.failures}")
+        if self.trace_memory:
+            line += f"  peak={self.peak_memory / 1024 / 1024:.1f} MiB"
+        print(line)
+        print('            calls: ' + ', '.join(f'{name}={count}' for name, count in sorted(self.calls.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100, help='emails to inject')
+    parser.add_argument('--users', type=int, default=10, help='distinct senders')
+    parser.add_argument('--attachments', default='1-3', help='images per email, N or MIN-MAX')
+    parser.add_argument('--image-kb', default='30-300', help='image size in KiB, N or MIN-MAX')
+    parser.add_argument('--injection-batch', type=int, default=10, help='SQS batch size of the injection trigger')
+    parser.add_argument('--processing-batch', type=int, default=5, help='SQS batch size of the processing trigger')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub model latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='stub share of 503 responses')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='stub share of 429 responses')
+    parser.add_argument('--model-rate-limit', type=int, default=0, help='model requests per minute, 0 disables it')
+    parser.add_argument('--sender-limit', type=int, default=0, help='receipts per sender before deferral, 0 disables it')
+    parser.add_argument('--fast-invalid-rate', type=float, help='route through a fast model, share of its answers failing validation')
+    parser.add_argument('--extras', action='store_true', help='add a signature logo, tracking pixel and duplicate image')
+    parser.add_argument('--queries', type=int, default=3, help='dashboard loads per user')
+    parser.add_argument('--trace-memory', action='store_true', help='per stage peak Python memory (slower)')
+    parser.add_argument('--verbose', action='store_true', help='show handler output')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    respond = default_response if args.fast_invalid_rate is None else tiered_response(args.fast_invalid_rate, args.seed)
+    _, stub, url = start_stub_server(latency=args.latency, error_rate=args.error_rate,
+                                     rate_limit_rate=args.rate_limit_rate, respond=respond, seed=args.seed)
+    os.environ.update({
+        'BUCKET_NAME': BUCKET,
+        'TABLE_NAME': TABLE,
+        'INDEX_NAME': INDEX,
+        'AGGREGATES_TABLE_NAME': AGGREGATES_TABLE,
+        'CACHE_TABLE_NAME': CACHE_TABLE,
+        'RATE_LIMIT_TABLE_NAME': RATE_TABLE,
+        'MODEL_RATE_LIMIT': str(args.model_rate_limit),
+        'SENDER_RATE_LIMIT': str(args.sender_limit),
+        'OPENROUTER_FAST_MODEL': FAST_MODEL if args.fast_invalid_rate is not None else '',
+        'PROCESSING_QUEUE_URL': PROCESSING_QUEUE,
+        'OPENROUTER_URL': url,
+        'OPENROUTER_API_KEY': 'load-test',
+        'MODEL_BACKOFF_BASE': os.environ.get('MODEL_BACKOFF_BASE', '0.05'),
+        'SENDER_EMAIL': 'receipts@example.com'
+    })
+
+    # Installed before the handlers are imported, they build their clients at import time
+    local = LocalAWS(TABLES).install()
+    # The shared layer is mounted on /opt/python in Lambda
+    sys.path.insert(0, os.path.join(CODE, 'shared'))
+    injection = load_handler('injection_handler', 'injection', 'lambda_function.py')
+    processing = load_handler('processing_handler', 'processing', 'lamda_function.py')
+    getmessages = load_handler('getmessages_handler', 'getmessages', 'lambda_function.py')
+
+    rng = random.Random(args.seed)
+    attachments, image_kb = parse_range(args.attachments), parse_range(args.image_kb)
+    print(f"Generating {args.messages} emails ({args.attachments} images of {args.image_kb} KiB)...")
+    records, senders = [], set()
+    for index in range(args.messages):
+        sender, raw = synthetic_email(rng, index, args.users, attachments, image_kb, args.extras)
+        senders.add(sender)
+        object_key = f'inbox/load-{index:06d}'
+        local.s3.put_object(Bucket=BUCKET, Key=object_key, Body=raw, ContentType='message/rfc822')
+        records.append(ses_record(index, sender, object_key))
+    raw_bytes = sum(len(data) for data, content_type in local.s3.objects.values())
+    print(f"Raw email bytes: {raw_bytes / 1024 / 1024:.1f} MiB, model stub latency {args.latency}s")
+
+    if args.trace_memory:
+        tracemalloc.start()
+    quiet = not args.verbose
+    stages = []
+
+    with Stage('injection', local, args.trace_memory) as stage:
+        for batch in chunks(records, args.injection_batch):
+            stage.invoke(injection.lambda_handler, {'Records': batch}, Context(40), quiet)
+    stages.append((stage, len(records)))
+
+    queued = local.sqs.drain(PROCESSING_QUEUE)
+    with Stage('processing', local, args.trace_memory) as stage:
+        for batch in chunks(queued, args.processing_batch):
+            event = {'Records': [queue_record(message) for message in batch]}
+            stage.invoke(processing.lambda_handler, event, Context(120), quiet)
+    stages.append((stage, len(queued)))
+    # Deferred messages would only come back after their delay, they are counted but not replayed
+    deferred = len(local.sqs.drain(PROCESSING_QUEUE))
+
+    with Stage('getmessages', local, args.trace_memory) as stage:
+        for _ in range(args.queries):
+            for sender in sorted(senders):
+                claims = {'requestContext': {'authorizer': {'claims': {'email': sender}}}}
+                stage.invoke(getmessages.lambda_handler, dict(claims, resource='/api/analytics'), Context(10), quiet)
+                stage.invoke(getmessages.lambda_handler, dict(claims, resource='/api'), Context(10), quiet)
+    stages.append((stage, args.queries * len(senders)))
+
+    print()
+    for stage, messages in stages:
+        stage.report(messages)
+    total = sum(stage.elapsed for stage, messages in stages[:2])
+    print()
+    print(f"End to end: {len(records)} emails, {len(queued)} processed in {total:.2f}s "
+          f"({len(records) / total:.1f} messages/s), {stub.requests} model requests, "
+          f"{len(local.ses.sent)} notifications, {deferred} deferred")
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
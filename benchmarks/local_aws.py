@@ -0,0 +1,641 @@
+"""
+In-memory stand-ins for the S3, SQS, DynamoDB and SES APIs used by the Lambdas.
+
+install() hooks botocore's before-call event on the default boto3 session,
+so every client created afterwards (including DynamoDB resources and
+batch writers) runs its real parameter validation and serialization but is
+answered from memory instead of AWS. Only the operations and expression
+syntax the handlers use are supported. Every call is counted per
+service and operation.
+
+Usage:
+    local = LocalAWS(tables={'receipts': {'key': ('receipt_id', None)}})
+    local.install()
+    import lambda_function  # clients built at import time are covered
+"""
+import hashlib
+import io
+import itertools
+import os
+import re
+import threading
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+class LocalError(Exception):
+    def __init__(self, code, message='', status=400, **extra):
+        super().__init__(message)
+        self.code = code
+        self.message = message or code
+        self.status = status
+        self.extra = extra
+
+
+def snake_case(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+def read_body(body):
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body)
+    return body.read()
+
+
+class S3Backend:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise LocalError('NoSuchKey', 'The specified key does not exist.', status=404)
+        data, content_type = self.objects[(Bucket, Key)]
+        return {
+            'Body': StreamingBody(io.BytesIO(data), len(data)),
+            'ContentLength': len(data),
+            'ContentType': content_type,
+            'ETag': f'"{hashlib.md5(data).hexdigest()}"'
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        response = self.get_object(Bucket, Key)
+        del response['Body']
+        return response
+
+    def put_object(self, Bucket, Key, Body=None, ContentType='binary/octet-stream', **kwargs):
+        data = read_body(Body)
+        self.objects[(Bucket, Key)] = (data, ContentType)
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for entry in Delete['Objects']:
+            self.objects.pop((Bucket, entry['Key']), None)
+        return {'Deleted': [{'Key': entry['Key']} for entry in Delete['Objects']]}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        if ContinuationToken:
+            keys = [key for key in keys if key > ContinuationToken]
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'IsTruncated': len(keys) > len(page),
+            'Contents': [{'Key': key, 'Size': len(self.objects[(Bucket, key)][0])} for key in page]
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, ContentType='binary/octet-stream', **kwargs):
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = (Bucket, Key, ContentType, {})
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body=None, **kwargs):
+        if UploadId not in self.uploads:
+            raise LocalError('NoSuchUpload', status=404)
+        data = read_body(Body)
+        self.uploads[UploadId][3][PartNumber] = data
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        if UploadId not in self.uploads:
+            raise LocalError('NoSuchUpload', status=404)
+        bucket, key, content_type, parts = self.uploads.pop(UploadId)
+        data = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        self.objects[(bucket, key)] = (data, content_type)
+        return {'Bucket': bucket, 'Key': key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class SQSBackend:
+    def __init__(self):
+        self.queues = {}
+        self.ids = itertools.count(1)
+
+    def queue(self, url):
+        return self.queues.setdefault(url, [])
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, MessageAttributes=None, **kwargs):
+        message_id = f'local-{next(self.ids)}'
+        self.queue(QueueUrl).append({
+            'MessageId': message_id,
+            'ReceiptHandle': f'handle-{message_id}',
+            'Body': MessageBody,
+            'DelaySeconds': DelaySeconds,
+            'MessageAttributes': MessageAttributes or {}
+        })
+        return {'MessageId': message_id, 'MD5OfMessageBody': hashlib.md5(MessageBody.encode('utf-8')).hexdigest()}
+
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        successful = []
+        for entry in Entries:
+            response = self.send_message(QueueUrl, entry['MessageBody'], entry.get('DelaySeconds', 0),
+                                         entry.get('MessageAttributes'))
+            successful.append(dict(response, Id=entry['Id']))
+        return {'Successful': successful, 'Failed': []}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout, **kwargs):
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries, **kwargs):
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        return {}
+
+    def drain(self, url):
+        """Remove and return every message sent to a queue"""
+        messages, self.queues[url] = self.queue(url), []
+        return messages
+
+
+class SESBackend:
+    def __init__(self):
+        self.sent = []
+
+    def send_email(self, Source, Destination, Message, **kwargs):
+        self.sent.append({'Source': Source, 'Destination': Destination, 'Message': Message})
+        return {'MessageId': uuid.uuid4().hex}
+
+    def send_raw_email(self, RawMessage, **kwargs):
+        self.sent.append({'RawMessage': RawMessage})
+        return {'MessageId': uuid.uuid4().hex}
+
+
+TOKEN_RE = re.compile(r'\s*(<>|<=|>=|=|<|>|\(|\)|,|\+|-|[#:]?[A-Za-z_][\w.]*)')
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_RE.match(expression, position)
+        if not match:
+            raise LocalError('ValidationException', f'Invalid expression: {expression}')
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class Expression:
+    """Evaluates DynamoDB condition and update expressions against a Python item"""
+
+    def __init__(self, expression, names=None, values=None):
+        self.tokens = tokenize(expression or '')
+        self.position = 0
+        self.names = names or {}
+        self.values = {key: deserializer.deserialize(value) for key, value in (values or {}).items()}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token or '').upper() != expected:
+            raise LocalError('ValidationException', f'Expected {expected}, got {token}')
+        self.position += 1
+        return token
+
+    def name(self, token):
+        return '.'.join(self.names.get(part, part) for part in token.split('.'))
+
+    # Operands
+
+    def operand(self, item):
+        token = self.take()
+        if token.startswith(':'):
+            return self.values[token]
+        if self.peek() == '(':
+            self.take('(')
+            args = [self.operand_or_path(item)]
+            while self.peek() == ',':
+                self.take(',')
+                args.append(self.operand_or_path(item))
+            self.take(')')
+            return self.function(token, args, item)
+        return self.resolve(item, self.name(token))
+
+    def operand_or_path(self, item):
+        token = self.peek()
+        if token.startswith(':') or self.peek(1) == '(':
+            return self.operand(item)
+        self.take()
+        return ('path', self.name(token))
+
+    def value(self, argument, item):
+        if isinstance(argument, tuple) and argument[0] == 'path':
+            return self.resolve(item, argument[1])
+        return argument
+
+    def function(self, name, args, item):
+        if name == 'attribute_exists':
+            return self.resolve(item, args[0][1]) is not None
+        if name == 'attribute_not_exists':
+            return self.resolve(item, args[0][1]) is None
+        if name == 'begins_with':
+            value = self.value(args[0], item)
+            return isinstance(value, str) and value.startswith(self.value(args[1], item))
+        if name == 'contains':
+            value = self.value(args[0], item)
+            return value is not None and self.value(args[1], item) in value
+        if name == 'size':
+            value = self.value(args[0], item)
+            return Decimal(len(value)) if value is not None else None
+        if name == 'if_not_exists':
+            value = self.value(args[0], item)
+            return value if value is not None else self.value(args[1], item)
+        if name == 'list_append':
+            return list(self.value(args[0], item) or []) + list(self.value(args[1], item) or [])
+        raise LocalError('ValidationException', f'Unsupported function {name}')
+
+    @staticmethod
+    def resolve(item, path):
+        value = item
+        for part in path.split('.'):
+            if not isinstance(value, dict) or part not in value:
+                return None
+            value = value[part]
+        return value
+
+    # Conditions
+
+    def condition(self, item):
+        result = self.conjunction(item)
+        while (self.peek() or '').upper() == 'OR':
+            self.take()
+            right = self.conjunction(item)
+            result = result or right
+        return result
+
+    def conjunction(self, item):
+        result = self.negation(item)
+        while (self.peek() or '').upper() == 'AND':
+            self.take()
+            right = self.negation(item)
+            result = result and right
+        return result
+
+    def negation(self, item):
+        if (self.peek() or '').upper() == 'NOT':
+            self.take()
+            return not self.negation(item)
+        if self.peek() == '(':
+            self.take('(')
+            result = self.condition(item)
+            self.take(')')
+            return result
+        left = self.operand(item)
+        operator = (self.peek() or '').upper()
+        if operator == 'BETWEEN':
+            self.take()
+            low = self.operand(item)
+            self.take('AND')
+            high = self.operand(item)
+            return left is not None and low <= left <= high
+        if operator == 'IN':
+            self.take()
+            self.take('(')
+            options = [self.operand(item)]
+            while self.peek() == ',':
+                self.take(',')
+                options.append(self.operand(item))
+            self.take(')')
+            return left in options
+        if operator in ('=', '<>', '<', '<=', '>', '>='):
+            self.take()
+            right = self.operand(item)
+            return compare(left, operator, right)
+        # A bare function call like attribute_exists(x)
+        return bool(left)
+
+    def matches(self, item):
+        if not self.tokens:
+            return True
+        self.position = 0
+        return self.condition(item)
+
+    # Updates
+
+    def update_value(self, item):
+        value = self.operand(item)
+        while self.peek() in ('+', '-'):
+            operator = self.take()
+            right = self.operand(item)
+            value = value + right if operator == '+' else value - right
+        return value
+
+    def apply_update(self, item):
+        self.position = 0
+        while self.peek() is not None:
+            section = self.take().upper()
+            while True:
+                path = self.name(self.take())
+                if section == 'SET':
+                    self.take('=')
+                    assign(item, path, self.update_value(item))
+                elif section == 'ADD':
+                    value = self.operand(item)
+                    current = self.resolve(item, path)
+                    if isinstance(value, set):
+                        assign(item, path, (current or set()) | value)
+                    else:
+                        assign(item, path, (current or 0) + value)
+                elif section == 'REMOVE':
+                    parent, _, leaf = path.rpartition('.')
+                    container = self.resolve(item, parent) if parent else item
+                    if isinstance(container, dict):
+                        container.pop(leaf, None)
+                elif section == 'DELETE':
+                    value = self.operand(item)
+                    assign(item, path, (self.resolve(item, path) or set()) - value)
+                else:
+                    raise LocalError('ValidationException', f'Unsupported update section {section}')
+                if self.peek() != ',':
+                    break
+                self.take(',')
+
+
+def compare(left, operator, right):
+    if left is None or right is None:
+        return operator == '<>' and left != right
+    try:
+        return {
+            '=': left == right,
+            '<>': left != right,
+            '<': left < right,
+            '<=': left <= right,
+            '>': left > right,
+            '>=': left >= right
+        }[operator]
+    except TypeError:
+        return operator == '<>'
+
+
+def assign(item, path, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        item = item.setdefault(part, {})
+    item[parts[-1]] = value
+
+
+def project(item, projection, names):
+    if not projection:
+        return item
+    fields = [names.get(field.strip(), field.strip()) for field in projection.split(',')]
+    return {field: item[field] for field in fields if field in item}
+
+
+def to_wire(item):
+    return {key: serializer.serialize(value) for key, value in item.items()}
+
+
+def from_wire(item):
+    return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+
+class DynamoDBBackend:
+    """
+    tables maps a table name to {'key': (hash, range), 'indexes': {name: (hash, range)}},
+    items are kept deserialized and converted at the API boundary.
+    """
+
+    def __init__(self, tables=None):
+        self.schemas = dict(tables or {})
+        self.tables = {name: {} for name in self.schemas}
+
+    def schema(self, table_name):
+        if table_name not in self.schemas:
+            raise LocalError('ResourceNotFoundException', f'Requested resource not found: {table_name}')
+        return self.schemas[table_name]
+
+    def table(self, table_name):
+        self.schema(table_name)
+        return self.tables[table_name]
+
+    def key_of(self, table_name, item):
+        hash_key, range_key = self.schema(table_name)['key']
+        return (item.get(hash_key), item.get(range_key) if range_key else None)
+
+    def check(self, item, condition, names, values):
+        if condition and not Expression(condition, names, values).matches(item or {}):
+            raise LocalError('ConditionalCheckFailedException', 'The conditional request failed')
+
+    # Single item operations
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        key = from_wire(Key)
+        item = self.table(TableName).get(self.key_of(TableName, key))
+        if item is None:
+            return {}
+        return {'Item': to_wire(project(item, ProjectionExpression, ExpressionAttributeNames or {}))}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        item = from_wire(Item)
+        key = self.key_of(TableName, item)
+        self.check(self.table(TableName).get(key), ConditionExpression, ExpressionAttributeNames,
+                   ExpressionAttributeValues)
+        self.table(TableName)[key] = item
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression=None, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        key_item = from_wire(Key)
+        key = self.key_of(TableName, key_item)
+        current = self.table(TableName).get(key)
+        self.check(current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        item = dict(current or key_item)
+        if UpdateExpression:
+            Expression(UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues).apply_update(item)
+        self.table(TableName)[key] = item
+        if ReturnValues == 'ALL_NEW':
+            return {'Attributes': to_wire(item)}
+        if ReturnValues == 'ALL_OLD' and current:
+            return {'Attributes': to_wire(current)}
+        if ReturnValues == 'UPDATED_NEW':
+            return {'Attributes': to_wire({name: value for name, value in item.items()
+                                           if current is None or current.get(name) != value})}
+        return {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        key = self.key_of(TableName, from_wire(Key))
+        self.check(self.table(TableName).get(key), ConditionExpression, ExpressionAttributeNames,
+                   ExpressionAttributeValues)
+        self.table(TableName).pop(key, None)
+        return {}
+
+    # Batches and transactions
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for table_name, request in RequestItems.items():
+            names = request.get('ExpressionAttributeNames', {})
+            found = []
+            for key in request['Keys']:
+                item = self.table(table_name).get(self.key_of(table_name, from_wire(key)))
+                if item is not None:
+                    found.append(to_wire(project(item, request.get('ProjectionExpression'), names)))
+            responses[table_name] = found
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                if 'PutRequest' in request:
+                    self.put_item(table_name, request['PutRequest']['Item'])
+                else:
+                    self.delete_item(table_name, request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {}}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        reasons = []
+        for entry in TransactItems:
+            (kind, request), = entry.items()
+            table_name = request['TableName']
+            key = self.key_of(table_name, from_wire(request['Key'] if 'Key' in request else request['Item']))
+            try:
+                self.check(self.table(table_name).get(key), request.get('ConditionExpression'),
+                           request.get('ExpressionAttributeNames'), request.get('ExpressionAttributeValues'))
+                reasons.append({'Code': 'None'})
+            except LocalError as e:
+                reasons.append({'Code': 'ConditionalCheckFailed', 'Message': e.message})
+        if any(reason['Code'] != 'None' for reason in reasons):
+            raise LocalError('TransactionCanceledException', 'Transaction cancelled', CancellationReasons=reasons)
+
+        for entry in TransactItems:
+            (kind, request), = entry.items()
+            request = {name: value for name, value in request.items() if name != 'ConditionExpression'}
+            if kind == 'Put':
+                self.put_item(**request)
+            elif kind == 'Update':
+                self.update_item(**request)
+            elif kind == 'Delete':
+                self.delete_item(**request)
+        return {}
+
+    # Reads
+
+    def query(self, TableName, KeyConditionExpression, IndexName=None, ExpressionAttributeNames=None,
+              ExpressionAttributeValues=None, ProjectionExpression=None, FilterExpression=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, Select=None, **kwargs):
+        schema = self.schema(TableName)
+        hash_key, range_key = schema['indexes'][IndexName] if IndexName else schema['key']
+        condition = Expression(KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        filter_expression = Expression(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+
+        # Sparse indexes only contain items that have the index keys
+        items = [item for item in self.table(TableName).values()
+                 if hash_key in item and (range_key is None or range_key in item) and condition.matches(item)]
+        table_keys = [name for name in schema['key'] if name]
+        order = [range_key] if range_key else []
+        items.sort(key=lambda item: tuple(item[name] for name in order + table_keys), reverse=not ScanIndexForward)
+
+        if ExclusiveStartKey:
+            start = from_wire(ExclusiveStartKey)
+            start_position = tuple(start.get(name) for name in order + table_keys)
+            items = [item for item in items
+                     if (tuple(item[name] for name in order + table_keys) > start_position) == ScanIndexForward
+                     and tuple(item[name] for name in order + table_keys) != start_position]
+
+        page = items[:Limit] if Limit else items
+        response = {'ScannedCount': len(page)}
+        if Limit and len(items) > Limit:
+            last = page[-1]
+            response['LastEvaluatedKey'] = to_wire({name: last[name] for name in set(table_keys + [hash_key] + order)})
+        page = [item for item in page if filter_expression.matches(item)]
+        response['Count'] = len(page)
+        if Select == 'COUNT':
+            return response
+        response['Items'] = [to_wire(project(item, ProjectionExpression, ExpressionAttributeNames or {}))
+                             for item in page]
+        return response
+
+    def scan(self, TableName, FilterExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+             ProjectionExpression=None, **kwargs):
+        filter_expression = Expression(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        items = [item for item in self.table(TableName).values() if filter_expression.matches(item)]
+        return {
+            'Items': [to_wire(project(item, ProjectionExpression, ExpressionAttributeNames or {})) for item in items],
+            'Count': len(items),
+            'ScannedCount': len(self.table(TableName))
+        }
+
+
+class LocalAWS:
+    """Routes boto3 calls to the in-memory backends and counts them"""
+
+    def __init__(self, tables=None):
+        self.s3 = S3Backend()
+        self.sqs = SQSBackend()
+        self.dynamodb = DynamoDBBackend(tables)
+        self.ses = SESBackend()
+        self.backends = {'s3': self.s3, 'sqs': self.sqs, 'dynamodb': self.dynamodb, 'ses': self.ses}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def install(self, session=None):
+        """Answer every client created from the (default) boto3 session from memory"""
+        # Nothing is sent, but credential lookup would otherwise probe the instance metadata service
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        if session is None:
+            boto3.setup_default_session()
+            session = boto3.DEFAULT_SESSION
+        events = session._session.get_component('event_emitter')
+        # Last, so parameters are captured after boto3's DynamoDB transformations
+        events.register_last('before-parameter-build', self._capture)
+        events.register('before-call', self._handle)
+        return self
+
+    def _capture(self, params, context, **kwargs):
+        context['local_aws_params'] = params
+
+    def _handle(self, model, context, **kwargs):
+        service = model.service_model.service_name
+        operation = snake_case(model.name)
+        backend = self.backends.get(service)
+        handler = getattr(backend, operation, None)
+        if handler is None:
+            raise NotImplementedError(f'{service}.{operation} is not supported by the local stand-in')
+
+        params = context.get('local_aws_params', {})
+        with self.lock:
+            self.calls[f'{service}.{operation}'] += 1
+            try:
+                parsed = handler(**params)
+                status = 200
+            except LocalError as e:
+                parsed = dict(e.extra, Error={'Code': e.code, 'Message': e.message})
+                status = e.status
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': status, 'RequestId': 'local', 'HTTPHeaders': {}}
+        return AWSResponse('https://local', status, {}, None), parsed
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls)
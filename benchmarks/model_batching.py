@@ -0,0 +1,119 @@
+"""
+Throughput and cost of single-image vs batched model requests.
+
+Extracts the same set of receipt images through the processing Lambda's
+download_and_extract, once with one request per image and once packing up
+to --batch-size images per request. Cost per receipt is computed from the
+usage block of the responses and the given per-token prices. Runs against
+the local stub server unless --url is given.
+
+Usage:
+    python benchmarks/model_batching.py --images 40 --batch-size 4 --latency 0.5
+    OPENROUTER_API_KEY=... OPENROUTER_MODEL=... python benchmarks/model_batching.py \\
+        --url https://openrouter.ai/api/v1/chat/completions --images 8 --dir receipts/
+"""
+import argparse
+import base64
+import contextlib
+import io
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code', 'processing'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code', 'shared'))
+
+from stub_openrouter import start_stub_server
+
+
+def load_images(args):
+    if args.dir:
+        names = sorted(name for name in os.listdir(args.dir) if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')))
+        images = []
+        for name in names[:args.images]:
+            with open(os.path.join(args.dir, name), 'rb') as f:
+                images.append((name, f.read()))
+        return images
+    return [(f'receipt-{i}.jpg', os.urandom(args.image_bytes)) for i in range(args.images)]
+
+
+def attachment(filename, data):
+    # Inline attachments keep S3 out of the measurement
+    return {
+        'filename': filename,
+        'content_type': 'image/jpeg',
+        'size': len(data),
+        'inline': base64.b64encode(zlib.compress(data)).decode('ascii')
+    }
+
+
+def run(processing, attachments, batch_size, workers):
+    processing.MODEL_BATCH_SIZE = batch_size
+    processing.extraction_cache.lru.clear()
+    processing.extraction_cache.table_name = None
+    usage = {'prompt_tokens': 0, 'completion_tokens': 0}
+    post = processing.model_client.post
+
+    def counting_post(payload, **kwargs):
+        response = post(payload, **kwargs)
+        try:
+            for key in usage:
+                usage[key] += response.json().get('usage', {}).get(key, 0)
+        except ValueError:
+            pass
+        return response
+
+    processing.model_client.post = counting_post
+    before = processing.model_client.snapshot()
+    deadline = time.monotonic() + 600
+    start = time.perf_counter()
+    # The handler logs every request, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda batch: processing.download_and_extract(batch, deadline),
+            processing.plan_batches(attachments)
+        ))
+    elapsed = time.perf_counter() - start
+    processing.model_client.post = post
+
+    extracted = sum(1 for batch in results for file_size, receipt_info, retry in batch if receipt_info)
+    requests_made = processing.model_client.snapshot()['requests'] - before['requests']
+    return elapsed, requests_made, extracted, usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='target URL, defaults to a local stub server')
+    parser.add_argument('--images', type=int, default=24)
+    parser.add_argument('--image-bytes', type=int, default=200 * 1024, help='size of synthetic images')
+    parser.add_argument('--dir', help='directory of real receipt images')
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.5, help='stub latency in seconds')
+    parser.add_argument('--prompt-price', type=float, default=0.10, help='USD per 1M prompt tokens')
+    parser.add_argument('--completion-price', type=float, default=0.40, help='USD per 1M completion tokens')
+    args = parser.parse_args()
+
+    if not args.url:
+        _, _, args.url = start_stub_server(latency=args.latency, seed=1)
+    os.environ['OPENROUTER_URL'] = args.url
+
+    # Imported after OPENROUTER_URL is set, the model client reads it at import time
+    import lamda_function as processing
+
+    attachments = [attachment(filename, data) for filename, data in load_images(args)]
+    print(f"Target: {args.url}, {len(attachments)} images, {args.workers} workers")
+    for label, batch_size in (('single', 1), (f'batch={args.batch_size}', args.batch_size)):
+        elapsed, requests_made, extracted, usage = run(processing, attachments, batch_size, args.workers)
+        cost = (usage['prompt_tokens'] * args.prompt_price + usage['completion_tokens'] * args.completion_price) / 1e6
+        print(f"{label:<10} requests={requests_made:<4} extracted={extracted:<4} "
+              f"time={elapsed:6.2f}s  requests/s={requests_made / elapsed:6.2f}  receipts/s={extracted / elapsed:6.2f}  "
+              f"tokens={usage['prompt_tokens']}+{usage['completion_tokens']}  "
+              f"cost/receipt=${cost / max(extracted, 1):.6f}")
+
+
+if __name__ == '__main__':
+    main()
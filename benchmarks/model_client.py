@@ -0,0 +1,92 @@
+"""
+Latency of the pooled OpenRouter client in cold and warm containers.
+
+A cold container builds a new ModelClient (and connection pool) for its
+first request, a warm one reuses the module-level client. Runs against the
+local stub server unless --url is given; use a real https URL to include the
+TLS handshake that pooling saves.
+
+Usage:
+    python benchmarks/model_client.py --requests 50 --latency 0.05
+    python benchmarks/model_client.py --error-rate 0.3
+    OPENROUTER_API_KEY=... python benchmarks/model_client.py --url https://openrouter.ai/api/v1/chat/completions
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code', 'processing'))
+
+from model_client import ModelClient
+from stub_openrouter import start_stub_server
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(label, samples, client=None):
+    line = (f"{label:<8} n={len(samples):<4} p50={statistics.median(samples):8.1f} ms"
+            f"  p99={percentile(samples, 99):8.1f} ms  mean={statistics.mean(samples):8.1f} ms")
+    if client is not None:
+        line += f"  {client.snapshot()}"
+    print(line)
+
+
+def run(client_factory, url, headers, payload, count, reuse):
+    samples = []
+    client = client_factory(url) if reuse else None
+    for _ in range(count):
+        if not reuse:
+            client = client_factory(url)
+        start = time.perf_counter()
+        try:
+            client.post(payload, headers=headers, timeout=30)
+        except Exception as e:
+            print(f"  request failed: {e}")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='target URL, defaults to a local stub server')
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02, help='stub latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='stub share of 503 responses')
+    args = parser.parse_args()
+
+    url = args.url
+    state = None
+    if not url:
+        _, state, url = start_stub_server(latency=args.latency, error_rate=args.error_rate, seed=1)
+
+    headers = {'Content-Type': 'application/json'}
+    if os.environ.get('OPENROUTER_API_KEY'):
+        headers['Authorization'] = f"Bearer {os.environ['OPENROUTER_API_KEY']}"
+    payload = {
+        'model': os.environ.get('OPENROUTER_MODEL', 'stub'),
+        'messages': [{'role': 'user', 'content': 'ping'}],
+        'max_tokens': 1
+    }
+
+    def factory(target):
+        return ModelClient(url=target, backoff_base=0.05, backoff_max=0.5)
+
+    cold, _ = run(factory, url, headers, payload, args.requests, reuse=False)
+    if state:
+        cold_connections = state.connections
+    warm, client = run(factory, url, headers, payload, args.requests, reuse=True)
+
+    print(f"Target: {url}")
+    report('cold', cold)
+    report('warm', warm, client)
+    if state:
+        print(f"Connections opened: cold={cold_connections} warm={state.connections - cold_connections}")
+
+
+if __name__ == '__main__':
+    main()
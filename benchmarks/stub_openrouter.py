@@ -0,0 +1,135 @@
+"""
+Local stand-in for the OpenRouter chat completions API.
+
+Answers every POST with a fixed receipt extraction (one per image of a
+batched request) after a configurable latency, and fails a configurable share of requests with 503/429 so the
+retry, backoff and circuit breaker paths can be exercised without network.
+
+Usage:
+    python benchmarks/stub_openrouter.py --port 8089 --latency 0.8 --error-rate 0.1
+"""
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RECEIPT = {
+    'merchant_name': 'Stub Market',
+    'date': '2026-01-15',
+    'time': '12:30',
+    'total_amount': 42.5,
+    'currency': 'EUR',
+    'payment_method': 'card'
+}
+
+
+class StubState:
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def roll(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random()
+
+
+def completion(content, prompt_tokens=850, completion_tokens=60):
+    return {
+        'id': 'stub',
+        'choices': [{'message': {'role': 'assistant', 'content': content}}],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+    }
+
+
+def make_handler(state, respond):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # Avoid Nagle/delayed-ACK stalls between headers and body on keep-alive connections
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with state.lock:
+                state.connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            roll = state.roll()
+            if state.latency:
+                time.sleep(state.latency)
+            if roll < state.rate_limit_rate:
+                self.send_json(429, {'error': 'rate limited'}, {'Retry-After': str(state.retry_after)})
+            elif roll < state.rate_limit_rate + state.error_rate:
+                self.send_json(503, {'error': 'upstream unavailable'})
+            else:
+                self.send_json(200, respond(payload))
+
+    return Handler
+
+
+def default_response(payload):
+    """One receipt per request, or an array keyed by file name for batched requests"""
+    content = payload.get('messages', [{}])[0].get('content')
+    parts = content if isinstance(content, list) else []
+    images = sum(1 for part in parts if part.get('type') == 'image_url')
+    filenames = [part['text'][len('File: '):] for part in parts
+                 if part.get('type') == 'text' and part['text'].startswith('File: ')]
+    if images > 1 and filenames:
+        receipts = [dict(RECEIPT, filename=filename) for filename in filenames]
+        return completion(json.dumps(receipts), prompt_tokens=150 + 700 * images, completion_tokens=60 * images)
+    return completion(json.dumps(RECEIPT))
+
+
+def start_stub_server(latency=0.0, error_rate=0.0, rate_limit_rate=0.0, port=0, respond=default_response, seed=None):
+    """Start the stub in a background thread, returns (server, state, url)"""
+    state = StubState(latency, error_rate, rate_limit_rate, seed=seed)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state, respond))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    return server, state, url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of 503 responses')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of 429 responses')
+    args = parser.parse_args()
+
+    server, state, url = start_stub_server(args.latency, args.error_rate, args.rate_limit_rate, args.port)
+    print(f"Stub OpenRouter listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
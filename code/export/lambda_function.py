@@ -0,0 +1,273 @@
+import io
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from boto3.dynamodb.types import TypeDeserializer
+from clients import lazy_client
+from metrics import Metrics, debug
+
+s3 = lazy_client('s3')
+metrics = Metrics('export')
+deserializer = TypeDeserializer()
+
+BUCKET_NAME = os.environ.get('BUCKET_NAME', 'checker-main-12')
+# Root of the receipts dataset, partitioned as user=/year=/month=
+EXPORT_PREFIX = os.environ.get('EXPORT_PREFIX', 'processed/receipts/')
+PARQUET_COMPRESSION = os.environ.get('PARQUET_COMPRESSION', 'snappy')
+# Files below this size are merged by compaction, which also aims for outputs of about this size
+COMPACT_TARGET_BYTES = int(os.environ.get('COMPACT_TARGET_BYTES', str(64 * 1024 * 1024)))
+# A partition is only compacted once it has this many small files
+COMPACT_MIN_FILES = int(os.environ.get('COMPACT_MIN_FILES', '4'))
+# Compaction stops starting new partitions this many seconds before the invocation times out
+COMPACT_MARGIN_SECONDS = float(os.environ.get('COMPACT_MARGIN_SECONDS', '30'))
+
+# Columns analytics reads, amounts and names normalized like the dashboard aggregates
+SCHEMA = pa.schema([
+    ('receipt_id', pa.string()),
+    ('message_id', pa.string()),
+    ('filename', pa.string()),
+    ('content_type', pa.string()),
+    ('file_size', pa.int64()),
+    ('processed_at', pa.timestamp('ms')),
+    ('merchant_name', pa.string()),
+    ('receipt_date', pa.date32()),
+    ('receipt_time', pa.string()),
+    ('total_amount', pa.float64()),
+    ('currency', pa.string()),
+    ('payment_method', pa.string()),
+    # Stream sequence number of the export, the highest one is the latest version of a receipt
+    ('sequence_number', pa.string())
+])
+
+
+def parse_amount(value):
+    """total_amount as float, None when the model returned something that isn't a number"""
+    try:
+        amount = Decimal(str(value).replace(',', '.').strip())
+    except Exception:
+        return None
+    return float(amount) if amount.is_finite() else None
+
+
+def parse_date(value):
+    value = str(value or '')
+    if not re.match(r'^\d{4}-\d{2}-\d{2}$', value):
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def parse_timestamp(value):
+    """processed_at is an ISO timestamp in UTC with a Z suffix"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def build_row(item, sequence_number=None):
+    """Parquet row of a processed receipt item"""
+    receipt_data = item.get('receipt_data') or {}
+    return {
+        'receipt_id': item['receipt_id'],
+        'message_id': item.get('message_id'),
+        'filename': item.get('filename'),
+        'content_type': item.get('content_type'),
+        'file_size': int(item.get('file_size') or 0),
+        'processed_at': parse_timestamp(item['processed_at']),
+        'merchant_name': str(receipt_data.get('merchant_name') or '').strip() or None,
+        'receipt_date': parse_date(receipt_data.get('date')),
+        'receipt_time': str(receipt_data.get('time') or '').strip() or None,
+        'total_amount': parse_amount(receipt_data.get('total_amount')),
+        'currency': str(receipt_data.get('currency') or '').strip().upper() or None,
+        'payment_method': str(receipt_data.get('payment_method') or '').strip().lower() or None,
+        'sequence_number': sequence_number
+    }
+
+
+def partition_prefix(email_from, row):
+    """Same month as the dashboard aggregates, the receipt date or else when it was processed"""
+    day = row['receipt_date'] or row['processed_at']
+    user = quote(email_from or 'unknown', safe='@.+-_')
+    return f"{EXPORT_PREFIX}user={user}/year={day.year}/month={day.month:02d}/"
+
+
+def write_table(key, table):
+    output = io.BytesIO()
+    pq.write_table(table, output, compression=PARQUET_COMPRESSION)
+    with metrics.timer('S3Write'):
+        s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=output.getvalue(), ContentType='application/vnd.apache.parquet')
+    metrics.count('ExportBytes', output.tell())
+    return output.tell()
+
+
+def export_records(records):
+    """
+    Append receipts of a DynamoDB stream batch, one Parquet file per partition.
+    File names come from the stream sequence numbers, so a retry of the
+    same batch overwrites its files. A retry that starts at a later record
+    exports some receipts again, compaction drops the older copies.
+    """
+    partitions = {}
+    for record in records:
+        if record.get('eventName') not in ('INSERT', 'MODIFY'):
+            continue
+        image = record.get('dynamodb', {}).get('NewImage')
+        if not image:
+            continue
+        item = {key: deserializer.deserialize(value) for key, value in image.items()}
+        if item.get('status') != 'processed' or not item.get('processed_at'):
+            continue
+        sequence = int(record['dynamodb']['SequenceNumber'])
+        try:
+            row = build_row(item, str(sequence))
+        except Exception as e:
+            print(f"Skipping receipt {item.get('receipt_id')}: {str(e)}")
+            continue
+        partitions.setdefault(partition_prefix(item.get('email_from'), row), []).append((sequence, row))
+
+    failed = []
+    for prefix, entries in partitions.items():
+        sequences = [sequence for sequence, row in entries]
+        key = f"{prefix}part-{min(sequences)}-{max(sequences)}.parquet"
+        try:
+            write_table(key, pa.Table.from_pylist([row for sequence, row in entries], schema=SCHEMA))
+        except Exception as e:
+            print(f"Failed to export {key}: {str(e)}")
+            failed.append(min(sequences))
+            continue
+        debug(f"Exported {len(entries)} receipts to {key}")
+        metrics.count('ExportedReceipts', len(entries))
+        metrics.count('ExportedFiles')
+
+    # The stream is retried from the oldest record that wasn't exported
+    if failed:
+        return {'batchItemFailures': [{'itemIdentifier': str(min(failed))}]}
+    return {'batchItemFailures': []}
+
+
+def list_partitions():
+    """{partition prefix: [(key, size)]} of every file in the dataset"""
+    partitions = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=EXPORT_PREFIX):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.parquet'):
+                prefix = obj['Key'].rsplit('/', 1)[0] + '/'
+                partitions.setdefault(prefix, []).append((obj['Key'], obj['Size']))
+    return partitions
+
+
+def plan_compaction(files):
+    """Groups of small files merged into one output of about COMPACT_TARGET_BYTES"""
+    groups = []
+    group, group_bytes = [], 0
+    for key, size in sorted(files):
+        if size >= COMPACT_TARGET_BYTES:
+            continue
+        if group and group_bytes + size > COMPACT_TARGET_BYTES:
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(key)
+        group_bytes += size
+    groups.append(group)
+    return [group for group in groups if len(group) >= COMPACT_MIN_FILES]
+
+
+def read_rows(key, columns=None):
+    body = s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+    # Files written before a column existed read it as null
+    return pq.read_table(io.BytesIO(body), schema=SCHEMA, columns=columns).to_pylist()
+
+
+def sequence_of(row):
+    """Stream sequence number of a row, files without one count as the oldest"""
+    return int(row['sequence_number'] or 0)
+
+
+def compact_files(prefix, keys, others=()):
+    """
+    Merge files of a partition into one, dropping receipts exported twice.
+    A retried stream batch can export a receipt again in a file of another
+    group, so the receipt ids of the rest of the partition (others) are read
+    too: a row is dropped when another file holds the same or a later export.
+    Inputs are deleted only after the output is written, a failed run
+    leaves duplicates that the next compaction removes.
+    Returns the key and size of the merged file, None when nothing is left.
+    """
+    latest = {}
+    for key in others:
+        for row in read_rows(key, columns=['receipt_id', 'sequence_number']):
+            latest[row['receipt_id']] = max(latest.get(row['receipt_id'], -1), sequence_of(row))
+
+    # Latest export of a receipt wins, rows end up ordered by processing time
+    rows = {}
+    for key in keys:
+        for row in read_rows(key):
+            current = rows.get(row['receipt_id'])
+            if current is None or (sequence_of(row), row['processed_at']) >= (sequence_of(current), current['processed_at']):
+                rows[row['receipt_id']] = row
+    rows = [
+        row for row in sorted(rows.values(), key=lambda row: row['processed_at'])
+        if sequence_of(row) > latest.get(row['receipt_id'], -1)
+    ]
+
+    output = None
+    if rows:
+        key = f"{prefix}compacted-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        output = (key, write_table(key, pa.Table.from_pylist(rows, schema=SCHEMA)))
+
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
+        )
+    print(f"Compacted {len(keys)} files into {output[0] if output else 'nothing'} ({len(rows)} receipts)")
+    metrics.count('CompactedFiles', len(keys))
+    return output
+
+
+def compact(context):
+    """Merge the small files every partition accumulates from stream batches"""
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - COMPACT_MARGIN_SECONDS
+    else:
+        deadline = None
+
+    compacted = 0
+    for prefix, files in sorted(list_partitions().items()):
+        for keys in plan_compaction(files):
+            if deadline is not None and time.monotonic() >= deadline:
+                print("Compaction stopped before the timeout, the next run continues")
+                return {'compacted_groups': compacted, 'complete': False}
+            others = [key for key, size in files if key not in keys]
+            try:
+                with metrics.timer('Compact'):
+                    output = compact_files(prefix, keys, others)
+            except Exception as e:
+                print(f"Failed to compact {prefix}: {str(e)}")
+                continue
+            compacted += 1
+            # Later groups of the partition dedupe against the merged file
+            files = [(key, size) for key, size in files if key not in keys] + ([output] if output else [])
+    return {'compacted_groups': compacted, 'complete': True}
+
+
+def lambda_handler(event, context):
+    """
+    Export processed receipts to the Parquet dataset under EXPORT_PREFIX.
+    DynamoDB stream batches are appended, scheduled invocations compact.
+    """
+    metrics.begin(context)
+    try:
+        if event.get('Records'):
+            return export_records(event['Records'])
+        return compact(context)
+    finally:
+        metrics.flush()
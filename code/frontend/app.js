@@ -2,6 +2,8 @@
 const CONFIG = window.APP_CONFIG;
 console.log(`Using API Endpoint: ${CONFIG.apiEndpoint}`);
 
+const RECEIPTS_PAGE_SIZE = 50;
+
 // ==================== COGNITO SETUP ====================
 const poolData = {
     UserPoolId: CONFIG.userPoolId,
@@ -16,7 +18,11 @@ let jwtToken = null;
 let spendingChart = null;
 let merchantsChart = null;
 let currentReceiptsData = [];
+let currentAnalytics = null;
 let currentChartType = 'doughnut';
+// Last response per URL with its ETag, replayed when the API answers 304 Not Modified
+const responseCache = new Map();
+const RESPONSE_CACHE_SIZE = 50;
 
 // ==================== DOM ELEMENTS ====================
 const elements = {
@@ -212,6 +218,8 @@ function signOut() {
         cognitoUser.signOut();
     }
     jwtToken = null;
+    responseCache.clear();
+    currentReceiptsData = [];
     elements.authSection.style.display = 'block';
     elements.appSection.style.display = 'none';
     showSignIn();
@@ -239,6 +247,72 @@ function updateUIForAuthenticatedUser(email) {
 }
 
 // ==================== DATA FETCHING & ANALYTICS ====================
+async function apiGet(path, params) {
+    const query = params ? `?${new URLSearchParams(params)}` : '';
+    const url = `${CONFIG.apiEndpoint}${path}${query}`;
+    const cached = responseCache.get(url);
+    const headers = {
+        'Authorization': `Bearer ${jwtToken}`,
+        'Content-Type': 'application/json'
+    };
+    if (cached) headers['If-None-Match'] = cached.etag;
+    const response = await fetch(url, { method: 'GET', headers });
+
+    if (response.status === 401) {
+        // Token expired, sign out
+        showToast('Session expired. Please sign in again.', 'error');
+        setTimeout(signOut, 3000);
+        return null;
+    }
+
+    // Nothing changed since the cached response
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+
+    // No receipts yet
+    if (response.status === 404) {
+        return { items: [], next_token: null };
+    }
+
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        responseCache.delete(url);
+        responseCache.set(url, { etag, data });
+        if (responseCache.size > RESPONSE_CACHE_SIZE) {
+            responseCache.delete(responseCache.keys().next().value);
+        }
+    }
+    return data;
+}
+
+async function fetchReceiptPage(nextToken, since) {
+    const params = { limit: RECEIPTS_PAGE_SIZE };
+    if (nextToken) params.next_token = nextToken;
+    if (since) params.since = since;
+    const data = await apiGet('/api', params);
+    if (!data) return null;
+    return { items: data.items || [], next_token: data.next_token };
+}
+
+// Receipts are returned page by page, follow next_token until the end
+async function fetchAllReceipts() {
+    const receipts = [];
+    let nextToken = null;
+    do {
+        const page = await fetchReceiptPage(nextToken);
+        if (!page) return null;
+        receipts.push(...page.items);
+        nextToken = page.next_token;
+    } while (nextToken);
+    return receipts;
+}
+
 async function fetchReceipts() {
     if (!jwtToken) {
         showToast('Please sign in first', 'error');
@@ -249,30 +323,34 @@ async function fetchReceipts() {
     updateApiStatus('Fetching...', 'warning');
 
     try {
-        const response = await fetch(CONFIG.apiEndpoint + '/api', {
-            method: 'GET',
-            headers: {
-                'Authorization': `Bearer ${jwtToken}`,
-                'Content-Type': 'application/json'
+        // Totals come precomputed, only the latest page of receipts is listed.
+        // After the first load only receipts newer than the listed ones are fetched.
+        const since = currentReceiptsData.length ? currentReceiptsData[0].processed_at : null;
+        const previousCount = currentAnalytics?.summary?.receipt_count ?? 0;
+        const [analytics, page] = await Promise.all([
+            apiGet('/api/analytics'),
+            fetchReceiptPage(null, since)
+        ]);
+        if (!analytics || !page) return;
+
+        let receipts = page.items;
+        if (since) {
+            receipts = [...page.items, ...currentReceiptsData].slice(0, RECEIPTS_PAGE_SIZE);
+            // More new receipts than one page, or one committed late with an older timestamp
+            // (the totals don't add up): start over from the latest page
+            const expectedCount = previousCount + page.items.length;
+            if (page.next_token || expectedCount !== analytics.analytics.summary.receipt_count) {
+                const latest = await fetchReceiptPage(null);
+                if (!latest) return;
+                receipts = latest.items;
             }
-        });
-
-        if (response.status === 401) {
-            // Token expired, sign out
-            showToast('Session expired. Please sign in again.', 'error');
-            setTimeout(signOut, 3000);
-            return;
         }
 
-        if (!response.ok) {
-            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-        }
-
-        const data = await response.json();
-        currentReceiptsData = data.items || [];
+        currentAnalytics = analytics.analytics;
+        currentReceiptsData = receipts;
         
         // Process and display analytics
-        processAnalyticsData(currentReceiptsData);
+        processAnalyticsData(currentAnalytics, currentReceiptsData);
         updateApiStatus('Connected', 'success');
         updateLastUpdate();
         showToast('Data loaded successfully!', 'success');
@@ -326,38 +404,36 @@ function updateLastUpdate() {
     elements.lastUpdate.textContent = `Last updated: ${dateString} ${timeString}`;
 }
 
-function processAnalyticsData(receipts) {
-    if (!receipts || receipts.length === 0) {
+function processAnalyticsData(analytics, receipts) {
+    const summary = analytics?.summary;
+    if (!summary || !summary.receipt_count) {
         resetAnalyticsUI();
+        // The listing doesn't depend on the totals, show what was loaded
+        if (receipts && receipts.length) {
+            updateRecentReceipts(receipts);
+            updateDataFreshness(receipts);
+        }
         return;
     }
     
     // Update summary cards
-    elements.totalReceipts.textContent = receipts.length;
-    elements.dataCount.textContent = `${receipts.length} receipts processed`;
+    const receiptCount = summary.receipt_count;
+    elements.totalReceipts.textContent = receiptCount;
+    elements.dataCount.textContent = `${receiptCount} receipts processed`;
     
-    // Calculate total amount
-    const totalAmount = receipts.reduce((sum, receipt) => {
-        return sum + (parseFloat(receipt.receipt_data?.total_amount) || 0);
-    }, 0);
+    // Total amount
+    const totalAmount = summary.total_amount || 0;
     elements.totalAmount.textContent = `$${totalAmount.toFixed(2)}`;
     
     // Calculate average amount
-    const avgAmount = receipts.length > 0 ? totalAmount / receipts.length : 0;
+    const avgAmount = receiptCount > 0 ? totalAmount / receiptCount : 0;
     elements.avgAmount.textContent = `$${avgAmount.toFixed(2)}`;
     
-    // Count unique merchants
-    const uniqueMerchants = new Set(
-        receipts
-            .map(r => r.receipt_data?.merchant_name)
-            .filter(Boolean)
-            .map(name => name.trim())
-    );
-    elements.uniqueMerchants.textContent = uniqueMerchants.size;
-    
-    // Calculate storage used
-    const totalStorage = receipts.reduce((sum, receipt) => sum + (receipt.file_size || 0), 0);
-    const storageMB = (totalStorage / (1024 * 1024)).toFixed(2);
+    // Unique merchants
+    elements.uniqueMerchants.textContent = analytics.merchants.filter(m => m.name !== 'Unknown').length;
+    
+    // Storage used
+    const storageMB = ((summary.file_size || 0) / (1024 * 1024)).toFixed(2);
     elements.storageUsed.textContent = `${storageMB} MB`;
     
     // Update storage indicator
@@ -372,7 +448,7 @@ function processAnalyticsData(receipts) {
     }
     
     // Update payment methods
-    updatePaymentMethods(receipts);
+    updatePaymentMethods(analytics.payment_methods, receiptCount);
     
     // Update recent receipts
     updateRecentReceipts(receipts);
@@ -381,7 +457,7 @@ function processAnalyticsData(receipts) {
     updateDataFreshness(receipts);
     
     // Update charts
-    updateCharts(receipts);
+    updateCharts(analytics);
 }
 
 function resetAnalyticsUI() {
@@ -427,7 +503,7 @@ function resetAnalyticsUI() {
     }
 }
 
-function updatePaymentMethods(receipts) {
+function updatePaymentMethods(paymentMethods, receiptCount) {
     const methods = {
         cash: 0,
         card: 0,
@@ -437,20 +513,20 @@ function updatePaymentMethods(receipts) {
         other: 0
     };
     
-    receipts.forEach(receipt => {
-        const method = (receipt.receipt_data?.payment_method || 'other').toLowerCase();
+    paymentMethods.forEach(entry => {
+        const method = (entry.name || 'other').toLowerCase();
         if (method.includes('cash')) {
-            methods.cash++;
+            methods.cash += entry.receipt_count;
         } else if (method.includes('card') || method.includes('credit') || method.includes('debit')) {
-            methods.card++;
+            methods.card += entry.receipt_count;
         } else if (method.includes('digital') || method.includes('online') || method.includes('mobile')) {
-            methods.digital++;
+            methods.digital += entry.receipt_count;
         } else {
-            methods.other++;
+            methods.other += entry.receipt_count;
         }
     });
     
-    const total = receipts.length || 1;
+    const total = receiptCount || 1;
     
     // Update cash
     const cashPercent = Math.round((methods.cash / total) * 100);
@@ -568,27 +644,18 @@ function updateDataFreshness(receipts) {
     }
 }
 
-function updateCharts(receipts) {
+function updateCharts(analytics) {
     // Destroy existing charts
     if (spendingChart) spendingChart.destroy();
     if (merchantsChart) merchantsChart.destroy();
     
-    // Prepare data for spending chart
+    // Monthly totals come sorted by month (YYYY-MM)
     const monthlyData = {};
-    receipts.forEach(receipt => {
-        if (receipt.receipt_data?.date) {
-            const date = new Date(receipt.receipt_data.date);
-            const monthYear = date.toLocaleDateString('en-US', { month: 'short', year: '2-digit' });
-            const amount = parseFloat(receipt.receipt_data.total_amount) || 0;
-            monthlyData[monthYear] = (monthlyData[monthYear] || 0) + amount;
-        }
-    });
-    
-    // Sort by date
-    const sortedMonths = Object.keys(monthlyData).sort((a, b) => {
-        const dateA = new Date(a);
-        const dateB = new Date(b);
-        return dateA - dateB;
+    const sortedMonths = analytics.months.map(entry => {
+        const date = new Date(`${entry.name}-01T00:00:00`);
+        const monthYear = date.toLocaleDateString('en-US', { month: 'short', year: '2-digit' });
+        monthlyData[monthYear] = entry.total_amount;
+        return monthYear;
     });
     
     // Take last 6 months by default
@@ -599,18 +666,10 @@ function updateCharts(receipts) {
         displayMonths = sortedMonths.slice(-monthsToShow);
     }
     
-    // Prepare data for merchants chart
-    const merchantData = {};
-    receipts.forEach(receipt => {
-        const merchant = receipt.receipt_data?.merchant_name || 'Unknown';
-        const amount = parseFloat(receipt.receipt_data?.total_amount) || 0;
-        merchantData[merchant] = (merchantData[merchant] || 0) + amount;
-    });
-    
-    // Sort merchants by total amount and take top 5
-    const sortedMerchants = Object.entries(merchantData)
-        .sort((a, b) => b[1] - a[1])
-        .slice(0, 5);
+    // Merchants come sorted by total amount, take top 5
+    const sortedMerchants = analytics.merchants
+        .slice(0, 5)
+        .map(entry => [entry.name, entry.total_amount]);
     
     // Create spending chart
     const spendingCtx = document.getElementById('spendingChart').getContext('2d');
@@ -735,15 +794,15 @@ function updateCharts(receipts) {
 
 // ==================== CHART CONTROLS ====================
 function updateTimeRange() {
-    if (currentReceiptsData.length > 0) {
-        updateCharts(currentReceiptsData);
+    if (currentAnalytics?.summary?.receipt_count) {
+        updateCharts(currentAnalytics);
     }
 }
 
 function toggleChartView() {
     currentChartType = currentChartType === 'doughnut' ? 'pie' : 'doughnut';
-    if (currentReceiptsData.length > 0) {
-        updateCharts(currentReceiptsData);
+    if (currentAnalytics?.summary?.receipt_count) {
+        updateCharts(currentAnalytics);
     }
 }
 
@@ -811,17 +870,27 @@ function showAllReceipts() {
     document.head.appendChild(style);
 }
 
-function exportData() {
+async function exportData() {
     if (currentReceiptsData.length === 0) {
         showToast('No data to export', 'warning');
         return;
     }
     
+    // The dashboard only holds the latest page, export needs the full history
+    let receipts;
+    try {
+        receipts = await fetchAllReceipts();
+    } catch (error) {
+        showToast('API Error: ' + error.message, 'error');
+        return;
+    }
+    if (!receipts) return;
+    
     // Convert to CSV
     const headers = ['Date', 'Merchant', 'Amount', 'Currency', 'Payment Method', 'Email From'];
     const csvRows = [
         headers.join(','),
-        ...currentReceiptsData.map(receipt => [
+        ...receipts.map(receipt => [
             receipt.receipt_data?.date || '',
             `"${(receipt.receipt_data?.merchant_name || '').replace(/"/g, '""')}"`,
             receipt.receipt_data?.total_amount || 0,
@@ -844,7 +913,7 @@ function exportData() {
     link.click();
     document.body.removeChild(link);
     
-    showToast(`Exported ${currentReceiptsData.length} receipts as CSV`, 'success');
+    showToast(`Exported ${receipts.length} receipts as CSV`, 'success');
 }
 
 // ==================== AUTO-CHECK AUTH ON LOAD ====================
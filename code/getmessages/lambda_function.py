@@ -1,49 +1,269 @@
 import json
-import boto3
-from boto3.dynamodb.conditions import Key
+import base64
+import hashlib
+import time
 from botocore.exceptions import ClientError
+from datetime import datetime, timezone
 from decimal import Decimal
+from email.utils import format_datetime
 import os
 import logging
+from aggregates import summarize
+from clients import lazy_client
+from json_encoding import dumps
+from metrics import LOG_LEVEL, Metrics
 
 # Configure logging
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
+metrics = Metrics('getmessages')
 
-# Initialize DynamoDB
+# Initialize DynamoDB, the low-level client skips loading the resource model on cold start
 table_name = os.environ.get('TABLE_NAME', 'receipts-table')
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(table_name)
-
-# Helper: convert Decimal to float for JSON
-def decimal_to_float(obj):
-    if isinstance(obj, list):
-        return [decimal_to_float(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: decimal_to_float(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return float(obj)
-    else:
-        return obj
+index_name = os.environ.get('INDEX_NAME', 'email_from-processed_at-index')
+aggregates_table_name = os.environ.get('AGGREGATES_TABLE_NAME', 'user-aggregates')
+dynamodb = lazy_client('dynamodb')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+# Responses are only given validators once the user's data is this old, the GSI may lag behind the version
+VERSION_SETTLE_SECONDS = int(os.environ.get('VERSION_SETTLE_SECONDS', '5'))
+# Part of every ETag, bump it when the response format changes
+RESPONSE_FORMAT = '1'
+# Only the attributes the frontend renders are read and returned
+PROJECTED_FIELDS = ['receipt_id', 'filename', 'email_from', 'processed_at', 'file_size', 'receipt_data']
+
+class BadRequest(Exception):
+    pass
+
+# Helper: DynamoDB attribute values to Python, numbers stay Decimal like boto3's TypeDeserializer
+def deserialize(value):
+    for tag, data in value.items():
+        return DESERIALIZERS[tag](data)
+
+DESERIALIZERS = {
+    'S': str,
+    'N': Decimal,
+    'BOOL': bool,
+    'NULL': lambda data: None,
+    'M': lambda data: {key: deserialize(value) for key, value in data.items()},
+    'L': lambda data: [deserialize(value) for value in data],
+    'SS': list,
+    'NS': lambda data: [Decimal(number) for number in data],
+    'B': bytes,
+    'BS': list
+}
+
+def deserialize_item(item):
+    return {key: deserialize(value) for key, value in item.items()}
+
+# Helper: opaque pagination cursor from DynamoDB LastEvaluatedKey
+def encode_token(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    raw = dumps(last_evaluated_key, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_token(token, email):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise BadRequest('Invalid next_token')
+    # A cursor can only continue a listing of the caller's own receipts
+    if not isinstance(key, dict) or key.get('email_from') != email:
+        raise BadRequest('Invalid next_token')
+    # Keys of the table and index are all strings
+    if not all(isinstance(value, str) for value in key.values()):
+        raise BadRequest('Invalid next_token')
+    return {name: {'S': value} for name, value in key.items()}
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise BadRequest('limit must be an integer')
+    if limit < 1:
+        raise BadRequest('limit must be positive')
+    return min(limit, MAX_LIMIT)
+
+def build_key_condition(email, date_from, date_to, since=None):
+    """
+    Key condition expression and values on the processed_at sort key, dates are ISO 8601 prefixes.
+    since is an exclusive processed_at lower bound for fetching only newer receipts.
+    Uses the #email_from and #processed_at attribute names.
+    """
+    expression = '#email_from = :email'
+    values = {':email': {'S': email}}
+    if since:
+        if date_from or date_to:
+            raise BadRequest('since cannot be combined with from/to')
+        values[':since'] = {'S': since}
+        return expression + ' AND #processed_at > :since', values
+    if date_from:
+        values[':from'] = {'S': date_from}
+    if date_to:
+        # Upper bound is inclusive for the whole day/prefix given
+        values[':to'] = {'S': date_to + '\uffff'}
+    if date_from and date_to:
+        expression += ' AND #processed_at BETWEEN :from AND :to'
+    elif date_from:
+        expression += ' AND #processed_at >= :from'
+    elif date_to:
+        expression += ' AND #processed_at <= :to'
+    return expression, values
+
+# Helper: per-user data version, the summary aggregate changes with every receipt processed
+def get_version(email):
+    try:
+        response = dynamodb.get_item(
+            TableName=aggregates_table_name,
+            Key={'email_from': {'S': email}, 'aggregate_key': {'S': 'summary'}},
+            ProjectionExpression='receipt_count, updated_at',
+            ConsistentRead=True
+        )
+    except ClientError as e:
+        # Without a version responses are just not cacheable
+        logger.warning(f"Version lookup failed: {e.response['Error']['Message']}")
+        return None
+    item = deserialize_item(response.get('Item', {}))
+    return str(item.get('receipt_count', 0)), item.get('updated_at')
+
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+# Helper: ETag/Last-Modified of a response, None while the data is too fresh to be cached
+def make_validators(email, version, resource, params):
+    if version is None:
+        return None
+    receipt_count, updated_at = version
+    last_modified = parse_timestamp(updated_at)
+    if last_modified and time.time() - last_modified.timestamp() < VERSION_SETTLE_SECONDS:
+        return None
+    key = json.dumps([RESPONSE_FORMAT, email, resource, sorted(params.items()), receipt_count, updated_at])
+    validators = {
+        'ETag': '"%s"' % hashlib.sha256(key.encode('utf-8')).hexdigest()[:32],
+        'Cache-Control': 'private, no-cache'
+    }
+    if last_modified:
+        validators['Last-Modified'] = format_datetime(last_modified, usegmt=True)
+    return validators
+
+def get_header(event, name):
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+# Helper: every item of a query, following LastEvaluatedKey
+def query_all(query):
+    items = []
+    while True:
+        with metrics.timer('Query'):
+            response = dynamodb.query(**query)
+        items.extend(deserialize_item(item) for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+# Helper: aggregates computed from the user's receipts, for receipts stored before aggregates existed
+def summarize_receipts(email):
+    receipts = query_all({
+        'TableName': table_name,
+        'IndexName': index_name,
+        'KeyConditionExpression': '#email_from = :email',
+        'ProjectionExpression': '#receipt_data, #file_size, #processed_at',
+        'ExpressionAttributeNames': {
+            '#email_from': 'email_from',
+            '#receipt_data': 'receipt_data',
+            '#file_size': 'file_size',
+            '#processed_at': 'processed_at'
+        },
+        'ExpressionAttributeValues': {':email': {'S': email}}
+    })
+    metrics.count('AggregateFallbacks')
+    return [dict(totals, aggregate_key=aggregate_key) for aggregate_key, totals in summarize(receipts).items()]
+
+# Helper: per-user aggregates maintained by the processing lambda
+def get_analytics(email):
+    items = query_all({
+        'TableName': aggregates_table_name,
+        'KeyConditionExpression': 'email_from = :email',
+        'ExpressionAttributeValues': {':email': {'S': email}}
+    })
+    if not items:
+        # Not backfilled yet (scripts/backfill_aggregates.py)
+        items = summarize_receipts(email)
+
+    analytics = {
+        'summary': {'receipt_count': 0, 'total_amount': 0, 'file_size': 0, 'updated_at': None},
+        'months': [],
+        'merchants': [],
+        'currencies': [],
+        'payment_methods': []
+    }
+    groups = {'month': 'months', 'merchant': 'merchants', 'currency': 'currencies', 'payment': 'payment_methods'}
+    for item in items:
+        entry = {
+            'receipt_count': item.get('receipt_count', 0),
+            'total_amount': item.get('total_amount', 0),
+            'file_size': item.get('file_size', 0),
+            'updated_at': item.get('updated_at')
+        }
+        kind, _, name = item['aggregate_key'].partition('#')
+        if kind == 'summary':
+            analytics['summary'] = entry
+        elif kind in groups:
+            entry['name'] = name
+            analytics[groups[kind]].append(entry)
+
+    # Months chronologically, everything else by spend
+    analytics['months'].sort(key=lambda entry: entry['name'])
+    for group in ('merchants', 'currencies', 'payment_methods'):
+        analytics[group].sort(key=lambda entry: entry['total_amount'], reverse=True)
+    return analytics
 
 # Helper: CORS response
-def cors_response(status_code, body):
+def cors_response(status_code, body, headers=None):
     return {
         'statusCode': status_code,
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With',
+            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With,If-None-Match',
             'Access-Control-Allow-Methods': 'GET,OPTIONS,POST,PUT,DELETE',
             'Access-Control-Allow-Credentials': 'true',
-            'Access-Control-Max-Age': '86400'
+            'Access-Control-Expose-Headers': 'ETag,Last-Modified',
+            'Access-Control-Max-Age': '86400',
+            **(headers or {})
         },
-        'body': json.dumps(body)
+        # Decimals from DynamoDB are encoded as floats in the same pass
+        'body': '' if body is None else dumps(body)
     }
 
 # Main handler
 def lambda_handler(event, context):
-    logger.info("Event: %s", json.dumps(event))
+    metrics.begin(context)
+    try:
+        return handle_request(event)
+    finally:
+        metrics.flush()
+
+def handle_request(event):
+    logger.debug("Event: %s", json.dumps(event))
     
     # Handle OPTIONS request
     if event.get('httpMethod') == 'OPTIONS':
@@ -51,7 +271,7 @@ def lambda_handler(event, context):
 
     try:
         # Debug print for Cognito identity
-        logger.info("RequestContext: %s", json.dumps(event.get('requestContext', {})))
+        logger.debug("RequestContext: %s", json.dumps(event.get('requestContext', {})))
 
         # Try to get email from Cognito authorizer claims
         email = None
@@ -68,38 +288,85 @@ def lambda_handler(event, context):
         if not email:
             return cors_response(400, {'error': 'Email is required or user must be authenticated'})
 
+        params = event.get('queryStringParameters') or {}
+        resource = event.get('resource') or event.get('path') or ''
+
+        # Unchanged data is answered from the version item alone, without querying the index
+        with metrics.timer('Version'):
+            validators = make_validators(email, get_version(email), resource, params)
+        if validators and etag_matches(get_header(event, 'If-None-Match'), validators['ETag']):
+            metrics.count('NotModified')
+            return cors_response(304, None, validators)
+
+        # Dashboard totals are served from precomputed aggregates
+        if resource.endswith('/analytics'):
+            logger.info(f"Querying analytics for email: {email}")
+            analytics = get_analytics(email)
+            with metrics.timer('Serialize'):
+                return cors_response(200, {
+                    'message': 'Analytics retrieved successfully',
+                    'analytics': analytics
+                }, validators)
+
+        limit = parse_limit(params.get('limit'))
+        next_token = params.get('next_token')
+        since = params.get('since')
+
         logger.info(f"Querying messages for email: {email}")
 
-        # Query DynamoDB using GSI 'email_from-index'
-        response = table.query(
-            IndexName='email_from-index',
-            KeyConditionExpression=Key('email_from').eq(email),
-            ScanIndexForward=False
-        )
+        # Query DynamoDB using GSI sorted by processing time, newest first
+        key_condition, values = build_key_condition(email, params.get('from'), params.get('to'), since)
+        names = {f'#f{i}': field for i, field in enumerate(PROJECTED_FIELDS)}
+        names.update({'#email_from': 'email_from', '#processed_at': 'processed_at'})
+        query = {
+            'TableName': table_name,
+            'IndexName': index_name,
+            'KeyConditionExpression': key_condition,
+            'ProjectionExpression': ', '.join(f'#f{i}' for i in range(len(PROJECTED_FIELDS))),
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+            'ScanIndexForward': False,
+            'Limit': limit
+        }
+        if next_token:
+            query['ExclusiveStartKey'] = decode_token(next_token, email)
 
-        items = decimal_to_float(response.get('Items', []))
+        with metrics.timer('Query'):
+            response = dynamodb.query(**query)
+
+        items = [deserialize_item(item) for item in response.get('Items', [])]
         count = response.get('Count', 0)
+        last_key = response.get('LastEvaluatedKey')
+        new_token = encode_token(deserialize_item(last_key) if last_key else None)
+        metrics.count('Items', count)
 
-        if count == 0:
+        if count == 0 and not next_token and not new_token and not since:
             return cors_response(404, {
                 'message': f'No messages found for email: {email}',
                 'count': 0,
-                'items': []
+                'items': [],
+                'next_token': None
             })
 
-        return cors_response(200, {
-            'message': 'Messages retrieved successfully',
-            'count': count,
-            'items': items
-        })
+        with metrics.timer('Serialize'):
+            return cors_response(200, {
+                'message': 'Messages retrieved successfully',
+                'count': count,
+                'items': items,
+                'next_token': new_token
+            }, validators)
 
+    except BadRequest as e:
+        return cors_response(400, {'error': str(e)})
     except ClientError as e:
+        metrics.count('Errors')
         logger.error(f"DynamoDB ClientError: {e.response['Error']['Message']}")
         return cors_response(500, {
             'error': 'Database error',
             'details': e.response['Error']['Message']
         })
     except Exception as e:
+        metrics.count('Errors')
         logger.error(f"Unexpected error: {str(e)}")
         return cors_response(500, {
             'error': 'Internal server error',
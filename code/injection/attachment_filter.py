@@ -0,0 +1,149 @@
+import hashlib
+import os
+import re
+import struct
+from urllib.parse import unquote
+
+# Images below this size are logos, icons or tracking pixels rather than receipts
+MIN_IMAGE_BYTES = int(os.environ.get('MIN_IMAGE_BYTES', '5120'))
+# Images whose shorter side is below this many pixels are skipped too
+MIN_IMAGE_SIDE = int(os.environ.get('MIN_IMAGE_SIDE', '150'))
+# Leading bytes kept per part to read image dimensions, JPEG EXIF blocks can be large
+HEADER_BYTES = 64 * 1024
+
+CID_PATTERN = re.compile(rb'cid:([^\s"\'<>()]+)', re.IGNORECASE)
+
+
+def normalize_cid(value):
+    return unquote(value.strip().strip('<>')).lower()
+
+
+class CidCollector:
+    """Sink for HTML bodies that only records the cid: references of embedded images"""
+
+    def __init__(self, references):
+        self.references = references
+        self.tail = b''
+
+    def write(self, data):
+        data = self.tail + data
+        for match in CID_PATTERN.finditer(data):
+            self.references.add(normalize_cid(match.group(1).decode('ascii', 'replace')))
+        # A reference may be split across writes
+        self.tail = data[-256:]
+
+    def close(self):
+        self.tail = b''
+
+    def abort(self):
+        self.tail = b''
+
+
+class PartInspector:
+    """
+    Sink wrapper hashing a part and keeping its leading bytes while it streams to S3,
+    so cheap checks can run once the whole email has been read.
+    """
+
+    def __init__(self, sink, part):
+        self.sink = sink
+        self.hash = hashlib.sha256()
+        self.header = bytearray()
+        content_id = part.get('Content-ID')
+        self.content_id = normalize_cid(str(content_id)) if content_id else None
+        self.disposition = part.get_content_disposition()
+
+    def write(self, data):
+        if not data:
+            return
+        self.hash.update(data)
+        if len(self.header) < HEADER_BYTES:
+            self.header += data[:HEADER_BYTES - len(self.header)]
+        self.sink.write(data)
+
+    def close(self):
+        self.sink.close()
+
+    def abort(self):
+        self.sink.abort()
+
+    def digest(self):
+        return self.hash.hexdigest()
+
+
+def jpeg_dimensions(data):
+    # Walk the segments up to the first start-of-frame marker
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            return width, height
+        position += 2 + length
+    return None
+
+
+def webp_dimensions(data):
+    chunk = data[12:16]
+    if chunk == b'VP8X' and len(data) >= 30:
+        return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    return None
+
+
+def image_dimensions(data):
+    """(width, height) from the leading bytes of a PNG, GIF, JPEG, WEBP or BMP image, None if unknown"""
+    data = bytes(data)
+    try:
+        if data.startswith(b'\x89PNG\r\n\x1a\n') and len(data) >= 24:
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+            return struct.unpack('<HH', data[6:10])
+        if data.startswith(b'\xff\xd8'):
+            return jpeg_dimensions(data)
+        if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+            return webp_dimensions(data)
+        if data.startswith(b'BM') and len(data) >= 26:
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+    except struct.error:
+        pass
+    return None
+
+
+def skip_reason(inspector, content_type, size, seen_digests, cid_references):
+    """
+    Why a part should not be sent to the model, None for plausible receipts.
+    Identical parts are skipped after the first, images only when they are
+    embedded inline in the HTML body, tiny, or too small in pixels to be a
+    receipt. Some mail clients send photos with a Content-ID but without a
+    Content-Disposition, those are kept.
+    """
+    digest = inspector.digest()
+    if digest in seen_digests:
+        return 'duplicate'
+    seen_digests.add(digest)
+    if not content_type.startswith('image/'):
+        return None
+    if inspector.content_id and inspector.disposition == 'inline' and inspector.content_id in cid_references:
+        return 'inline'
+    if size < MIN_IMAGE_BYTES:
+        return 'tiny'
+    dimensions = image_dimensions(inspector.header)
+    if dimensions and min(dimensions) < MIN_IMAGE_SIDE:
+        return 'small'
+    return None
@@ -1,16 +1,28 @@
 import json
-import boto3
-import email
-from email import policy
 import os
 import re
+import base64
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from email.utils import parseaddr
+from attachment_filter import CidCollector, PartInspector, skip_reason
+from attachments import is_pdf, unique_filename
+from clients import lazy_client
+from metrics import Metrics, debug
+from mime_stream import READ_CHUNK_SIZE, S3StreamUploader, stream_attachments
 
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
+s3 = lazy_client('s3')
+sqs = lazy_client('sqs')
+metrics = Metrics('injection')
 
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'checker-main-12')
 PROCESSING_QUEUE_URL = os.environ.get('PROCESSING_QUEUE_URL')
+# Number of emails of one SQS batch injected in parallel
+INJECTION_WORKERS = int(os.environ.get('INJECTION_WORKERS', '4'))
+# Images and PDFs up to this size are carried compressed inside the processing queue message, 0 disables it
+INLINE_MAX_BYTES = int(os.environ.get('INLINE_MAX_BYTES', str(192 * 1024)))
+# Processing message size budget, the queue accepts at most 1 MiB including attributes
+INLINE_MESSAGE_BUDGET = int(os.environ.get('INLINE_MESSAGE_BUDGET', str(900 * 1024)))
 
 
 def parse_email_from(email_string):
@@ -45,141 +57,208 @@ def parse_email_from(email_string):
             return "", email_match.group(0).lower()
         return "", email_string
 
+def inline_attachments(processing_message, uploads):
+    """
+    Embed small images and PDFs compressed into the processing message while it fits the budget.
+    S3 keeps the durable copy, larger images are still downloaded by processing.
+    """
+    size = len(json.dumps(processing_message))
+    for attachment, upload in sorted(zip(processing_message['attachments'], uploads), key=lambda pair: pair[1].size):
+        if upload.data is None:
+            continue
+        inline = base64.b64encode(zlib.compress(upload.data)).decode('ascii')
+        # Encoded field plus its key and separators
+        if size + len(inline) + 16 > INLINE_MESSAGE_BUDGET:
+            break
+        attachment['inline'] = inline
+        size += len(inline) + 16
+    return size
+
+def inject_record(record):
+    """
+    Extract files from a single SQS record and inject them into S3
+    """
+    # Parse SQS message body
+    body = json.loads(record['body'])
+    
+    # Extract message metadata
+    message_id = body['mail']['messageId']
+    object_key = body['receipt']['action']['objectKey']
+    
+    print(f"Processing message: {message_id}")
+    debug(f"S3 object key: {object_key}")
+    
+    # Stream the raw email from S3, uploading attachments while they are decoded
+    uploads = []
+    cid_references = set()
+    filenames = set()
+    
+    def open_upload(part):
+        # HTML bodies are only scanned for the cid: references of embedded images
+        if part.get_content_type() == 'text/html':
+            return CidCollector(cid_references)
+        # Skip text/plain parts that are email body
+        if part.get_content_type() == 'text/plain':
+            return None
+        
+        # Only named parts are attachments
+        filename = part.get_filename()
+        if not filename:
+            return None
+        # Phones name every photo image.jpg, a second one must not overwrite the first
+        filename = unique_filename(filename, filenames)
+        
+        # Save to S3 in injected folder
+        target_key = f"injected/{message_id}/files/{filename}"
+        keep_bytes = INLINE_MAX_BYTES if part.get_content_maintype() == 'image' or is_pdf(part.get_content_type(), filename) else 0
+        upload = S3StreamUploader(s3, BUCKET_NAME, target_key, part.get_content_type(), keep_bytes=keep_bytes)
+        inspector = PartInspector(upload, part)
+        uploads.append((filename, upload, inspector))
+        return inspector
+    
+    with metrics.timer('S3Stream'):
+        response = s3.get_object(Bucket=BUCKET_NAME, Key=object_key)
+        stream_attachments(response['Body'].iter_chunks(READ_CHUNK_SIZE), open_upload)
+    
+    # Extract attachments
+    attachments = []
+    forwarded = []
+    file_count = 0
+    has_images = False
+    has_pdfs = False
+    seen_digests = set()
+    
+    for filename, upload, inspector in uploads:
+        attachment = {
+            'filename': filename,
+            's3_key': upload.key,
+            'content_type': upload.content_type,
+            'size': upload.size
+        }
+        attachments.append(attachment)
+        file_count += 1
+        debug(f"Injected file: {filename} -> {upload.key}")
+        
+        # Logos, tracking pixels and repeated parts stay in S3 but never reach the model
+        reason = skip_reason(inspector, upload.content_type, upload.size, seen_digests, cid_references)
+        if reason:
+            attachment['skipped'] = reason
+            metrics.count('SkippedAttachments')
+            print(f"Skipping {reason} file: {filename} ({upload.size} bytes)")
+            continue
+        
+        # Check if it's an image
+        if upload.content_type.startswith('image/'):
+            has_images = True
+        elif is_pdf(upload.content_type, filename):
+            has_pdfs = True
+        forwarded.append((attachment, upload))
+    metrics.count('Attachments', file_count)
+    metrics.count('AttachmentBytes', sum(upload.size for filename, upload, inspector in uploads))
+    
+    # Save metadata
+    metadata = {
+        'message_id': message_id,
+        'from': body['mail']['commonHeaders']['from'],
+        'to': body['mail']['commonHeaders']['to'],
+        'subject': body['mail']['commonHeaders']['subject'],
+        'timestamp': body['mail']['timestamp'],
+        'attachments': attachments,
+        'file_count': file_count,
+        'has_images': has_images,
+        'has_pdfs': has_pdfs
+    }
+    
+    metadata_key = f"injected/{message_id}/metadata.json"
+    with metrics.timer('Metadata'):
+        s3.put_object(
+            Bucket=BUCKET_NAME,
+            Key=metadata_key,
+            Body=json.dumps(metadata, indent=2),
+            ContentType='application/json'
+        )
+    
+    print(f"Injection complete: {file_count} files processed")
+    email_from_raw = body['mail']['commonHeaders']['from'][0]
+    email_name, email_address = parse_email_from(email_from_raw)
+    
+    # Send to processing queue ONLY if there are images or PDFs
+    send_to_processing = has_images or has_pdfs
+    if send_to_processing and PROCESSING_QUEUE_URL:
+        processing_message = {
+            'message_id': message_id,
+            'file_count': file_count,
+            'has_images': has_images,
+            'has_pdfs': has_pdfs,
+            'email_from_raw': email_from_raw,  # Keep original for reference
+            'email_from': email_address,       # Parsed email address
+            'email_name': email_name,          # Parsed name
+            'email_subject': body['mail']['commonHeaders']['subject'],
+            # Manifest travels with the message so processing doesn't read metadata.json
+            'attachments': [dict(attachment) for attachment, upload in forwarded]
+        }
+        size = inline_attachments(processing_message, [upload for attachment, upload in forwarded])
+        inlined = sum(1 for attachment in processing_message['attachments'] if 'inline' in attachment)
+        debug(f"Processing message: {size} bytes, {inlined} inline file(s)")
+        metrics.count('InlineAttachments', inlined)
+        metrics.count('QueueMessageBytes', size)
+        
+        with metrics.timer('SQSSend'):
+            sqs.send_message(
+                QueueUrl=PROCESSING_QUEUE_URL,
+                MessageBody=json.dumps(processing_message),
+                MessageAttributes={
+                    'message_id': {
+                        'StringValue': message_id,
+                        'DataType': 'String'
+                    }
+                }
+            )
+        print(f"Sent to processing queue: {message_id}")
+    else:
+        print(f"No images or PDFs found, skipping processing queue")
+    
+    return {
+        'message_id': message_id,
+        'files_injected': file_count,
+        'has_images': has_images,
+        'sent_to_processing': send_to_processing,
+        'attachments': attachments
+    }
+
 def lambda_handler(event, context):
     """
-    Extract files from SQS message and inject them into S3
+    Extract files from SQS messages and inject them into S3
     Then send message to processing queue
+    
+    Records are injected in parallel, failed records are reported back to
+    SQS through batchItemFailures so only they are retried.
     """
+    metrics.begin(context)
+    records = event['Records']
+    results = []
+    batch_item_failures = []
     
-    for record in event['Records']:
-        try:
-            # Parse SQS message body
-            body = json.loads(record['body'])
-            
-            # Extract message metadata
-            message_id = body['mail']['messageId']
-            object_key = body['receipt']['action']['objectKey']
-            
-            print(f"Processing message: {message_id}")
-            print(f"S3 object key: {object_key}")
-            
-            # Download the raw email from S3
-            response = s3.get_object(Bucket=BUCKET_NAME, Key=object_key)
-            raw_email = response['Body'].read()
-            
-            # Parse email
-            msg = email.message_from_bytes(raw_email, policy=policy.default)
-            
-            # Extract attachments
-            attachments = []
-            file_count = 0
-            has_images = False
-            
-            for part in msg.walk():
-                # Skip multipart containers
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                
-                # Skip text/html/plain parts that are email body
-                if part.get_content_type() in ['text/plain', 'text/html']:
-                    continue
-                
-                # Get filename
-                filename = part.get_filename()
-                if filename:
-                    # Get file content
-                    file_data = part.get_payload(decode=True)
-                    content_type = part.get_content_type()
-                    
-                    # Save to S3 in injected folder
-                    target_key = f"injected/{message_id}/files/{filename}"
-                    s3.put_object(
-                        Bucket=BUCKET_NAME,
-                        Key=target_key,
-                        Body=file_data,
-                        ContentType=content_type
-                    )
-                    
-                    # Check if it's an image
-                    if content_type.startswith('image/'):
-                        has_images = True
-                    
-                    attachments.append({
-                        'filename': filename,
-                        's3_key': target_key,
-                        'content_type': content_type,
-                        'size': len(file_data)
-                    })
-                    
-                    file_count += 1
-                    print(f"Injected file: {filename} -> {target_key}")
-            
-            # Save metadata
-            metadata = {
-                'message_id': message_id,
-                'from': body['mail']['commonHeaders']['from'],
-                'to': body['mail']['commonHeaders']['to'],
-                'subject': body['mail']['commonHeaders']['subject'],
-                'timestamp': body['mail']['timestamp'],
-                'attachments': attachments,
-                'file_count': file_count,
-                'has_images': has_images
-            }
-            
-            metadata_key = f"injected/{message_id}/metadata.json"
-            s3.put_object(
-                Bucket=BUCKET_NAME,
-                Key=metadata_key,
-                Body=json.dumps(metadata, indent=2),
-                ContentType='application/json'
-            )
-            
-            print(f"Injection complete: {file_count} files processed")
-            email_from_raw = body['mail']['commonHeaders']['from'][0]
-            email_name, email_address = parse_email_from(email_from_raw)
-            
-            # Send to processing queue ONLY if there are images
-            if has_images and PROCESSING_QUEUE_URL:
-                processing_message = {
-                    'message_id': message_id,
-                    'file_count': file_count,
-                    'has_images': has_images,
-                    'email_from_raw': email_from_raw,  # Keep original for reference
-                    'email_from': email_address,       # Parsed email address
-                    'email_name': email_name,          # Parsed name
-                    'email_subject': body['mail']['commonHeaders']['subject']
-                }
-                
-                sqs.send_message(
-                    QueueUrl=PROCESSING_QUEUE_URL,
-                    MessageBody=json.dumps(processing_message),
-                    MessageAttributes={
-                        'message_id': {
-                            'StringValue': message_id,
-                            'DataType': 'String'
-                        }
-                    }
-                )
-                print(f"Sent to processing queue: {message_id}")
-            else:
-                print(f"No images found, skipping processing queue")
-            
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message_id': message_id,
-                    'files_injected': file_count,
-                    'has_images': has_images,
-                    'sent_to_processing': has_images,
-                    'attachments': attachments
-                })
-            }
-            
-        except Exception as e:
-            print(f"Error processing record: {str(e)}")
-            raise e
+    with ThreadPoolExecutor(max_workers=max(1, min(INJECTION_WORKERS, len(records)))) as executor:
+        futures = [executor.submit(inject_record, record) for record in records]
+        for record, future in zip(records, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error processing record {record.get('messageId')}: {str(e)}")
+                batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+    
+    metrics.count('Emails', len(results))
+    metrics.count('FailedRecords', len(batch_item_failures))
+    metrics.flush()
     
     return {
         'statusCode': 200,
-        'body': json.dumps('Processing complete')
-    }
\ No newline at end of file
+        'body': json.dumps({
+            'message': 'Processing complete',
+            'injected_records': len(results),
+            'failed_records': len(batch_item_failures),
+            'results': results
+        }),
+        'batchItemFailures': batch_item_failures
+    }
@@ -0,0 +1,272 @@
+import binascii
+import os
+from email import policy
+from email.parser import BytesFeedParser
+
+# Bytes read from the raw email per S3 request chunk
+READ_CHUNK_SIZE = int(os.environ.get('READ_CHUNK_SIZE', str(1024 * 1024)))
+# Attachments larger than one part are uploaded with S3 multipart upload (minimum part size is 5 MiB)
+MULTIPART_PART_SIZE = max(int(os.environ.get('MULTIPART_PART_SIZE', str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+
+def iter_lines(chunks, max_line=READ_CHUNK_SIZE):
+    """
+    Split an iterator of byte chunks into lines, keeping line endings.
+    Lines longer than max_line are yielded in pieces so memory stays bounded.
+    """
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            yield buffer[start:end + 1]
+            start = end + 1
+        buffer = buffer[start:]
+        if len(buffer) > max_line:
+            yield buffer
+            buffer = b''
+    if buffer:
+        yield buffer
+
+
+class IdentityDecoder:
+    def decode(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class Base64Decoder:
+    """Decode base64 incrementally, carrying incomplete quanta over to the next call"""
+
+    def __init__(self):
+        self.pending = b''
+
+    def decode(self, data):
+        data = self.pending + data.translate(None, b' \t\r\n')
+        usable = len(data) - len(data) % 4
+        self.pending = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b''
+
+    def flush(self):
+        data, self.pending = self.pending, b''
+        if not data:
+            return b''
+        try:
+            return binascii.a2b_base64(data + b'=' * (-len(data) % 4))
+        except binascii.Error:
+            return b''
+
+
+class QuotedPrintableDecoder:
+    """Decode quoted-printable line by line so soft line breaks are handled"""
+
+    def __init__(self):
+        self.pending = b''
+
+    def decode(self, data):
+        data = self.pending + data
+        end = data.rfind(b'\n') + 1
+        self.pending = data[end:]
+        return binascii.a2b_qp(data[:end]) if end else b''
+
+    def flush(self):
+        data, self.pending = self.pending, b''
+        return binascii.a2b_qp(data) if data else b''
+
+
+def is_encoded(part):
+    encoding = str(part.get('Content-Transfer-Encoding', '7bit')).strip().lower()
+    return encoding in ('base64', 'quoted-printable')
+
+
+def make_decoder(part):
+    encoding = str(part.get('Content-Transfer-Encoding', '7bit')).strip().lower()
+    if encoding == 'base64':
+        return Base64Decoder()
+    if encoding == 'quoted-printable':
+        return QuotedPrintableDecoder()
+    return IdentityDecoder()
+
+
+class S3StreamUploader:
+    """
+    Upload a stream of bytes to S3 holding at most one part in memory.
+    Small objects are sent with a single put_object, larger ones switch to multipart upload.
+    Objects of at most keep_bytes are also kept in .data after close, otherwise .data is None.
+    """
+
+    def __init__(self, s3, bucket, key, content_type, part_size=MULTIPART_PART_SIZE, keep_bytes=0):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.keep_bytes = min(keep_bytes, part_size)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.size = 0
+        self.data = None
+
+    def write(self, data):
+        if not data:
+            return
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            response = self.s3.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                ContentType=self.content_type
+            )
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            PartNumber=part_number,
+            UploadId=self.upload_id,
+            Body=data
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        if self.upload_id is None:
+            body = bytes(self.buffer)
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=body,
+                ContentType=self.content_type
+            )
+            if self.size <= self.keep_bytes:
+                self.data = body
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+
+
+def parse_headers(lines):
+    """Parse a block of header lines into a message object without a body"""
+    parser = BytesFeedParser(policy=policy.default)
+    for line in lines:
+        parser.feed(line)
+    return parser.close()
+
+
+def stream_attachments(chunks, open_sink):
+    """
+    Walk a MIME message from an iterator of byte chunks without building the message tree.
+
+    Embedded message/rfc822 parts are walked into like email.message.walk().
+    open_sink(part) is called with the headers of every leaf part and returns
+    an object with write(data)/close()/abort() receiving the decoded body,
+    or None to skip the part. Returns the top level message headers.
+    """
+    boundaries = []
+    state = 'headers'
+    header_lines = []
+    top_headers = None
+    sink = None
+    decoder = None
+    pending_newline = b''
+    at_line_start = True
+
+    def finish_part(trailing=b''):
+        nonlocal sink, decoder
+        if sink is not None:
+            sink.write(decoder.decode(trailing) + decoder.flush())
+            sink.close()
+        sink = None
+        decoder = None
+
+    try:
+        for line in iter_lines(chunks):
+            line_start = at_line_start
+            at_line_start = line.endswith(b'\n')
+
+            if state == 'headers':
+                if line_start and line in (b'\n', b'\r\n'):
+                    part = parse_headers(header_lines)
+                    header_lines = []
+                    if top_headers is None:
+                        top_headers = part
+                    boundary = part.get_boundary() if part.get_content_maintype() == 'multipart' else None
+                    if boundary:
+                        boundaries.append(b'--' + boundary.encode('utf-8', 'surrogateescape'))
+                        state = 'preamble'
+                        continue
+                    # Emails forwarded as attachment carry a whole message, its headers follow
+                    if part.get_content_type() == 'message/rfc822' and not is_encoded(part):
+                        continue
+                    sink = open_sink(part)
+                    decoder = make_decoder(part) if sink is not None else None
+                    pending_newline = b''
+                    state = 'body'
+                else:
+                    header_lines.append(line)
+                continue
+
+            # Boundary delimiters always start at the beginning of a line
+            if line_start and boundaries and line.startswith(b'--'):
+                delimiter = line.rstrip(b'\r\n').rstrip(b' \t')
+                matched = None
+                for depth in range(len(boundaries) - 1, -1, -1):
+                    if delimiter in (boundaries[depth], boundaries[depth] + b'--'):
+                        matched = depth
+                        break
+                if matched is not None:
+                    # The line break before a delimiter belongs to the delimiter
+                    if state == 'body':
+                        finish_part()
+                    closing = delimiter == boundaries[matched] + b'--'
+                    del boundaries[matched + 1:]
+                    if closing:
+                        boundaries.pop()
+                        state = 'preamble'
+                    else:
+                        state = 'headers'
+                    continue
+
+            if state == 'body' and sink is not None:
+                if line.endswith(b'\r\n'):
+                    content, newline = line[:-2], b'\r\n'
+                elif line.endswith(b'\n'):
+                    content, newline = line[:-1], b'\n'
+                else:
+                    content, newline = line, b''
+                sink.write(decoder.decode(pending_newline + content))
+                pending_newline = newline
+
+        # A body without a closing delimiter runs to the end of the stream
+        if state == 'body':
+            finish_part(pending_newline)
+    except Exception:
+        if sink is not None:
+            sink.abort()
+        raise
+
+    return top_headers
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from clients import client as aws_client
+
+CACHE_TABLE_NAME = os.environ.get('CACHE_TABLE_NAME')
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_DAYS', '30')) * 86400
+CACHE_LRU_SIZE = int(os.environ.get('CACHE_LRU_SIZE', '256'))
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of extracted receipt data.
+
+    Entries are keyed on a hash of the image bytes, the model and the prompt
+    version. A small in-process LRU sits in front of a DynamoDB table whose
+    items expire through DynamoDB TTL on the 'expires_at' attribute.
+    """
+
+    def __init__(self, table_name=CACHE_TABLE_NAME, ttl_seconds=CACHE_TTL_SECONDS,
+                 lru_size=CACHE_LRU_SIZE, client=None):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.lru_size = lru_size
+        self.client = client
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'lru_hits': 0, 'table_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+
+    @staticmethod
+    def make_key(data, model, prompt_version):
+        digest = hashlib.sha256()
+        digest.update(model.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(str(prompt_version).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _client(self):
+        # Low-level clients are thread-safe, unlike boto3 resources
+        if self.client is None:
+            self.client = aws_client('dynamodb')
+        return self.client
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _remember(self, key, receipt_data, expires_at):
+        if self.lru_size <= 0:
+            return
+        with self.lock:
+            self.lru[key] = (receipt_data, expires_at)
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+
+    def get(self, key):
+        """Return cached receipt data for key or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.lru.get(key)
+            if entry and entry[1] > now:
+                self.lru.move_to_end(key)
+                self.stats['lru_hits'] += 1
+                return entry[0]
+            if entry:
+                del self.lru[key]
+
+        if self.table_name:
+            try:
+                response = self._client().get_item(
+                    TableName=self.table_name,
+                    Key={'cache_key': {'S': key}}
+                )
+                item = response.get('Item')
+                # TTL deletion is lazy, expired items can still be returned
+                if item and int(item['expires_at']['N']) > now:
+                    # Model answers are parsed with Decimal numbers, so cached data round-trips as is
+                    receipt_data = deserializer.deserialize(item['receipt_data'])
+                    self._remember(key, receipt_data, int(item['expires_at']['N']))
+                    self._count('table_hits')
+                    return receipt_data
+            except Exception as e:
+                print(f"Extraction cache read error: {str(e)}")
+                self._count('errors')
+
+        self._count('misses')
+        return None
+
+    def put(self, key, receipt_data, model, prompt_version):
+        """Store receipt data for key"""
+        expires_at = int(time.time()) + self.ttl_seconds
+        self._remember(key, receipt_data, expires_at)
+
+        if self.table_name:
+            try:
+                self._client().put_item(
+                    TableName=self.table_name,
+                    Item={
+                        'cache_key': {'S': key},
+                        'receipt_data': serializer.serialize(receipt_data),
+                        'model': {'S': model},
+                        'prompt_version': {'S': str(prompt_version)},
+                        'created_at': {'N': str(int(time.time()))},
+                        'expires_at': {'N': str(expires_at)}
+                    }
+                )
+            except Exception as e:
+                print(f"Extraction cache write error: {str(e)}")
+                self._count('errors')
+                return
+        self._count('stores')
+
+    def snapshot(self):
+        """Counters since the container started"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['hits'] = stats['lru_hits'] + stats['table_hits']
+        return stats
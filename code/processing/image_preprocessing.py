@@ -0,0 +1,52 @@
+import io
+import os
+
+# Pillow has to be bundled into the processing zip, without it images are sent unchanged
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '1600'))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG').upper()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '80'))
+IMAGE_GRAYSCALE = os.environ.get('IMAGE_GRAYSCALE', 'true').lower() == 'true'
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+def preprocessing_signature():
+    """Describes how images are transformed, part of the extraction cache key"""
+    if Image is None:
+        return 'original'
+    return f"{IMAGE_MAX_DIMENSION}:{IMAGE_FORMAT}:{IMAGE_QUALITY}:{'L' if IMAGE_GRAYSCALE else 'RGB'}"
+
+
+def prepare_image(data, content_type):
+    """
+    Auto-orient, downscale and re-encode an image before sending it to the model.
+    Returns (image bytes, mime type). Falls back to the original bytes when
+    Pillow is missing, the image can't be decoded or re-encoding doesn't help.
+    """
+    if Image is None:
+        return data, content_type
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            mode = 'L' if IMAGE_GRAYSCALE else 'RGB'
+            # Let the JPEG decoder scale down while decoding, much cheaper than a full decode
+            image.draft(mode, (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert(mode)
+            image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
+            processed = output.getvalue()
+    except Exception as e:
+        print(f"Image preprocessing failed, sending original: {str(e)}")
+        return data, content_type
+
+    if len(processed) >= len(data):
+        return data, content_type
+    return processed, MIME_TYPES.get(IMAGE_FORMAT, content_type)
@@ -1,28 +1,113 @@
 import json
-import boto3
 import os
-import requests
 import base64
+import random
+import re
+import html
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from decimal import Decimal
+from aggregates import aggregate_keys, parse_amount, receipt_amount
+from attachments import is_pdf, unique_filename
+from botocore.exceptions import ClientError
+from clients import lazy_client, lazy_resource, lazy_table
+from extraction_cache import ExtractionCache
+from json_encoding import dumps
+from metrics import Metrics, debug
+from image_preprocessing import prepare_image, preprocessing_signature
+from model_client import CircuitOpenError, ModelClient, ModelRequestError, ModelUnavailableError
+from pdf_pages import PDF_MAX_TEXT_CHARS, PDF_MIN_TEXT_CHARS, PdfDocument, can_rasterize, pdf_signature, pdfium
+from rate_limiter import (MODEL_RATE_LIMIT, MODEL_RATE_WINDOW_SECONDS, SENDER_RATE_LIMIT, SENDER_WINDOW_SECONDS,
+                          RateLimiter)
+from visibility_heartbeat import VisibilityHeartbeat
 
 # Environment variables should be defined before using them
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
 SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'receipts@senchuknazar123.online')  # Missing equals sign
 BUCKET_NAME = os.environ.get('BUCKET_NAME', 'checker-main-12')
 TABLE_NAME = os.environ.get('TABLE_NAME', 'receipts-table')
+AGGREGATES_TABLE_NAME = os.environ.get('AGGREGATES_TABLE_NAME')
+PROCESSING_QUEUE_URL = os.environ.get('PROCESSING_QUEUE_URL')
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
 OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', 'nvidia/nemotron-nano-12b-v2-vl:free')
+# Fast, cheap model tried first, answers failing validation are escalated to OPENROUTER_MODEL. Empty disables tiering
+OPENROUTER_FAST_MODEL = os.environ.get('OPENROUTER_FAST_MODEL', '')
+# Completion budget of the fast model per receipt, a valid answer is well under 100 tokens
+FAST_MODEL_MAX_TOKENS = int(os.environ.get('FAST_MODEL_MAX_TOKENS', '150'))
+# Extractions may come from either tier, so cached ones belong to the pair of models
+MODEL_ROUTE = f"{OPENROUTER_FAST_MODEL}>{OPENROUTER_MODEL}" if OPENROUTER_FAST_MODEL else OPENROUTER_MODEL
 CHARSET = "UTF-8"  # Missing CHARSET definition
+# Number of attachments downloaded and sent to the model in parallel
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', '4'))
+# Seconds reserved at the end of the invocation for persisting results
+DEADLINE_MARGIN_SECONDS = float(os.environ.get('DEADLINE_MARGIN_SECONDS', '5'))
+# Visibility timeout of the processing queue, claims never outlive it
+QUEUE_VISIBILITY_TIMEOUT = int(os.environ.get('QUEUE_VISIBILITY_TIMEOUT', '100'))
+MODEL_TIMEOUT_SECONDS = 60
+# Images of one message packed into a single model request, 1 sends every image on its own
+MODEL_BATCH_SIZE = int(os.environ.get('MODEL_BATCH_SIZE', '1'))
+# Original bytes of the images packed into a single model request
+MODEL_BATCH_BYTES = int(os.environ.get('MODEL_BATCH_BYTES', str(4 * 1024 * 1024)))
+# A message is deferred at most this many times, then processed even if its sender is over the limit,
+# or handed back to SQS when the model quota is still used up
+MAX_DEFERRALS = int(os.environ.get('MAX_DEFERRALS', '8'))
+# Bump whenever RECEIPT_PROMPT changes so cached extractions are not reused
+PROMPT_VERSION = '1'
+RECEIPT_PROMPT = '''Extract receipt information and return ONLY JSON with this structure:
+                        {
+                          "merchant_name": "store name",
+                          "date": "YYYY-MM-DD",
+                          "time": "HH:MM",
+                          "total_amount": 0.00,
+                          "currency": "USD/EUR/etc",
+                          "payment_method": "cash/card/etc"
+                        }
+                        No explanations, no markdown, just pure JSON.'''
+PDF_TEXT_PROMPT = RECEIPT_PROMPT + '\nThe receipt is given as the text extracted from a PDF:'
+PDF_PAGES_PROMPT = 'The images below are the pages of one receipt or invoice.\n' + RECEIPT_PROMPT
+BATCH_PROMPT = '''Each image below is a separate receipt, preceded by its file name.
+Extract every receipt and return ONLY a JSON array with one object per image:
+[
+  {
+    "filename": "file name of the image",
+    "merchant_name": "store name",
+    "date": "YYYY-MM-DD",
+    "time": "HH:MM",
+    "total_amount": 0.00,
+    "currency": "USD/EUR/etc",
+    "payment_method": "cash/card/etc"
+  }
+]
+No explanations, no markdown, just pure JSON.'''
+RECEIPT_FIELDS = ('merchant_name', 'date', 'time', 'total_amount', 'currency', 'payment_method')
+CURRENCY_PATTERN = re.compile(r'^[A-Z]{3}$')
+
+# Built on first use, an invocation with only inline images never creates the S3 client
+s3 = lazy_client('s3')
+dynamodb = lazy_resource('dynamodb')
+ses_client = lazy_client('ses', region_name=AWS_REGION)
+sqs = lazy_client('sqs')
+table = lazy_table(TABLE_NAME)
+aggregates_table = lazy_table(AGGREGATES_TABLE_NAME) if AGGREGATES_TABLE_NAME else None
+extraction_cache = ExtractionCache()
+# Reused across warm invocations so connections to OpenRouter stay open
+model_client = ModelClient(pool_size=EXTRACTION_WORKERS)
+# Global model quota, and per sender quota so one backlog doesn't starve everyone else
+model_limiter = RateLimiter('model', MODEL_RATE_LIMIT, MODEL_RATE_WINDOW_SECONDS)
+sender_limiter = RateLimiter('sender', SENDER_RATE_LIMIT, SENDER_WINDOW_SECONDS)
+metrics = Metrics('processing')
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-ses_client = boto3.client('ses', region_name=AWS_REGION)
-table = dynamodb.Table(TABLE_NAME)
+class ModelThrottledError(ModelUnavailableError):
+    """The shared model quota is used up until its window refills"""
 
-def extract_receipt_info(image_base64, filename):
+def request_completion(message_content, timeout=MODEL_TIMEOUT_SECONDS, max_tokens=500, model=OPENROUTER_MODEL):
     """
-    Send image to OpenRouter for receipt analysis
+    Send a chat completion request to OpenRouter, returns the answer text or None when the request failed.
+    Raises ModelUnavailableError when the model can't be reached or the quota is used up and the request
+    should be retried later.
     """
     headers = {
         'Authorization': f'Bearer {OPENROUTER_API_KEY}',
@@ -32,51 +117,39 @@ def extract_receipt_info(image_base64, filename):
     }
     
     payload = {
-        'model': OPENROUTER_MODEL,
+        'model': model,
         'messages': [
             {
                 'role': 'user',
-                'content': [
-                    {
-                        'type': 'text',
-                        'text': '''Extract receipt information and return ONLY JSON with this structure:
-                        {
-                          "merchant_name": "store name",
-                          "date": "YYYY-MM-DD",
-                          "time": "HH:MM",
-                          "total_amount": 0.00,
-                          "currency": "USD/EUR/etc",
-                          "payment_method": "cash/card/etc"
-                        }
-                        No explanations, no markdown, just pure JSON.'''
-                    },
-                    {
-                        'type': 'image_url',
-                        'image_url': {
-                            'url': f'data:image/png;base64,{image_base64}'
-                        }
-                    }
-                ]
+                'content': message_content
             }
         ],
-        'max_tokens': 500,
+        'max_tokens': max_tokens,
         'temperature': 0.1
     }
     
     try:
-        response = requests.post(
-            'https://openrouter.ai/api/v1/chat/completions',
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        # Wait for the shared model quota, within the time this request has anyway
+        wait_until = time.monotonic() + timeout
+        with metrics.timer('RateLimit'):
+            acquired = model_limiter.acquire(wait_until)
+        if not acquired:
+            raise ModelThrottledError("Model rate limit reached, no time left to wait for a token")
+        timeout = wait_until - time.monotonic()
+        
+        with metrics.timer('Model'):
+            response = model_client.post(payload, headers=headers, timeout=timeout)
         
-        print(f"OpenRouter Status Code: {response.status_code}")
-        print(f"OpenRouter Response: {response.text[:200]}")
+        debug(f"OpenRouter Status Code: {response.status_code}")
+        debug(f"OpenRouter Response: {response.text[:200]}")
         
         response.raise_for_status()
         result = response.json()
         
+        usage = result.get('usage') or {}
+        metrics.count('PromptTokens', usage.get('prompt_tokens', 0))
+        metrics.count('CompletionTokens', usage.get('completion_tokens', 0))
+        
         # Check for API errors first
         if 'error' in result:
             print(f"OpenRouter API error: {result['error']}")
@@ -87,31 +160,18 @@ def extract_receipt_info(image_base64, filename):
             print(f"No choices in response: {result}")
             return None
             
-        content = result['choices'][0]['message']['content']
-        
-        # Clean the response
-        content_clean = content.strip()
-        
-        # Remove code blocks if present
-        if '```json' in content_clean:
-            content_clean = content_clean.split('```json')[1]
-        if '```' in content_clean:
-            content_clean = content_clean.split('```')[0]
-            
-        content_clean = content_clean.strip()
-        
-        # Parse JSON
-        receipt_data = json.loads(content_clean)
-        return receipt_data
+        return result['choices'][0]['message']['content'] or ''
         
-    except requests.exceptions.RequestException as e:
+    except CircuitOpenError as e:
+        # Transient, the message is retried instead of the receipt being given up
+        print(f"Skipping model request: {str(e)}")
+        raise
+    except ModelUnavailableError as e:
+        print(f"Model unavailable: {str(e)}")
+        raise
+    except ModelRequestError as e:
         print(f"Request error: {str(e)}")
         return None
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {str(e)}")
-        if 'content' in locals():
-            print(f"Raw content: {content[:500]}")
-        return None
     except KeyError as e:
         print(f"Key error in response: {str(e)}")
         print(f"Response structure: {result}")
@@ -120,23 +180,221 @@ def extract_receipt_info(image_base64, filename):
         print(f"Unexpected error: {str(e)}")
         return None
 
-def convert_floats_to_decimal(obj):
-    """Convert floats to Decimal for DynamoDB"""
-    if isinstance(obj, list):
-        return [convert_floats_to_decimal(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_floats_to_decimal(v) for k, v in obj.items()}
-    elif isinstance(obj, float):
-        return Decimal(str(obj))
-    return obj
-
-def send_email(receipt_id, file_name, email_from):
-    """Send email notification"""
+def parse_model_json(content):
+    """JSON in a model answer, raises json.JSONDecodeError when there is none"""
+    # Clean the response
+    content_clean = content.strip()
+    
+    # Remove code blocks if present
+    if '```json' in content_clean:
+        content_clean = content_clean.split('```json')[1]
+    if '```' in content_clean:
+        content_clean = content_clean.split('```')[0]
+        
+    content_clean = content_clean.strip()
+    
+    # Parse JSON, numbers as Decimal so the result can be stored in DynamoDB as is
+    return json.loads(content_clean, parse_float=Decimal)
+
+def call_model(message_content, timeout=MODEL_TIMEOUT_SECONDS, max_tokens=500, model=OPENROUTER_MODEL):
+    """
+    Send a chat completion request to OpenRouter and parse the JSON answer
+    """
+    content = request_completion(message_content, timeout=timeout, max_tokens=max_tokens, model=model)
+    if content is None:
+        return None
+    try:
+        return parse_model_json(content)
+    except json.JSONDecodeError as e:
+        print(f"JSON decode error: {str(e)}")
+        print(f"Raw content: {content[:500]}")
+        return None
+
+def receipt_problem(receipt_data):
+    """Why an extraction can't be trusted as is, None when its fields are well formed"""
+    if not is_receipt(receipt_data):
+        return 'not a receipt object'
+    date = receipt_data.get('date')
+    if not isinstance(date, str) or not re.match(r'^\d{4}-\d{2}-\d{2}$', date):
+        return f"date {date!r}"
+    try:
+        datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return f"date {date!r}"
+    amount = receipt_data.get('total_amount')
+    if isinstance(amount, bool) or not isinstance(amount, (int, Decimal)) or not Decimal(amount).is_finite():
+        return f"total_amount {amount!r}"
+    currency = receipt_data.get('currency')
+    if not isinstance(currency, str) or not CURRENCY_PATTERN.match(currency.strip().upper()):
+        return f"currency {currency!r}"
+    return None
+
+def call_tiered(message_content, label, timeout=MODEL_TIMEOUT_SECONDS, escalated=False):
+    """
+    Extract one receipt with the fast model and escalate to OPENROUTER_MODEL
+    when its answer isn't JSON or fails receipt_problem. Failed requests are
+    not escalated, both tiers share the quota and the circuit breaker.
+    """
+    if not OPENROUTER_FAST_MODEL:
+        return call_model(message_content, timeout=timeout)
+    deadline = time.monotonic() + timeout
+    
+    if not escalated:
+        metrics.count('FastModelRequests')
+        with metrics.timer('FastModel'):
+            content = request_completion(message_content, timeout=timeout, max_tokens=FAST_MODEL_MAX_TOKENS,
+                                         model=OPENROUTER_FAST_MODEL)
+        if content is None:
+            return None
+        try:
+            receipt_info = parse_model_json(content)
+            problem = receipt_problem(receipt_info)
+        except json.JSONDecodeError:
+            problem = f"invalid JSON {content[:100]!r}"
+        if problem is None:
+            return receipt_info
+        print(f"Escalating {label} to {OPENROUTER_MODEL}: {problem}")
+        metrics.count('Escalations')
+    
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        print(f"No time left to escalate file: {label}")
+        return None
+    metrics.count('StrongModelRequests')
+    with metrics.timer('StrongModel'):
+        return call_model(message_content, timeout=remaining)
+
+def image_content(image_base64, mime_type):
+    return {
+        'type': 'image_url',
+        'image_url': {
+            'url': f'data:{mime_type};base64,{image_base64}'
+        }
+    }
+
+def extract_receipt_info(image_base64, filename, timeout=MODEL_TIMEOUT_SECONDS, mime_type='image/png', escalated=False):
+    """
+    Send image to OpenRouter for receipt analysis, escalated images skip the fast model
+    """
+    content = [
+        {
+            'type': 'text',
+            'text': RECEIPT_PROMPT
+        },
+        image_content(image_base64, mime_type)
+    ]
+    return call_tiered(content, filename, timeout=timeout, escalated=escalated)
+
+def extract_pdf_receipt(pdf_data, filename, deadline):
+    """
+    Extract a PDF receipt from its text layer when it has one, a text-only
+    request is far cheaper than a vision call. Scanned PDFs are rasterized
+    and their pages sent as images of a single receipt.
+    """
+    try:
+        with metrics.timer('Pdf'):
+            with PdfDocument(pdf_data) as document:
+                text = document.text()
+                use_text = len(text) >= PDF_MIN_TEXT_CHARS
+                pages = document.pages() if not use_text and can_rasterize() else []
+    except Exception as e:
+        print(f"Failed to read PDF {filename}: {str(e)}")
+        return None
+    
+    if use_text:
+        metrics.count('PdfTextLayers')
+        content = [{'type': 'text', 'text': f"{PDF_TEXT_PROMPT}\n\n{text[:PDF_MAX_TEXT_CHARS]}"}]
+    elif pages:
+        metrics.count('PdfPages', len(pages))
+        metrics.count('ModelImageBytes', sum(len(data) for data, mime_type in pages))
+        content = [{'type': 'text', 'text': PDF_PAGES_PROMPT}]
+        content.extend(image_content(base64.b64encode(data).decode('utf-8'), mime_type) for data, mime_type in pages)
+    else:
+        print(f"Skipping PDF without text layer, Pillow is needed to rasterize it: {filename}")
+        return None
+    
+    timeout = min(MODEL_TIMEOUT_SECONDS, deadline - time.monotonic())
+    if timeout <= 0:
+        print(f"No time left to process file: {filename}")
+        return None
+    return call_tiered(content, filename, timeout=timeout)
+
+def is_receipt(receipt_data):
+    return isinstance(receipt_data, dict) and any(field in receipt_data for field in RECEIPT_FIELDS)
+
+def extract_receipt_batch(images, timeout=MODEL_TIMEOUT_SECONDS):
+    """
+    Send several images of (filename, image_base64, mime_type) in one request.
+    Returns receipt data by filename, images the model dropped or mangled are missing,
+    and the filenames to escalate: with a fast model the batch goes to it and answers
+    failing receipt_problem are left out of the receipt data and escalated instead.
+    """
+    content = [{'type': 'text', 'text': BATCH_PROMPT}]
+    for filename, image_base64, mime_type in images:
+        content.append({'type': 'text', 'text': f'File: {filename}'})
+        content.append(image_content(image_base64, mime_type))
+    
+    if OPENROUTER_FAST_MODEL:
+        metrics.count('FastModelRequests')
+        with metrics.timer('FastModel'):
+            result = call_model(content, timeout=timeout, max_tokens=FAST_MODEL_MAX_TOKENS * len(images),
+                                model=OPENROUTER_FAST_MODEL)
+    else:
+        result = call_model(content, timeout=timeout, max_tokens=500 * len(images))
+    if isinstance(result, dict):
+        # Some models wrap the array or key the receipts by file name
+        result = result.get('receipts', [dict(value, filename=key) for key, value in result.items() if isinstance(value, dict)])
+    if not isinstance(result, list):
+        return {}, set()
+    
+    filenames = {filename for filename, image_base64, mime_type in images}
+    extracted, escalate = {}, set()
+    for receipt_data in result:
+        if not is_receipt(receipt_data):
+            continue
+        receipt_data = dict(receipt_data)
+        filename = receipt_data.pop('filename', None)
+        problem = receipt_problem(receipt_data) if OPENROUTER_FAST_MODEL else None
+        if filename in filenames and problem:
+            print(f"Escalating {filename} to {OPENROUTER_MODEL}: {problem}")
+            escalate.add(filename)
+            continue
+        if filename in filenames and filename not in extracted:
+            extracted[filename] = receipt_data
+    return extracted, escalate - set(extracted)
+
+def format_amount(receipt_info):
+    amount = receipt_info.get('total_amount')
+    if amount in (None, ''):
+        return '-'
+    return f"{amount} {receipt_info.get('currency') or ''}".strip()
+
+def send_email(message_id, receipts, email_from):
+    """Send one notification listing every receipt processed from a message"""
+    rows = "".join(
+        f"<tr><td>{html.escape(str(filename))}</td>"
+        f"<td>{html.escape(str(receipt_info.get('merchant_name') or '-'))}</td>"
+        f"<td>{html.escape(str(receipt_info.get('date') or '-'))}</td>"
+        f"<td>{html.escape(format_amount(receipt_info))}</td></tr>"
+        for receipt_id, filename, receipt_info in receipts
+    )
+    
+    totals = {}
+    for receipt_id, filename, receipt_info in receipts:
+        currency = str(receipt_info.get('currency') or '').strip().upper()
+        totals[currency] = totals.get(currency, Decimal('0')) + parse_amount(receipt_info.get('total_amount'))
+    total_text = ", ".join(f"{amount} {currency}".strip() for currency, amount in totals.items())
+    
     BODY_HTML = f"""<html>
     <head></head>
     <body>
     <h1>Receipt Processor Message</h1>
-    <p>Your receipt {receipt_id} with file {file_name} has been completely processed. Visit site to check analytics.</p>
+    <p>{len(receipts)} receipt(s) from your message {html.escape(message_id)} have been completely processed. Visit site to check analytics.</p>
+    <table border="1" cellpadding="4" cellspacing="0">
+    <tr><th>File</th><th>Merchant</th><th>Date</th><th>Total</th></tr>
+    {rows}
+    </table>
+    <p>Total: {html.escape(total_text)}</p>
     </body>
     </html>
     """
@@ -155,147 +413,701 @@ def send_email(receipt_id, file_name, email_from):
                 },
                 'Subject': {
                     'Charset': CHARSET,
-                    'Data': "Processed receipt",
+                    'Data': "Processed receipt" if len(receipts) == 1 else f"Processed {len(receipts)} receipts",
                 },
             },
             Source=SENDER_EMAIL,
         )
-        print(f"Email sent! Message ID: {response['MessageId']}")
-        print(f"Sent email to {email_from}")
+        debug(f"Email sent! Message ID: {response['MessageId']}")
+        debug(f"Sent email to {email_from}")
     except Exception as e:
         print(f"Failed to send email: {str(e)}")
 
+def stats_delta(before, after):
+    """Counters accumulated during this invocation"""
+    return {
+        name: value - before.get(name, 0) if isinstance(value, int) and not isinstance(value, bool) else value
+        for name, value in after.items()
+    }
+
+def invocation_deadline(context):
+    """Monotonic deadline for the current invocation, leaving time to persist results"""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return time.monotonic() + MODEL_TIMEOUT_SECONDS
+    remaining = context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN_SECONDS
+    return time.monotonic() + max(remaining, 1.0)
+
+def read_attachment(attachment):
+    """Attachment bytes, inline from the queue message or downloaded from S3"""
+    if attachment.get('inline'):
+        metrics.count('InlineAttachments')
+        return zlib.decompress(base64.b64decode(attachment['inline']))
+    # Download file from S3
+    with metrics.timer('S3Read'):
+        file_obj = s3.get_object(Bucket=BUCKET_NAME, Key=attachment['s3_key'])
+        return file_obj['Body'].read()
+
+def plan_batches(attachments):
+    """Group attachments of a message into model requests by count and byte budget"""
+    batches = []
+    batch, batch_bytes = [], 0
+    for attachment in attachments:
+        size = attachment.get('size') or 0
+        full = len(batch) >= MODEL_BATCH_SIZE or (batch and batch_bytes + size > MODEL_BATCH_BYTES)
+        # Results are matched by file name, so names must be unique within a request
+        if full or any(other['filename'] == attachment['filename'] for other in batch):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(attachment)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def download_and_extract(attachments, deadline):
+    """
+    Download a batch of attachments and send them to OpenRouter, in a
+    single request when there are several. Images missing from the batched
+    answer are retried one by one, with the strong model when the batch
+    went to the fast one. Returns [(file size, receipt info, unavailable)] in
+    the order of attachments, unavailable is the ModelUnavailableError of
+    attachments to retry later, when the model was down, throttled or there
+    was no time left.
+    """
+    cache_version = f"{PROMPT_VERSION}:{preprocessing_signature()}"
+    pdf_cache_version = f"{cache_version}:{pdf_signature()}"
+    results = []
+    todo = []
+    
+    for index, attachment in enumerate(attachments):
+        filename = attachment['filename']
+        debug(f"Processing file: {filename}")
+        file_data = read_attachment(attachment)
+        metrics.count('Attachments')
+        metrics.count('AttachmentBytes', len(file_data))
+        pdf = is_pdf(attachment['content_type'], filename)
+        
+        # Reuse a previous extraction of the exact same file
+        version = pdf_cache_version if pdf else cache_version
+        cache_key = ExtractionCache.make_key(file_data, MODEL_ROUTE, version)
+        receipt_info = extraction_cache.get(cache_key)
+        results.append((len(file_data), receipt_info, None))
+        if receipt_info:
+            debug(f"Extraction cache hit for file: {filename}")
+            continue
+        
+        # PDFs make their own request, from the text layer or the rendered pages
+        if pdf:
+            try:
+                receipt_info = extract_pdf_receipt(file_data, filename, deadline)
+            except ModelUnavailableError as e:
+                results[index] = (len(file_data), None, e)
+                continue
+            if receipt_info:
+                results[index] = (len(file_data), receipt_info, None)
+                extraction_cache.put(cache_key, receipt_info, MODEL_ROUTE, version)
+            continue
+        
+        # Downscale and recompress, the model doesn't need full resolution photos
+        with metrics.timer('Preprocess'):
+            image_data, mime_type = prepare_image(file_data, attachment['content_type'])
+        debug(f"Prepared {filename}: {len(file_data)} -> {len(image_data)} bytes ({mime_type})")
+        metrics.count('ModelImageBytes', len(image_data))
+        
+        # Convert to base64
+        with metrics.timer('Encode'):
+            image_base64 = base64.b64encode(image_data).decode('utf-8')
+        todo.append((index, cache_key, filename, image_base64, mime_type))
+    
+    escalate = set()
+    if len(todo) > 1:
+        timeout = min(MODEL_TIMEOUT_SECONDS, deadline - time.monotonic())
+        extracted = {}
+        if timeout > 0:
+            try:
+                extracted, escalate = extract_receipt_batch(
+                    [(filename, image_base64, mime_type) for index, cache_key, filename, image_base64, mime_type in todo],
+                    timeout=timeout
+                )
+            except ModelUnavailableError as e:
+                # Single requests would fail the same way
+                for index, cache_key, filename, image_base64, mime_type in todo:
+                    results[index] = (results[index][0], None, e)
+                return results
+            print(f"Batched extraction: {len(extracted)}/{len(todo)} images")
+        remaining = []
+        for entry in todo:
+            index, cache_key, filename = entry[:3]
+            if filename in extracted:
+                results[index] = (results[index][0], extracted[filename], None)
+                extraction_cache.put(cache_key, extracted[filename], MODEL_ROUTE, cache_version)
+            else:
+                remaining.append(entry)
+        todo = remaining
+        # Only images the fast model answered badly skip it, dropped ones get a request of their own first
+        metrics.count('Escalations', len(escalate))
+    
+    for index, cache_key, filename, image_base64, mime_type in todo:
+        # Send to OpenRouter, never waiting past the invocation deadline
+        timeout = min(MODEL_TIMEOUT_SECONDS, deadline - time.monotonic())
+        if timeout <= 0:
+            print(f"No time left to process file: {filename}")
+            results[index] = (results[index][0], None, ModelUnavailableError('No time left to process file'))
+            continue
+        try:
+            receipt_info = extract_receipt_info(image_base64, filename, timeout=timeout, mime_type=mime_type,
+                                                escalated=filename in escalate)
+        except ModelUnavailableError as e:
+            results[index] = (results[index][0], None, e)
+            continue
+        if receipt_info:
+            results[index] = (results[index][0], receipt_info, None)
+            extraction_cache.put(cache_key, receipt_info, MODEL_ROUTE, cache_version)
+    
+    return results
+
+def defer_message(record, message, limiter):
+    """
+    Send a message back to the processing queue, delayed until the window of
+    the quota it ran into refills (its sender's or the model's). The original
+    is deleted with the rest of the batch.
+    """
+    if not PROCESSING_QUEUE_URL or message['deferrals'] >= MAX_DEFERRALS:
+        return False
+    body = json.loads(record['body'])
+    body['deferrals'] = message['deferrals'] + 1
+    # Spread deferred messages so they don't all come back in the same second
+    delay = limiter.seconds_until_refill() + random.uniform(0, 0.1 * limiter.window_seconds)
+    try:
+        sqs.send_message(
+            QueueUrl=PROCESSING_QUEUE_URL,
+            MessageBody=dumps(body),
+            DelaySeconds=min(int(delay) + 1, 900)
+        )
+    except Exception as e:
+        print(f"Failed to defer message {message['message_id']}: {str(e)}")
+        return False
+    print(f"Deferred message {message['message_id']} of {message['email_from']} by {int(delay) + 1}s")
+    return True
+
+def load_message(record):
+    """
+    Parse an SQS record, the attachment manifest comes with the message
+    or, for messages without one, from metadata.json in S3.
+    Returns None for records that can never be processed.
+    """
+    # 1️⃣ Parse body
+    try:
+        body = json.loads(record["body"])
+    except (KeyError, json.JSONDecodeError):
+        print("Invalid SQS message body")
+        return None
+
+    message_id = body.get("message_id")
+
+    # 2️⃣ Fallback to messageAttributes (optional but safe)
+    if not message_id:
+        attrs = record.get("messageAttributes", {})
+        if "message_id" in attrs:
+            message_id = attrs["message_id"]["stringValue"]
+
+    # 3️⃣ Validate
+    if not message_id:
+        print("message_id not found, skipping message")
+        return None
+
+    message = {
+        'record_id': record.get('messageId'),
+        'receipt_handle': record.get('receiptHandle'),
+        'message_id': message_id,
+        'email_from_raw': body.get("email_from_raw", body.get("email_from")),
+        'email_from': body.get("email_from"),
+        'email_name': body.get("email_name"),
+        'email_subject': body.get("email_subject"),
+        'deferrals': int(body.get('deferrals', 0)),
+        'images': [],
+        'results': [],
+        'failed': False,
+        'throttled': False
+    }
+
+    print(f"Processing message {message_id}")
+    debug(f"Files: {body.get('file_count')}, Images: {body.get('has_images')}")
+    debug(f"From: {message['email_from']}, Subject: {message['email_subject']}")
+    
+    attachments = body.get('attachments')
+    if attachments is None:
+        # Load metadata
+        metadata_key = f"injected/{message_id}/metadata.json"
+        metadata_obj = s3.get_object(Bucket=BUCKET_NAME, Key=metadata_key)
+        attachments = json.loads(metadata_obj['Body'].read())['attachments']
+    
+    # Only process images and PDFs
+    filenames = set()
+    for attachment in attachments:
+        # Emails injected before names were made unique can repeat one, receipt ids must not collide
+        attachment = dict(attachment, filename=unique_filename(attachment['filename'], filenames))
+        if attachment.get('skipped'):
+            # Filtered at injection (logo, tracking pixel, duplicate)
+            continue
+        if attachment['content_type'].startswith('image/'):
+            message['images'].append(attachment)
+        elif is_pdf(attachment['content_type'], attachment['filename']) and pdfium is not None:
+            message['images'].append(attachment)
+        else:
+            print(f"Skipping non-image file: {attachment['filename']}")
+
+    return message
+
+def make_receipt_id(message_id, filename):
+    return f"{message_id}_{filename}"
+
+def processed_receipt_ids(receipt_ids):
+    """Receipt ids already stored with status 'processed', so redeliveries can skip them"""
+    found = set()
+    keys = [{'receipt_id': receipt_id} for receipt_id in dict.fromkeys(receipt_ids)]
+    for start in range(0, len(keys), 100):
+        request = {
+            TABLE_NAME: {
+                'Keys': keys[start:start + 100],
+                'ProjectionExpression': 'receipt_id, #status',
+                'ExpressionAttributeNames': {'#status': 'status'}
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(TABLE_NAME, []):
+                if item.get('status') == 'processed':
+                    found.add(item['receipt_id'])
+            request = response.get('UnprocessedKeys')
+            if request:
+                time.sleep(0.05)
+    return found
+
+def claim_receipt(message, attachment, lease_until, owner):
+    """
+    Record an attachment as pending before it is sent to the model.
+    Returns False when another worker holds a live claim or the receipt is already processed,
+    a claim of the same owner (invocation) is taken over.
+    Pending items have no processed_at, so they never show up in the dashboard index.
+    """
+    receipt_id = make_receipt_id(message['message_id'], attachment['filename'])
+    try:
+        with metrics.timer('DynamoDB'):
+            dynamodb.meta.client.put_item(
+                TableName=TABLE_NAME,
+                Item={
+                    'receipt_id': receipt_id,
+                    'message_id': message['message_id'],
+                    'filename': attachment['filename'],
+                    's3_key': attachment['s3_key'],
+                    'email_from': message['email_from'],
+                    'status': 'pending',
+                    'claimed_at': datetime.utcnow().isoformat() + "Z",
+                    'claimed_by': owner,
+                    'lease_until': int(lease_until)
+                },
+                ConditionExpression='attribute_not_exists(receipt_id) OR '
+                                    '(#status = :pending AND (lease_until < :now OR claimed_by = :owner))',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':pending': 'pending',
+                    ':now': int(time.time()),
+                    ':owner': owner
+                }
+            )
+    except Exception as e:
+        if isinstance(e, ClientError) and e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        # Claims only prevent duplicate work, never block processing on them
+        print(f"Failed to claim {receipt_id}: {str(e)}")
+    return True
+
+def release_claim(message, attachment, owner):
+    """
+    Delete the claim of an attachment that wasn't stored, so the redelivered
+    or deferred message can claim it again instead of waiting for the lease.
+    """
+    receipt_id = make_receipt_id(message['message_id'], attachment['filename'])
+    try:
+        with metrics.timer('DynamoDB'):
+            dynamodb.meta.client.delete_item(
+                TableName=TABLE_NAME,
+                Key={'receipt_id': receipt_id},
+                ConditionExpression='#status = :pending AND claimed_by = :owner',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':pending': 'pending',
+                    ':owner': owner
+                }
+            )
+    except Exception as e:
+        if isinstance(e, ClientError) and e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return
+        # The claim expires with its lease
+        print(f"Failed to release claim {receipt_id}: {str(e)}")
+
+def build_item(message, attachment, file_size, receipt_info):
+    """DynamoDB item for an extracted receipt"""
+    message_id = message['message_id']
+    filename = attachment['filename']
+    processed_at = datetime.utcnow().isoformat() + "Z"
+    
+    return {
+        'receipt_id': make_receipt_id(message_id, filename),
+        'message_id': message_id,
+        'filename': filename,
+        's3_key': attachment['s3_key'],
+        'content_type': attachment['content_type'],
+        'file_size': file_size,
+        'email_from_raw': message['email_from_raw'],
+        'email_from': message['email_from'],
+        'email_name': message['email_name'],
+        'email_subject': message['email_subject'],
+        'processed_at': processed_at,
+        'receipt_data': receipt_info,
+        'status': 'processed',
+        'processing_timestamp': processed_at
+    }
+
+def aggregate_updates(item):
+    """TransactWriteItems updates adding a receipt to the sender's totals with atomic ADD operations"""
+    values = {
+        ':one': 1,
+        ':amount': receipt_amount(item['receipt_data']),
+        ':size': item['file_size'] or 0,
+        ':now': item['processed_at']
+    }
+    return [
+        {
+            'Update': {
+                'TableName': AGGREGATES_TABLE_NAME,
+                'Key': {
+                    'email_from': item['email_from'],
+                    'aggregate_key': aggregate_key
+                },
+                'UpdateExpression': 'ADD receipt_count :one, total_amount :amount, file_size :size SET updated_at = :now',
+                'ExpressionAttributeValues': values
+            }
+        }
+        for aggregate_key in aggregate_keys(item['receipt_data'], item['processed_at'])
+    ]
+
+def write_receipts(items):
+    """
+    Persist the receipts of one message, returns the items actually written.
+    
+    With aggregates every receipt is written in one transaction with its
+    aggregate updates, conditional on the receipt not being processed yet,
+    so redeliveries are never counted twice. Without aggregates the items
+    are flushed together with batch_writer.
+    """
+    if aggregates_table is None:
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+        return items
+    
+    written = []
+    for item in items:
+        put = {
+            'Put': {
+                'TableName': TABLE_NAME,
+                'Item': item,
+                'ConditionExpression': 'attribute_not_exists(receipt_id) OR #status <> :processed',
+                'ExpressionAttributeNames': {'#status': 'status'},
+                'ExpressionAttributeValues': {':processed': 'processed'}
+            }
+        }
+        try:
+            dynamodb.meta.client.transact_write_items(TransactItems=[put] + aggregate_updates(item))
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons') or [{}]
+            if e.response['Error']['Code'] == 'TransactionCanceledException' and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                print(f"Receipt already processed: {item['receipt_id']}")
+                continue
+            raise
+        written.append(item)
+    return written
+
+def flush_message(message):
+    """Write all receipts extracted for a message, new ones are queued for the notification email"""
+    extracted, message['extracted'] = message['extracted'], []
+    if not extracted:
+        return
+    
+    items = [
+        build_item(message, attachment, file_size, receipt_info)
+        for attachment, file_size, receipt_info in extracted
+    ]
+    with metrics.timer('DynamoDB'):
+        written = {item['receipt_id'] for item in write_receipts(items)}
+    
+    for item, (attachment, file_size, receipt_info) in zip(items, extracted):
+        receipt_id = item['receipt_id']
+        if receipt_id not in written:
+            message['results'].append({
+                'filename': item['filename'],
+                'receipt_id': receipt_id,
+                'status': 'duplicate'
+            })
+            continue
+        
+        debug(f"Saved to DynamoDB: {receipt_id}")
+        message['results'].append({
+            'filename': item['filename'],
+            'receipt_id': receipt_id,
+            'status': 'success',
+            'data': receipt_info
+        })
+        message['notify'].append((receipt_id, item['filename'], receipt_info))
+
 def lambda_handler(event, context):
     """
     Process receipt files from /injected/{message_id}/files/
     Send to OpenRouter for analysis
     Save results to DynamoDB
+    
+    All records of the batch are processed together, failed records are
+    reported back to SQS through batchItemFailures so only they are retried.
     """
+    metrics.begin(context)
+    records = event.get("Records", [])
+    cache_before = extraction_cache.snapshot()
+    model_before = model_client.snapshot()
+    limiter_before = model_limiter.snapshot()
+    messages = []
+    records_by_id = {}
+    batch_item_failures = []
+    deferred = 0
     
-    for record in event.get("Records", []):
+    for record in records:
         try:
-            # 1️⃣ Parse body
-            try:
-                body = json.loads(record["body"])
-            except (KeyError, json.JSONDecodeError):
-                print("Invalid SQS message body")
-                continue
-
-            message_id = body.get("message_id")
-            file_count = body.get("file_count")
-            has_images = body.get("has_images")
-            email_from_raw = body.get("email_from_raw", body.get("email_from"))
-            email_from = body.get("email_from")
-            email_name = body.get("email_name")
-            email_subject = body.get("email_subject")
-
-            # 2️⃣ Fallback to messageAttributes (optional but safe)
-            if not message_id:
-                attrs = record.get("messageAttributes", {})
-                if "message_id" in attrs:
-                    message_id = attrs["message_id"]["stringValue"]
-
-            # 3️⃣ Validate
-            if not message_id:
-                print("message_id not found, skipping message")
+            with metrics.timer('Load'):
+                message = load_message(record)
+        except Exception as e:
+            print(f"Error loading record {record.get('messageId')}: {str(e)}")
+            batch_item_failures.append({'itemIdentifier': record.get('messageId')})
+            continue
+        if not message:
+            continue
+        # Heavy senders wait for their next window instead of holding up everyone else
+        if not sender_limiter.take(message['email_from'] or 'unknown', len(message['images'])):
+            if defer_message(record, message, sender_limiter):
+                deferred += 1
                 continue
-
-            print(f"Processing message {message_id}")
-            print(f"Files: {file_count}, Images: {has_images}")
-            print(f"From: {email_from}, Subject: {email_subject}")
-            
-            # Load metadata
-            metadata_key = f"injected/{message_id}/metadata.json"
-            metadata_obj = s3.get_object(Bucket=BUCKET_NAME, Key=metadata_key)
-            metadata = json.loads(metadata_obj['Body'].read())
-            
-            results = []
-            
-            # Process each file
-            for attachment in metadata['attachments']:
-                filename = attachment['filename']
-                s3_key = attachment['s3_key']
-                content_type = attachment['content_type']
-                
-                print(f"Processing file: {filename}")
-                
-                # Only process images
-                if not content_type.startswith('image/'):
-                    print(f"Skipping non-image file: {filename}")
+        messages.append(message)
+        records_by_id[message['record_id']] = record
+    
+    # Keep the batch invisible while the model is slow so SQS doesn't hand it to another worker
+    receipt_handles = [message['receipt_handle'] for message in messages if message['receipt_handle']]
+    with VisibilityHeartbeat(sqs, PROCESSING_QUEUE_URL, receipt_handles) as heartbeat:
+        # Redelivered messages skip receipts that were already stored
+        receipt_ids = [
+            make_receipt_id(message['message_id'], attachment['filename'])
+            for message in messages
+            for attachment in message['images']
+        ]
+        try:
+            with metrics.timer('DynamoDB'):
+                already_processed = processed_receipt_ids(receipt_ids)
+        except Exception as e:
+            print(f"Failed to check processed receipts: {str(e)}")
+            already_processed = set()
+        
+        # Download and extract images of all messages in parallel, persist each message once it's complete
+        deadline = invocation_deadline(context)
+        # Claims expire when this invocation ends, and never later than a redelivery of the message
+        owner = uuid.uuid4().hex
+        lease_until = time.time() + min(deadline - time.monotonic() + DEADLINE_MARGIN_SECONDS, QUEUE_VISIBILITY_TIMEOUT)
+        claims = []
+        for message in messages:
+            message['extracted'] = []
+            message['notify'] = []
+            message['outstanding'] = 0
+            message['claimed'] = []
+            for attachment in message['images']:
+                receipt_id = make_receipt_id(message['message_id'], attachment['filename'])
+                if receipt_id in already_processed:
+                    print(f"Skipping already processed file: {attachment['filename']}")
+                    message['results'].append({
+                        'filename': attachment['filename'],
+                        'receipt_id': receipt_id,
+                        'status': 'duplicate'
+                    })
                     continue
+                claims.append((message, attachment))
+        with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_WORKERS, len(claims)))) as claimer:
+            owned = list(claimer.map(lambda claim: claim_receipt(claim[0], claim[1], lease_until, owner), claims))
+        for (message, attachment), claimed in zip(claims, owned):
+            if claimed:
+                message['claimed'].append(attachment)
+                continue
+            # Redelivered later, by then the other worker stored it or its claim expired
+            print(f"File is being processed by another worker: {attachment['filename']}")
+            message['failed'] = True
+            message['results'].append({
+                'filename': attachment['filename'],
+                'receipt_id': make_receipt_id(message['message_id'], attachment['filename']),
+                'status': 'in_progress'
+            })
+        
+        batches = []
+        for message in messages:
+            for batch in plan_batches(message['claimed']):
+                batches.append((message, batch))
+                message['outstanding'] += 1
+            if not message['outstanding']:
+                heartbeat.release(message['receipt_handle'])
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_WORKERS, len(batches))))
+        pending = {}
+        for message, batch in batches:
+            pending[executor.submit(download_and_extract, batch, deadline)] = (message, batch)
+        
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    message, batch = pending.pop(future)
+                    message['outstanding'] -= 1
                 
-                # Download file from S3
-                file_obj = s3.get_object(Bucket=BUCKET_NAME, Key=s3_key)
-                file_data = file_obj['Body'].read()
-                
-                # Convert to base64
-                image_base64 = base64.b64encode(file_data).decode('utf-8')
+                    try:
+                        results, error = future.result(), None
+                    except Exception as e:
+                        print(f"Error processing files {', '.join(attachment['filename'] for attachment in batch)}: {str(e)}")
+                        message['failed'] = True
+                        results, error = None, str(e)
                 
-                # Send to OpenRouter
-                receipt_info = extract_receipt_info(image_base64, filename)
+                    for index, attachment in enumerate(batch):
+                        if error is not None:
+                            message['results'].append({
+                                'filename': attachment['filename'],
+                                'status': 'failed',
+                                'error': error
+                            })
+                            continue
+                        file_size, receipt_info, unavailable = results[index]
+                        if receipt_info:
+                            message['extracted'].append((attachment, file_size, receipt_info))
+                        elif unavailable:
+                            # Never acknowledged, the receipt is retried once the model or the quota is back
+                            if isinstance(unavailable, ModelThrottledError):
+                                message['throttled'] = True
+                            else:
+                                message['failed'] = True
+                            message['results'].append({
+                                'filename': attachment['filename'],
+                                'status': 'failed',
+                                'error': f"{unavailable}, will be retried"
+                            })
+                        else:
+                            message['results'].append({
+                                'filename': attachment['filename'],
+                                'status': 'failed',
+                                'error': 'Failed to extract receipt info'
+                            })
                 
-                if receipt_info:
-                    # Prepare DynamoDB item
-                    receipt_id = f"{message_id}_{filename}"
-                    
-                    item = {
-                        'receipt_id': receipt_id,
-                        'message_id': message_id,
-                        'filename': filename,
-                        's3_key': s3_key,
-                        'content_type': content_type,
-                        'file_size': len(file_data),
-                        'email_from_raw': email_from_raw,
-                        'email_from': email_from,
-                        'email_name': email_name,
-                        'email_subject': email_subject,
-                        'processed_at': datetime.utcnow().isoformat() + "Z",
-                        'receipt_data': convert_floats_to_decimal(receipt_info),
-                        'status': 'processed',
-                        'processing_timestamp': datetime.utcnow().isoformat() + "Z"
-                    }
-                    
-                    # Save to DynamoDB
-                    table.put_item(Item=item)
-                    
-                    results.append({
-                        'filename': filename,
-                        'receipt_id': receipt_id,
-                        'status': 'success',
-                        'data': receipt_info
-                    })
-                    
-                    print(f"Saved to DynamoDB: {receipt_id}")
-                    
-                    # Send email notification
-                    send_email(receipt_id, filename, email_from)
-                    
-                else:
-                    results.append({
-                        'filename': filename,
-                        'status': 'failed',
-                        'error': 'Failed to extract receipt info'
-                    })
-            
-            return {
-                'statusCode': 200,
-                'body': json.dumps({
-                    'message_id': message_id,
-                    'processed_files': len(results),
-                    'results': results
-                }, default=str)
-            }
-            
-        except Exception as e:
-            print(f"Error processing record: {str(e)}")
-            # Continue processing other records if there are multiple
-            continue
+                    if message['outstanding'] == 0:
+                        try:
+                            flush_message(message)
+                        except Exception as e:
+                            print(f"Error saving message {message['message_id']}: {str(e)}")
+                            message['failed'] = True
+                        heartbeat.release(message['receipt_handle'])
+        finally:
+            # Don't block the handler on attachments that missed the deadline
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        for message, batch in pending.values():
+            message['failed'] = True
+            for attachment in batch:
+                print(f"Deadline exceeded for file: {attachment['filename']}")
+                message['results'].append({
+                    'filename': attachment['filename'],
+                    'status': 'failed',
+                    'error': 'Deadline exceeded'
+                })
+        
+        # Keep what finished in time, the redelivery only redoes the rest
+        for message in messages:
+            try:
+                flush_message(message)
+            except Exception as e:
+                print(f"Error saving message {message['message_id']}: {str(e)}")
+                message['failed'] = True
+        
+        # Claims of attachments that weren't stored would block the retry of their message
+        unstored = []
+        for message in messages:
+            stored = {result.get('receipt_id') for result in message['results'] if result['status'] in ('success', 'duplicate')}
+            unstored.extend(
+                (message, attachment) for attachment in message['claimed']
+                if make_receipt_id(message['message_id'], attachment['filename']) not in stored
+            )
+        if unstored:
+            with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_WORKERS, len(unstored)))) as releaser:
+                list(releaser.map(lambda claim: release_claim(claim[0], claim[1], owner), unstored))
+        
+        # One summary email per message, sent once extraction is over so SES never gates it
+        for message in messages:
+            if message['notify']:
+                with metrics.timer('SES'):
+                    send_email(message['message_id'], message['notify'], message['email_from'])
+    
+    for message in messages:
+        # Throttled receipts come back when the model quota refills, stored ones are skipped then
+        if message['throttled'] and not message['failed']:
+            if defer_message(records_by_id[message['record_id']], message, model_limiter):
+                deferred += 1
+            else:
+                message['failed'] = True
+        if message['failed']:
+            batch_item_failures.append({'itemIdentifier': message['record_id']})
+    
+    cache_stats = stats_delta(cache_before, extraction_cache.snapshot())
+    debug(f"Extraction cache: {cache_stats}")
+    model_stats = stats_delta(model_before, model_client.snapshot())
+    debug(f"Model client: {model_stats}")
+    
+    results = [result for message in messages for result in message['results']]
+    limiter_stats = stats_delta(limiter_before, model_limiter.snapshot())
+    
+    metrics.count('Messages', len(messages))
+    metrics.count('DeferredMessages', deferred)
+    metrics.count('FailedRecords', len(batch_item_failures))
+    metrics.count('Receipts', sum(1 for result in results if result['status'] == 'success'))
+    metrics.count('Duplicates', sum(1 for result in results if result['status'] in ('duplicate', 'in_progress')))
+    metrics.count('ExtractionFailures', sum(1 for result in results if result['status'] == 'failed'))
+    metrics.count('CacheHits', cache_stats['hits'])
+    metrics.count('CacheMisses', cache_stats['misses'])
+    metrics.count('ModelRequests', model_stats['requests'])
+    metrics.count('ModelRetries', model_stats['retries'])
+    metrics.count('ModelFailures', model_stats['failures'])
+    metrics.count('ModelRejected', model_stats['rejected'])
+    metrics.count('ModelThrottled', limiter_stats['throttled'])
+    metrics.flush()
     
-    # Return success even if no records were processed
     return {
         'statusCode': 200,
-        'body': json.dumps({
+        'body': dumps({
             'message': 'Processing completed',
-            'processed_records': len(event.get("Records", []))
-        })
-    }
\ No newline at end of file
+            'processed_records': len(records),
+            'failed_records': len(batch_item_failures),
+            'deferred_records': deferred,
+            'cache': cache_stats,
+            'model': model_stats,
+            'messages': [
+                {
+                    'message_id': message['message_id'],
+                    'processed_files': len(message['results']),
+                    'results': message['results']
+                }
+                for message in messages
+            ]
+        }),
+        'batchItemFailures': batch_item_failures
+    }
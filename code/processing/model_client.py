@@ -0,0 +1,189 @@
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+
+# Ships with botocore in the Lambda runtime, unlike requests which had to be bundled
+import urllib3
+
+OPENROUTER_URL = os.environ.get('OPENROUTER_URL', 'https://openrouter.ai/api/v1/chat/completions')
+MODEL_MAX_RETRIES = int(os.environ.get('MODEL_MAX_RETRIES', '3'))
+MODEL_BACKOFF_BASE = float(os.environ.get('MODEL_BACKOFF_BASE', '0.5'))
+MODEL_BACKOFF_MAX = float(os.environ.get('MODEL_BACKOFF_MAX', '8'))
+# Consecutive upstream failures before requests are rejected without calling the model
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ModelRequestError(Exception):
+    """No usable response was received from the model"""
+
+
+class ModelUnavailableError(ModelRequestError):
+    """The model can't answer right now, the request is worth retrying later"""
+
+
+class CircuitOpenError(ModelUnavailableError):
+    """Raised instead of calling a model that keeps failing"""
+
+
+class ModelResponse:
+    """Status, headers and decoded body of a model response"""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code in RETRY_STATUS_CODES:
+            raise ModelUnavailableError(f"{self.status_code} error from model: {self.text[:200]}")
+        if self.status_code >= 400:
+            raise ModelRequestError(f"{self.status_code} error from model: {self.text[:200]}")
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelClient:
+    """
+    HTTP client for the OpenRouter chat completions API.
+
+    Keeps a keep-alive connection pool for the lifetime of the container,
+    retries 429/5xx and connection errors with exponential backoff and full
+    jitter (honoring Retry-After), and opens a circuit breaker after repeated
+    upstream failures so a degraded model doesn't burn the Lambda timeout.
+    """
+
+    def __init__(self, url=OPENROUTER_URL, pool_size=10, max_retries=MODEL_MAX_RETRIES,
+                 backoff_base=MODEL_BACKOFF_BASE, backoff_max=MODEL_BACKOFF_MAX,
+                 failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self.pool = urllib3.PoolManager(num_pools=1, maxsize=pool_size)
+        self.headers = {
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            'Content-Type': 'application/json'
+        }
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: let a single probe through once the reset period passed
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.opened_at = time.monotonic()
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def _record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def _record_failure(self):
+        with self.lock:
+            self.stats['failures'] += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Circuit opened after {self.consecutive_failures} consecutive model failures")
+                self.opened_at = time.monotonic()
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def post(self, payload, headers=None, timeout=60):
+        """
+        POST a JSON payload, retrying transient failures within timeout seconds.
+        Returns the last response, raises ModelUnavailableError when no response was received.
+        """
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        body = json.dumps(payload).encode('utf-8')
+        headers = {**self.headers, **(headers or {})}
+
+        while True:
+            if not self._allow_request():
+                raise CircuitOpenError('Model circuit breaker is open')
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ModelUnavailableError('Model request deadline exceeded')
+
+            self._count('requests')
+            retry_after = None
+            try:
+                raw = self.pool.request('POST', self.url, body=body, headers=headers,
+                                        timeout=urllib3.Timeout(total=remaining), retries=False)
+                response = ModelResponse(raw.status, raw.headers, raw.data)
+            except urllib3.exceptions.HTTPError as e:
+                self._record_failure()
+                error, response = ModelUnavailableError(f"Model request failed: {e}"), None
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self._record_success()
+                    return response
+                # Rate limiting says nothing about upstream health
+                if response.status_code != 429:
+                    self._record_failure()
+                error = None
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+            delay = self._backoff(attempt, retry_after)
+            if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise error
+
+            attempt += 1
+            self._count('retries')
+            print(f"Retrying model request in {delay:.2f}s (attempt {attempt}/{self.max_retries})")
+            time.sleep(delay)
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['circuit_open'] = self.opened_at is not None
+        return stats
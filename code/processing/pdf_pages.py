@@ -0,0 +1,115 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from image_preprocessing import IMAGE_FORMAT, IMAGE_GRAYSCALE, IMAGE_MAX_DIMENSION, IMAGE_QUALITY, MIME_TYPES, Image
+
+# pypdfium2 comes from a layer in processing_layers, without it PDF attachments are skipped
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# Pages of a PDF looked at, receipts and invoices rarely need more
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '4'))
+# Rasterization resolution, lowered further so no page side exceeds IMAGE_MAX_DIMENSION
+PDF_DPI = float(os.environ.get('PDF_DPI', '150'))
+# A text layer shorter than this is treated as a scan and the pages are rasterized
+PDF_MIN_TEXT_CHARS = int(os.environ.get('PDF_MIN_TEXT_CHARS', '80'))
+# Text sent to the model is cut to this length
+PDF_MAX_TEXT_CHARS = int(os.environ.get('PDF_MAX_TEXT_CHARS', '12000'))
+# Pages encoded in parallel, also the number of rendered pages held in memory at once
+PDF_PAGE_WORKERS = int(os.environ.get('PDF_PAGE_WORKERS', '2'))
+
+# PDFium is not thread-safe, documents are only opened, read and rendered under this lock
+pdfium_lock = threading.Lock()
+
+
+def can_rasterize():
+    return pdfium is not None and Image is not None
+
+
+def pdf_signature():
+    """Describes how PDFs are turned into model input, part of the extraction cache key"""
+    return f"pdf:{PDF_MAX_PAGES}:{PDF_DPI:g}:{PDF_MIN_TEXT_CHARS}"
+
+
+def page_scale(page):
+    """Render scale of a page at PDF_DPI, capped so the longer side fits IMAGE_MAX_DIMENSION"""
+    width, height = page.get_size()
+    scale = PDF_DPI / 72
+    longest = max(width, height) * scale
+    if longest > IMAGE_MAX_DIMENSION:
+        scale *= IMAGE_MAX_DIMENSION / longest
+    return scale
+
+
+def encode_page(image):
+    output = io.BytesIO()
+    image.save(output, format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
+    image.close()
+    return output.getvalue()
+
+
+class PdfDocument:
+    """
+    Text layer and rendered pages of a PDF attachment.
+
+    Rendering is serialized on the PDFium lock while pages already rendered
+    are encoded in parallel, with at most PDF_PAGE_WORKERS bitmaps alive at
+    any time, so memory is bounded by a few pages of IMAGE_MAX_DIMENSION.
+    """
+
+    def __init__(self, data):
+        with pdfium_lock:
+            self.document = pdfium.PdfDocument(data)
+            self.page_count = len(self.document)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with pdfium_lock:
+            self.document.close()
+
+    def text(self):
+        """Embedded text of the first PDF_MAX_PAGES pages"""
+        texts = []
+        with pdfium_lock:
+            for index in range(min(self.page_count, PDF_MAX_PAGES)):
+                page = self.document[index]
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range().strip())
+                textpage.close()
+                page.close()
+        return '\n\n'.join(text for text in texts if text)
+
+    def render(self, index):
+        with pdfium_lock:
+            page = self.document[index]
+            bitmap = page.render(scale=page_scale(page), grayscale=IMAGE_GRAYSCALE)
+            image = bitmap.to_pil()
+            # to_pil shares the bitmap buffer, copy before PDFium frees it
+            image = image.convert('L' if IMAGE_GRAYSCALE else 'RGB')
+            bitmap.close()
+            page.close()
+        return image
+
+    def pages(self):
+        """Encoded images of the first PDF_MAX_PAGES pages, in page order"""
+        count = min(self.page_count, PDF_MAX_PAGES)
+        results = [None] * count
+        with ThreadPoolExecutor(max_workers=max(1, PDF_PAGE_WORKERS)) as executor:
+            pending = []
+            for index in range(count):
+                if len(pending) >= PDF_PAGE_WORKERS:
+                    done_index, future = pending.pop(0)
+                    results[done_index] = future.result()
+                pending.append((index, executor.submit(encode_page, self.render(index))))
+            for index, future in pending:
+                results[index] = future.result()
+        return [(data, MIME_TYPES.get(IMAGE_FORMAT, 'image/jpeg')) for data in results]
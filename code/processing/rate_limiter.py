@@ -0,0 +1,101 @@
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from clients import client as aws_client
+
+RATE_LIMIT_TABLE_NAME = os.environ.get('RATE_LIMIT_TABLE_NAME')
+# Model requests allowed per window across every processing Lambda, 0 disables the limit
+MODEL_RATE_LIMIT = int(os.environ.get('MODEL_RATE_LIMIT', '0'))
+MODEL_RATE_WINDOW_SECONDS = int(os.environ.get('MODEL_RATE_WINDOW_SECONDS', '60'))
+# Receipts of one sender processed per window before their messages are deferred, 0 disables it
+SENDER_RATE_LIMIT = int(os.environ.get('SENDER_RATE_LIMIT', '0'))
+SENDER_WINDOW_SECONDS = int(os.environ.get('SENDER_WINDOW_SECONDS', '300'))
+# Waiters wake up spread over this many seconds after a refill instead of all at once
+REFILL_JITTER_SECONDS = float(os.environ.get('REFILL_JITTER_SECONDS', '1'))
+
+
+class RateLimiter:
+    """
+    Token buckets kept in DynamoDB, refilled to `limit` at the start of every window.
+
+    Each bucket and window has its own item and tokens are taken with a single
+    conditional ADD on its counter, so Lambdas running concurrently never hand
+    out more than `limit` tokens per window and never read the item first.
+    Items expire through DynamoDB TTL on 'expires_at'. When the table can't be
+    reached the limiter lets requests through rather than stalling the queue.
+    """
+
+    def __init__(self, name, limit, window_seconds, table_name=RATE_LIMIT_TABLE_NAME, client=None):
+        self.name = name
+        self.limit = limit
+        self.window_seconds = max(1, window_seconds)
+        self.table_name = table_name
+        self.client = client
+        self.lock = threading.Lock()
+        self.stats = {'taken': 0, 'throttled': 0, 'waits': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.table_name) and self.limit > 0
+
+    def _client(self):
+        if self.client is None:
+            self.client = aws_client('dynamodb')
+        return self.client
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def seconds_until_refill(self):
+        return self.window_seconds - time.time() % self.window_seconds
+
+    def take(self, bucket='global', amount=1):
+        """
+        Take `amount` tokens from the current window of a bucket, False when it
+        doesn't have them. More than `limit` tokens only fit an untouched window.
+        """
+        if not self.enabled or amount <= 0:
+            return True
+        window = int(time.time() // self.window_seconds) * self.window_seconds
+        try:
+            self._client().update_item(
+                TableName=self.table_name,
+                Key={'limit_key': {'S': f"{self.name}#{bucket}#{window}"}},
+                UpdateExpression='ADD tokens :amount SET expires_at = :expires_at',
+                ConditionExpression='attribute_not_exists(tokens) OR tokens <= :ceiling',
+                ExpressionAttributeValues={
+                    ':amount': {'N': str(amount)},
+                    ':ceiling': {'N': str(max(self.limit - amount, 0))},
+                    ':expires_at': {'N': str(window + 2 * self.window_seconds)}
+                }
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                self._count('throttled')
+                return False
+            print(f"Rate limiter {self.name} error: {str(e)}")
+            self._count('errors')
+        except Exception as e:
+            print(f"Rate limiter {self.name} error: {str(e)}")
+            self._count('errors')
+        self._count('taken')
+        return True
+
+    def acquire(self, deadline, bucket='global'):
+        """Wait for a token until the monotonic deadline, False when none was free in time"""
+        while not self.take(bucket):
+            delay = self.seconds_until_refill() + random.uniform(0, REFILL_JITTER_SECONDS)
+            if time.monotonic() + delay >= deadline:
+                return False
+            self._count('waits')
+            time.sleep(delay)
+        return True
+
+    def snapshot(self):
+        """Counters since the container started"""
+        with self.lock:
+            return dict(self.stats)
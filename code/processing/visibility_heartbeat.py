@@ -0,0 +1,75 @@
+import os
+import threading
+
+# Seconds between visibility extensions, 0 disables the heartbeat
+VISIBILITY_HEARTBEAT_SECONDS = float(os.environ.get('VISIBILITY_HEARTBEAT_SECONDS', '30'))
+# Visibility timeout set on every heartbeat, must outlast the interval
+VISIBILITY_EXTENSION_SECONDS = int(os.environ.get('VISIBILITY_EXTENSION_SECONDS', '90'))
+
+
+class VisibilityHeartbeat:
+    """
+    Keep SQS messages invisible while they are being worked on.
+
+    A daemon thread extends the visibility timeout of every tracked receipt
+    handle, so a slow model doesn't make SQS redeliver a message to another
+    worker that would race this one. Handles are released once their
+    message is persisted.
+    """
+
+    def __init__(self, sqs, queue_url, receipt_handles, interval=VISIBILITY_HEARTBEAT_SECONDS,
+                 extension=VISIBILITY_EXTENSION_SECONDS):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.handles = set(receipt_handles)
+        self.interval = interval
+        self.extension = extension
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.beats = 0
+
+    def start(self):
+        if not self.queue_url or self.interval <= 0 or not self.handles:
+            return self
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def release(self, receipt_handle):
+        with self.lock:
+            self.handles.discard(receipt_handle)
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                handles = sorted(self.handles)
+            if not handles:
+                return
+            self._extend(handles)
+
+    def _extend(self, handles):
+        # ChangeMessageVisibilityBatch takes at most 10 entries
+        for start in range(0, len(handles), 10):
+            entries = [
+                {'Id': str(index), 'ReceiptHandle': handle, 'VisibilityTimeout': self.extension}
+                for index, handle in enumerate(handles[start:start + 10])
+            ]
+            try:
+                response = self.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+                for failure in response.get('Failed', []):
+                    print(f"Visibility extension failed: {failure.get('Code')} {failure.get('Message')}")
+            except Exception as e:
+                print(f"Visibility heartbeat error: {str(e)}")
+        self.beats += 1
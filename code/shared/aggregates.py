@@ -0,0 +1,64 @@
+"""
+Per-user dashboard totals.
+
+The processing lambda adds every receipt to its sender's aggregate items
+(summary, month#, merchant#, currency#, payment#) as it is stored.
+getmessages and scripts/backfill_aggregates.py compute the same items
+from stored receipts, for users whose receipts predate the aggregates.
+"""
+import re
+from decimal import Decimal
+
+
+def parse_amount(value):
+    """total_amount as Decimal, models sometimes return strings like '12,50'"""
+    try:
+        return Decimal(str(value).replace(',', '.').strip())
+    except Exception:
+        return Decimal('0')
+
+
+def receipt_amount(receipt_info):
+    """Amount a receipt adds to the totals, 0 when it isn't a finite number"""
+    amount = parse_amount(receipt_info.get('total_amount'))
+    return amount if amount.is_finite() else Decimal('0')
+
+
+def aggregate_keys(receipt_info, processed_at):
+    """Aggregate records a receipt contributes to"""
+    date = str(receipt_info.get('date') or '')
+    month = date[:7] if re.match(r'^\d{4}-\d{2}', date) else processed_at[:7]
+    merchant = str(receipt_info.get('merchant_name') or '').strip() or 'Unknown'
+    currency = str(receipt_info.get('currency') or '').strip().upper() or 'UNKNOWN'
+    payment_method = str(receipt_info.get('payment_method') or '').strip().lower() or 'other'
+    return [
+        'summary',
+        f'month#{month}',
+        f'merchant#{merchant}',
+        f'currency#{currency}',
+        f'payment#{payment_method}'
+    ]
+
+
+def summarize(receipts):
+    """
+    {aggregate_key: totals} of stored receipts (receipt_data, file_size,
+    processed_at), the values the incremental updates add up to.
+    """
+    totals = {}
+    for receipt in receipts:
+        receipt_info = receipt.get('receipt_data') or {}
+        processed_at = receipt.get('processed_at') or ''
+        amount = receipt_amount(receipt_info)
+        for aggregate_key in aggregate_keys(receipt_info, processed_at):
+            entry = totals.setdefault(aggregate_key, {
+                'receipt_count': 0,
+                'total_amount': Decimal('0'),
+                'file_size': 0,
+                'updated_at': processed_at
+            })
+            entry['receipt_count'] += 1
+            entry['total_amount'] += amount
+            entry['file_size'] += int(receipt.get('file_size') or 0)
+            entry['updated_at'] = max(entry['updated_at'], processed_at)
+    return totals
@@ -0,0 +1,29 @@
+"""
+Attachment classification shared by the injection and processing lambdas,
+so both stages agree on which attachments are receipts to extract.
+"""
+
+
+def is_pdf(content_type, filename=''):
+    content_type = (content_type or '').lower()
+    if content_type == 'application/pdf':
+        return True
+    # Some mail clients don't know the type of attached files
+    return content_type in ('', 'application/octet-stream') and (filename or '').lower().endswith('.pdf')
+
+
+def unique_filename(filename, taken):
+    """
+    filename, or 'name (2).ext' when another attachment of the email already
+    has it. Receipt ids and S3 keys are made from the file name, so names
+    must be unique within an email. The name returned is added to taken.
+    """
+    stem, dot, extension = filename.rpartition('.')
+    if not dot:
+        stem, extension = filename, ''
+    candidate, number = filename, 1
+    while candidate in taken:
+        number += 1
+        candidate = f"{stem} ({number}){dot}{extension}"
+    taken.add(candidate)
+    return candidate
@@ -0,0 +1,61 @@
+"""
+Lazily built, cached AWS clients shared by the Lambdas.
+
+Creating a boto3 client loads and parses its service model, a resource
+loads a second one on top, which adds tens of milliseconds per service to
+every cold start. Handlers declare their clients as lazy proxies instead,
+so an invocation only builds the clients it actually calls and every
+later invocation of the container reuses them.
+"""
+import threading
+
+import boto3
+
+_lock = threading.RLock()
+_cache = {}
+
+
+def _cached(key, factory):
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+    # The default boto3 session is not thread-safe while it creates clients
+    with _lock:
+        if key not in _cache:
+            _cache[key] = factory()
+        return _cache[key]
+
+
+def client(service, **kwargs):
+    return _cached(('client', service, tuple(sorted(kwargs.items()))), lambda: boto3.client(service, **kwargs))
+
+
+def resource(service, **kwargs):
+    return _cached(('resource', service, tuple(sorted(kwargs.items()))), lambda: boto3.resource(service, **kwargs))
+
+
+def table(name):
+    return _cached(('table', name), lambda: resource('dynamodb').Table(name))
+
+
+class Lazy:
+    """Stands in for an object that is built on first attribute access"""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+def lazy_client(service, **kwargs):
+    return Lazy(lambda: client(service, **kwargs))
+
+
+def lazy_resource(service, **kwargs):
+    return Lazy(lambda: resource(service, **kwargs))
+
+
+def lazy_table(name):
+    return Lazy(lambda: table(name))
@@ -0,0 +1,22 @@
+"""
+JSON encoding of DynamoDB data in a single pass.
+
+boto3 returns numbers as Decimal, which json can't serialize. Instead of
+copying every item into a float-converted structure first, the encoder
+calls json_default for the values it doesn't know, so items go straight
+from DynamoDB to the response body.
+"""
+import json
+from decimal import Decimal
+
+
+def json_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj, **kwargs):
+    return json.dumps(obj, default=json_default, **kwargs)
@@ -0,0 +1,131 @@
+"""
+Hot-path instrumentation shared by the Lambdas, deployed as a Lambda layer.
+
+Stage timers and counters are collected per invocation and written as one
+CloudWatch Embedded Metric Format (EMF) log line, which CloudWatch turns
+into metrics without any PutMetricData calls. Invocations are sampled with
+METRICS_SAMPLE_RATE (the rate is logged with every line so sums can be
+scaled back up) and chatty logs are gated by LOG_LEVEL.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'ReceiptProcessor')
+# Share of invocations that emit metrics, 0 disables them
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1'))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+# Module state survives warm invocations, so only the first one sees True
+_cold_start = True
+
+
+def log_enabled(level):
+    return LEVELS.get(level, 20) >= LEVELS.get(LOG_LEVEL, 20)
+
+
+def debug(message):
+    """Print only when LOG_LEVEL is DEBUG, for payload dumps and per-request chatter"""
+    if log_enabled('DEBUG'):
+        print(message)
+
+
+class Metrics:
+    """
+    Per-invocation timers and counters of one Lambda.
+
+    Thread-safe, stages timed in parallel workers add up their durations.
+    Counter names ending in Bytes are reported in bytes, timers in
+    milliseconds and everything else as a count.
+    """
+
+    def __init__(self, service, namespace=METRICS_NAMESPACE, sample_rate=METRICS_SAMPLE_RATE):
+        self.service = service
+        self.namespace = namespace
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = defaultdict(float)
+            self.counters = defaultdict(float)
+            self.properties = {}
+        self.sampled = False
+        self.started = time.perf_counter()
+
+    def begin(self, context=None):
+        """Start collecting for a new invocation"""
+        global _cold_start
+        self.reset()
+        self.cold_start, _cold_start = _cold_start, False
+        self.sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        request_id = getattr(context, 'aws_request_id', None)
+        if request_id:
+            self.properties['RequestId'] = request_id
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, (time.perf_counter() - start) * 1000)
+
+    def add_time(self, stage, milliseconds):
+        with self.lock:
+            self.timings[stage] += milliseconds
+
+    def count(self, name, value=1):
+        if value:
+            with self.lock:
+                self.counters[name] += value
+
+    def set_property(self, name, value):
+        with self.lock:
+            self.properties[name] = value
+
+    def document(self):
+        """EMF document of everything collected so far"""
+        with self.lock:
+            timings = dict(self.timings)
+            counters = dict(self.counters)
+            properties = dict(self.properties)
+        timings['Total'] = (time.perf_counter() - self.started) * 1000
+        counters['ColdStart'] = 1 if self.cold_start else 0
+
+        definitions = []
+        values = {}
+        for stage, milliseconds in timings.items():
+            definitions.append({'Name': f'{stage}Time', 'Unit': 'Milliseconds'})
+            values[f'{stage}Time'] = round(milliseconds, 3)
+        for name, value in counters.items():
+            definitions.append({'Name': name, 'Unit': 'Bytes' if name.endswith('Bytes') else 'Count'})
+            values[name] = int(value) if float(value).is_integer() else value
+
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service']],
+                    'Metrics': definitions
+                }]
+            },
+            'Service': self.service,
+            'SampleRate': self.sample_rate,
+            **properties,
+            **values
+        }
+
+    def flush(self):
+        """Write the invocation's EMF line when it was sampled"""
+        if self.sampled:
+            print(json.dumps(self.document(), separators=(',', ':'), default=str))
+        self.sampled = False
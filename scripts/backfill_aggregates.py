@@ -0,0 +1,99 @@
+"""
+One-off backfill of the per-user dashboard aggregates.
+
+The processing lambda only adds receipts to the aggregates as it stores
+them, receipts stored before the aggregates existed are missing from the
+totals. This scans the receipts table and rewrites every user's aggregate
+items from all their processed receipts, the values the incremental
+updates add up to. The result only depends on the receipts table, so
+running it again is harmless: receipts stored while it runs may be missed
+or counted twice, a second run (or one with the processing trigger
+disabled) makes the totals exact.
+
+Usage:
+    python scripts/backfill_aggregates.py --environment prod --dry-run
+    python scripts/backfill_aggregates.py --receipts-table prod-receipts-table --aggregates-table prod-user-aggregates
+"""
+import argparse
+import os
+import sys
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code', 'shared'))
+
+from aggregates import summarize
+
+
+def scan_receipts(table):
+    """{email_from: [receipt]} of every processed receipt"""
+    receipts = {}
+    scan = {
+        'ProjectionExpression': '#email_from, #receipt_data, #file_size, #processed_at, #status',
+        'ExpressionAttributeNames': {
+            '#email_from': 'email_from',
+            '#receipt_data': 'receipt_data',
+            '#file_size': 'file_size',
+            '#processed_at': 'processed_at',
+            '#status': 'status'
+        }
+    }
+    while True:
+        response = table.scan(**scan)
+        for item in response.get('Items', []):
+            # Claims of receipts still being processed are not counted
+            if item.get('status') == 'processed' and item.get('email_from'):
+                receipts.setdefault(item['email_from'], []).append(item)
+        if 'LastEvaluatedKey' not in response:
+            return receipts
+        scan['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def existing_keys(table, email):
+    keys = set()
+    query = {'KeyConditionExpression': Key('email_from').eq(email), 'ProjectionExpression': 'aggregate_key'}
+    while True:
+        response = table.query(**query)
+        keys.update(item['aggregate_key'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return keys
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def backfill(receipts_table, aggregates_table, dry_run=False):
+    users = scan_receipts(receipts_table)
+    for email, receipts in sorted(users.items()):
+        totals = summarize(receipts)
+        stale = existing_keys(aggregates_table, email) - set(totals)
+        print(f"{email}: {len(receipts)} receipts, {len(totals)} aggregates, {len(stale)} stale")
+        if dry_run:
+            continue
+        with aggregates_table.batch_writer() as batch:
+            for aggregate_key, entry in totals.items():
+                batch.put_item(Item=dict(entry, email_from=email, aggregate_key=aggregate_key))
+            for aggregate_key in stale:
+                batch.delete_item(Key={'email_from': email, 'aggregate_key': aggregate_key})
+    return len(users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--environment', help='environment prefix of the Terraform table names')
+    parser.add_argument('--receipts-table', help='defaults to <environment>-receipts-table')
+    parser.add_argument('--aggregates-table', help='defaults to <environment>-user-aggregates')
+    parser.add_argument('--dry-run', action='store_true', help='only print what would be written')
+    args = parser.parse_args()
+
+    receipts_table = args.receipts_table or args.environment and f"{args.environment}-receipts-table"
+    aggregates_table = args.aggregates_table or args.environment and f"{args.environment}-user-aggregates"
+    if not receipts_table or not aggregates_table:
+        parser.error('--environment or both table names are required')
+
+    dynamodb = boto3.resource('dynamodb')
+    users = backfill(dynamodb.Table(receipts_table), dynamodb.Table(aggregates_table), args.dry_run)
+    print(f"Backfilled {users} users")
+
+
+if __name__ == '__main__':
+    main()
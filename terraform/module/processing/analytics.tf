@@ -0,0 +1,122 @@
+# Compaction merges the small Parquet files stream batches leave in every partition
+resource "aws_cloudwatch_event_rule" "export_compaction" {
+  name                = "${var.environment}-export-compaction"
+  schedule_expression = try(var.processing_config.compaction_schedule, "rate(6 hours)")
+  tags                = var.tags
+}
+
+resource "aws_cloudwatch_event_target" "export_compaction" {
+  rule = aws_cloudwatch_event_rule.export_compaction.name
+  arn  = aws_lambda_function.export.arn
+}
+
+resource "aws_lambda_permission" "export_compaction" {
+  statement_id  = "AllowCompactionSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.export.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.export_compaction.arn
+}
+
+# Athena table over the dataset, partition projection resolves user/year/month from the query without crawlers
+resource "aws_glue_catalog_database" "analytics" {
+  name = replace("${var.environment}_receipts", "-", "_")
+}
+
+resource "aws_glue_catalog_table" "receipts" {
+  name          = "receipts"
+  database_name = aws_glue_catalog_database.analytics.name
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"            = "parquet"
+    "projection.enabled"        = "true"
+    # Users can't be enumerated, so every query needs an equality or IN predicate on user (the URL quoted
+    # email address). Queries across all users need another table over this location without projection.
+    "projection.user.type"      = "injected"
+    "projection.year.type"      = "integer"
+    "projection.year.range"     = "2000,2100"
+    "projection.month.type"     = "integer"
+    "projection.month.range"    = "1,12"
+    "projection.month.digits"   = "2"
+    "storage.location.template" = "s3://${aws_s3_bucket.main.id}/processed/receipts/user=$${user}/year=$${year}/month=$${month}"
+  }
+
+  partition_keys {
+    name = "user"
+    type = "string"
+  }
+
+  partition_keys {
+    name = "year"
+    type = "int"
+  }
+
+  partition_keys {
+    name = "month"
+    type = "int"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.main.id}/processed/receipts/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "receipt_id"
+      type = "string"
+    }
+    columns {
+      name = "message_id"
+      type = "string"
+    }
+    columns {
+      name = "filename"
+      type = "string"
+    }
+    columns {
+      name = "content_type"
+      type = "string"
+    }
+    columns {
+      name = "file_size"
+      type = "bigint"
+    }
+    columns {
+      name = "processed_at"
+      type = "timestamp"
+    }
+    columns {
+      name = "merchant_name"
+      type = "string"
+    }
+    columns {
+      name = "receipt_date"
+      type = "date"
+    }
+    columns {
+      name = "receipt_time"
+      type = "string"
+    }
+    columns {
+      name = "total_amount"
+      type = "double"
+    }
+    columns {
+      name = "currency"
+      type = "string"
+    }
+    columns {
+      name = "payment_method"
+      type = "string"
+    }
+    columns {
+      name = "sequence_number"
+      type = "string"
+    }
+  }
+}
@@ -19,10 +19,18 @@ resource "aws_dynamodb_table" "main" {
     type = "S"
   }
 
+  attribute {
+    name = "processed_at"
+    type = "S"
+  }
+
+  # Paginated, date-ranged listing for the frontend, only the rendered attributes are projected
   global_secondary_index {
-    name            = "email_from-index"
-    hash_key        = "email_from"
-    projection_type = "ALL"
+    name               = "email_from-processed_at-index"
+    hash_key           = "email_from"
+    range_key          = "processed_at"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["filename", "file_size", "receipt_data"]
   }
 
   global_secondary_index {
@@ -31,5 +39,99 @@ resource "aws_dynamodb_table" "main" {
     projection_type = "ALL"
   }
 
+  # Feeds the Parquet export of processed receipts
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
+  tags = var.tags
+}
+
+resource "aws_dynamodb_table" "extraction_cache" {
+  name           = "${var.environment}-extraction-cache"
+  billing_mode   = "PAY_PER_REQUEST"
+  table_class    = "STANDARD"
+  hash_key       = "cache_key"
+
+  attribute {
+    name = "cache_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
   tags = var.tags
 }
+
+# Per-user dashboard totals (summary, month#, merchant#, currency#, payment#) updated by processing
+resource "aws_dynamodb_table" "aggregates" {
+  name           = "${var.environment}-user-aggregates"
+  billing_mode   = "PAY_PER_REQUEST"
+  table_class    = "STANDARD"
+  hash_key       = "email_from"
+  range_key      = "aggregate_key"
+
+  attribute {
+    name = "email_from"
+    type = "S"
+  }
+
+  attribute {
+    name = "aggregate_key"
+    type = "S"
+  }
+
+  tags = var.tags
+}
+
+# Token buckets of the model quota and per sender fairness, one item per bucket and window
+resource "aws_dynamodb_table" "rate_limits" {
+  name           = "${var.environment}-rate-limits"
+  billing_mode   = "PAY_PER_REQUEST"
+  table_class    = "STANDARD"
+  hash_key       = "limit_key"
+
+  attribute {
+    name = "limit_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = var.tags
+}
+
+# Only receipts that reached 'processed' are exported, claims and pending items are filtered out before invoking
+resource "aws_lambda_event_source_mapping" "export_stream_trigger" {
+  event_source_arn  = aws_dynamodb_table.main.stream_arn
+  function_name     = aws_lambda_function.export.arn
+  starting_position = "LATEST"
+
+  batch_size                         = try(var.processing_config.export_batch_size, 1000)
+  maximum_batching_window_in_seconds = try(var.processing_config.export_batching_window, 60)
+  maximum_retry_attempts             = 10
+  bisect_batch_on_function_error     = true
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  filter_criteria {
+    filter {
+      pattern = jsonencode({
+        eventName = ["INSERT", "MODIFY"]
+        dynamodb = {
+          NewImage = {
+            status = { S = ["processed"] }
+          }
+        }
+      })
+    }
+  }
+
+  depends_on = [
+    aws_lambda_function.export
+  ]
+}
@@ -40,6 +40,27 @@ resource "aws_iam_role" "processing" {
 
 
 
+resource "aws_iam_role" "export" {
+  name = "Export"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Sid    = ""
+        Principal = {
+          Service = "lambda.amazonaws.com"
+        }
+      },
+    ]
+  })
+  tags = var.tags
+}
+
+
+
 resource "aws_iam_policy" "injection_policy" {
   name        = "${var.environment}-injection-policy"
   description = "Policy for Injection Lambda to access S3 and SQS"
@@ -62,7 +83,8 @@ resource "aws_iam_policy" "injection_policy" {
           "s3:PutObject",
           "s3:GetObject",
           "s3:ListBucket",
-          "s3:DeleteObject"
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ]
         Resource = [
           aws_s3_bucket.main.arn,
@@ -131,6 +153,7 @@ resource "aws_iam_policy" "processing_policy" {
           "dynamodb:DeleteItem",
           "dynamodb:Query",
           "dynamodb:Scan",
+          "dynamodb:BatchGetItem",
           "dynamodb:BatchWriteItem"
         ]
         Resource = [
@@ -138,13 +161,36 @@ resource "aws_iam_policy" "processing_policy" {
           "${aws_dynamodb_table.main.arn}/index/*"
         ]
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:PutItem"
+        ]
+        Resource = aws_dynamodb_table.extraction_cache.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:UpdateItem"
+        ]
+        Resource = aws_dynamodb_table.aggregates.arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:UpdateItem"
+        ]
+        Resource = aws_dynamodb_table.rate_limits.arn
+      },
       {
         Effect = "Allow"
         Action = [
           "sqs:ReceiveMessage",
           "sqs:DeleteMessage",
           "sqs:GetQueueAttributes",
-          "sqs:ChangeMessageVisibility"
+          "sqs:ChangeMessageVisibility",
+          "sqs:SendMessage"
         ]
         Resource = aws_sqs_queue.processing.arn
       }
@@ -162,6 +208,57 @@ resource "aws_iam_role_policy_attachment" "processing_policy_attach" {
   policy_arn = aws_iam_policy.processing_policy.arn
 }
 
+resource "aws_iam_policy" "export_policy" {
+  name        = "${var.environment}-export-policy"
+  description = "Policy for Export Lambda to read the receipts stream and write the Parquet dataset"
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect = "Allow"
+        Action = [
+          "logs:CreateLogGroup",
+          "logs:CreateLogStream",
+          "logs:PutLogEvents"
+        ]
+        Resource = "arn:aws:logs:*:*:*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams"
+        ]
+        Resource = aws_dynamodb_table.main.stream_arn
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:GetObject",
+          "s3:PutObject",
+          "s3:DeleteObject"
+        ]
+        Resource = "${aws_s3_bucket.main.arn}/processed/*"
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "s3:ListBucket"
+        ]
+        Resource = aws_s3_bucket.main.arn
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "export_policy_attach" {
+  role       = aws_iam_role.export.name
+  policy_arn = aws_iam_policy.export_policy.arn
+}
+
 
 
 data "aws_iam_policy_document" "injection" {
@@ -1,15 +1,73 @@
+# Code shared by all lambdas (metrics, lazy AWS clients, JSON encoding, dashboard aggregates), importable as a top level module from the layer
+data "archive_file" "shared_layer" {
+    type        = "zip"
+    output_path = "${path.root}/.terraform/shared-layer.zip"
+    source {
+      content  = file("${path.module}/../../../code/shared/metrics.py")
+      filename = "python/metrics.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/shared/clients.py")
+      filename = "python/clients.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/shared/json_encoding.py")
+      filename = "python/json_encoding.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/shared/aggregates.py")
+      filename = "python/aggregates.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/shared/attachments.py")
+      filename = "python/attachments.py"
+    }
+}
+
+resource "aws_lambda_layer_version" "shared" {
+    layer_name          = "${var.environment}-shared"
+    filename            = data.archive_file.shared_layer.output_path
+    source_code_hash    = data.archive_file.shared_layer.output_base64sha256
+    compatible_runtimes = ["python3.13", "python3.14"]
+}
+
+# Lambda code is zipped from the sources on every plan, boto3 and urllib3 come with the runtime
+data "archive_file" "injection" {
+    type        = "zip"
+    output_path = "${path.root}/.terraform/injection.zip"
+    source {
+      content  = file("${path.module}/../../../code/injection/lambda_function.py")
+      filename = "lambda_function.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/injection/mime_stream.py")
+      filename = "mime_stream.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/injection/attachment_filter.py")
+      filename = "attachment_filter.py"
+    }
+}
 
 resource "aws_lambda_function" "injection" {
-    filename                       = "${path.module}/../../../code/injection/injection.zip"
+    filename                       = data.archive_file.injection.output_path
+    source_code_hash               = data.archive_file.injection.output_base64sha256
     function_name                  = "${var.environment}-injection"
     role                           = aws_iam_role.injection.arn
     runtime                        = "python3.14"
     handler                        = "lambda_function.lambda_handler"
+    layers                         = [aws_lambda_layer_version.shared.arn]
 
     environment {
       variables = {
         "PROCESSING_QUEUE_URL": aws_sqs_queue.processing.url 
-        "BUCKET_NAME" : aws_s3_bucket.main.id 
+        "BUCKET_NAME" : aws_s3_bucket.main.id,
+        "INJECTION_WORKERS" : try(var.processing_config.injection_workers, 4),
+        "INLINE_MAX_BYTES" : try(var.processing_config.inline_max_bytes, 196608),
+        "MIN_IMAGE_BYTES" : try(var.processing_config.min_image_bytes, 5120),
+        "MIN_IMAGE_SIDE" : try(var.processing_config.min_image_side, 150),
+        "METRICS_SAMPLE_RATE" : try(var.processing_config.metrics_sample_rate, 1),
+        "LOG_LEVEL" : try(var.processing_config.log_level, "INFO")
         }
     }
 
@@ -17,20 +75,114 @@ resource "aws_lambda_function" "injection" {
     tags = var.tags
 }
 
+data "archive_file" "processing" {
+    type        = "zip"
+    output_path = "${path.root}/.terraform/processing.zip"
+    source {
+      content  = file("${path.module}/../../../code/processing/lamda_function.py")
+      filename = "lambda_function.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/processing/extraction_cache.py")
+      filename = "extraction_cache.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/processing/model_client.py")
+      filename = "model_client.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/processing/image_preprocessing.py")
+      filename = "image_preprocessing.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/processing/pdf_pages.py")
+      filename = "pdf_pages.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/processing/rate_limiter.py")
+      filename = "rate_limiter.py"
+    }
+    source {
+      content  = file("${path.module}/../../../code/processing/visibility_heartbeat.py")
+      filename = "visibility_heartbeat.py"
+    }
+}
+
+# Pillow and pypdfium2 are optional, they come from layers in processing_layers built for the same runtime
 resource "aws_lambda_function" "processing" {
-    filename                       = "${path.module}/../../../code/processing/processing.zip"
+    filename                       = data.archive_file.processing.output_path
+    source_code_hash               = data.archive_file.processing.output_base64sha256
     function_name                  = "${var.environment}-processing"
     role                           = aws_iam_role.processing.arn
     runtime                        = "python3.14"
     handler = "lambda_function.lambda_handler"
+    layers = concat([aws_lambda_layer_version.shared.arn], try(var.processing_config.processing_layers, []))
     environment {
       variables = {"BUCKET_NAME" : aws_s3_bucket.main.id,
                   "TABLE_NAME" : aws_dynamodb_table.main.name,
+                  "AGGREGATES_TABLE_NAME" : aws_dynamodb_table.aggregates.name,
+                  "PROCESSING_QUEUE_URL" : aws_sqs_queue.processing.url,
+                  "QUEUE_VISIBILITY_TIMEOUT" : aws_sqs_queue.processing.visibility_timeout_seconds,
+                  "VISIBILITY_HEARTBEAT_SECONDS" : try(var.processing_config.visibility_heartbeat_seconds, 30),
+                  "VISIBILITY_EXTENSION_SECONDS" : try(var.processing_config.visibility_extension_seconds, 90),
                   "OPENROUTER_API_KEY" : var.processing_config.openrouter_api_key ,
                   "OPENROUTER_MODEL": var.processing_config.openrouter_model, 
-                  "SENDER_EMAIL" :  var.processing_config.sender_email
+                  "OPENROUTER_FAST_MODEL" : try(var.processing_config.openrouter_fast_model, ""),
+                  "FAST_MODEL_MAX_TOKENS" : try(var.processing_config.fast_model_max_tokens, 150),
+                  "SENDER_EMAIL" :  var.processing_config.sender_email,
+                  "EXTRACTION_WORKERS" : try(var.processing_config.extraction_workers, 4),
+                  "MODEL_BATCH_SIZE" : try(var.processing_config.model_batch_size, 1),
+                  "MODEL_BATCH_BYTES" : try(var.processing_config.model_batch_bytes, 4194304),
+                  "CACHE_TABLE_NAME" : aws_dynamodb_table.extraction_cache.name,
+                  "CACHE_TTL_DAYS" : try(var.processing_config.cache_ttl_days, 30),
+                  "IMAGE_MAX_DIMENSION" : try(var.processing_config.image_max_dimension, 1600),
+                  "IMAGE_FORMAT" : try(var.processing_config.image_format, "JPEG"),
+                  "IMAGE_QUALITY" : try(var.processing_config.image_quality, 80),
+                  "IMAGE_GRAYSCALE" : try(var.processing_config.image_grayscale, "true"),
+                  "PDF_MAX_PAGES" : try(var.processing_config.pdf_max_pages, 4),
+                  "PDF_DPI" : try(var.processing_config.pdf_dpi, 150),
+                  "PDF_PAGE_WORKERS" : try(var.processing_config.pdf_page_workers, 2),
+                  "RATE_LIMIT_TABLE_NAME" : aws_dynamodb_table.rate_limits.name,
+                  "MODEL_RATE_LIMIT" : try(var.processing_config.model_rate_limit, 0),
+                  "MODEL_RATE_WINDOW_SECONDS" : try(var.processing_config.model_rate_window_seconds, 60),
+                  "SENDER_RATE_LIMIT" : try(var.processing_config.sender_rate_limit, 0),
+                  "SENDER_WINDOW_SECONDS" : try(var.processing_config.sender_window_seconds, 300),
+                  "METRICS_SAMPLE_RATE" : try(var.processing_config.metrics_sample_rate, 1),
+                  "LOG_LEVEL" : try(var.processing_config.log_level, "INFO")
       }
     }
     timeout = var.processing_config.processing_timeout
     tags = var.tags
-}
\ No newline at end of file
+}
+
+data "archive_file" "export" {
+    type        = "zip"
+    output_path = "${path.root}/.terraform/export.zip"
+    source_file = "${path.module}/../../../code/export/lambda_function.py"
+}
+
+# pyarrow is too large to bundle, it comes from a layer such as AWS SDK for pandas built for the same runtime
+resource "aws_lambda_function" "export" {
+    filename                       = data.archive_file.export.output_path
+    source_code_hash               = data.archive_file.export.output_base64sha256
+    function_name                  = "${var.environment}-export"
+    role                           = aws_iam_role.export.arn
+    runtime                        = try(var.processing_config.export_runtime, "python3.13")
+    handler                        = "lambda_function.lambda_handler"
+    layers                         = concat([aws_lambda_layer_version.shared.arn], try([var.processing_config.pyarrow_layer], []))
+    memory_size                    = try(var.processing_config.export_memory, 1024)
+
+    environment {
+      variables = {
+        "BUCKET_NAME" : aws_s3_bucket.main.id,
+        "EXPORT_PREFIX" : "processed/receipts/",
+        "COMPACT_TARGET_BYTES" : try(var.processing_config.compact_target_bytes, 67108864),
+        "COMPACT_MIN_FILES" : try(var.processing_config.compact_min_files, 4),
+        "METRICS_SAMPLE_RATE" : try(var.processing_config.metrics_sample_rate, 1),
+        "LOG_LEVEL" : try(var.processing_config.log_level, "INFO")
+        }
+    }
+
+    timeout = 300
+    tags = var.tags
+}
@@ -19,3 +19,22 @@ output "lambda_processing" {
     description = "Lambda, responsible for processing receipts"
 }
 
+output "aggregates_table" {
+    value = aws_dynamodb_table.aggregates
+    description = "Table that stores precomputed per-user receipt totals"
+}
+
+output "shared_layer" {
+    value = aws_lambda_layer_version.shared.arn
+    description = "Lambda layer with the code shared by all lambdas"
+}
+
+output "lambda_export" {
+    value = aws_lambda_function.export.arn
+    description = "Lambda, responsible for the Parquet export of processed receipts"
+}
+
+output "analytics_table" {
+    value = "${aws_glue_catalog_database.analytics.name}.${aws_glue_catalog_table.receipts.name}"
+    description = "Athena table over the Parquet export, partitioned by user, year and month"
+}
@@ -46,6 +46,10 @@ resource "aws_lambda_event_source_mapping" "injection_queue_trigger" {
   event_source_arn = aws_sqs_queue.injection.arn
   function_name    = aws_lambda_function.injection.arn
   
+  batch_size                         = try(var.processing_config.injection_batch_size, 10)
+  maximum_batching_window_in_seconds = try(var.processing_config.injection_batching_window, 0)
+  function_response_types            = ["ReportBatchItemFailures"]
+
   enabled          = true
 
   depends_on = [
@@ -58,6 +62,18 @@ resource "aws_lambda_event_source_mapping" "processing_queue_trigger" {
   event_source_arn = aws_sqs_queue.processing.arn
   function_name    = aws_lambda_function.processing.arn
   
+  batch_size                         = try(var.processing_config.processing_batch_size, 10)
+  maximum_batching_window_in_seconds = try(var.processing_config.processing_batching_window, 0)
+  function_response_types            = ["ReportBatchItemFailures"]
+
+  # Caps concurrent processing Lambdas (2-1000), unset leaves it to Lambda's scaling
+  dynamic "scaling_config" {
+    for_each = try(var.processing_config.processing_max_concurrency, null) == null ? [] : [var.processing_config.processing_max_concurrency]
+    content {
+      maximum_concurrency = scaling_config.value
+    }
+  }
+
   enabled          = true
 
   depends_on = [
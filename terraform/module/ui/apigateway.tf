@@ -1,6 +1,6 @@
 locals {
   cors_config = {
-    headers = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With'"
+    headers = "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,X-Requested-With,If-None-Match'"
     methods = "'GET,OPTIONS,POST,PUT,DELETE'"
     origin  = "'*'"
   }
@@ -111,9 +111,94 @@ resource "aws_api_gateway_integration_response" "get" {
   response_parameters = local.cors_response_params
 }
 
+# GET /api/analytics, precomputed dashboard totals
+resource "aws_api_gateway_resource" "analytics" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  parent_id   = aws_api_gateway_resource.api.id
+  path_part   = "analytics"
+}
+
+resource "aws_api_gateway_method" "analytics_get" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.analytics.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+}
+
+resource "aws_api_gateway_integration" "analytics" {
+  rest_api_id             = aws_api_gateway_rest_api.main.id
+  resource_id             = aws_api_gateway_resource.analytics.id
+  http_method             = aws_api_gateway_method.analytics_get.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.getmessages.invoke_arn
+}
+
+resource "aws_api_gateway_method" "analytics_options" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.analytics.id
+  http_method   = "OPTIONS"
+  authorization = "NONE"
+}
+
+resource "aws_api_gateway_integration" "analytics_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.analytics.id
+  http_method = aws_api_gateway_method.analytics_options.http_method
+  type        = "MOCK"
+
+  request_templates = {
+    "application/json" = jsonencode({ statusCode = 200 })
+  }
+}
+
+resource "aws_api_gateway_method_response" "analytics_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.analytics.id
+  http_method = aws_api_gateway_method.analytics_options.http_method
+  status_code = "200"
+
+  response_parameters = {
+    for k, v in local.cors_response_params : k => true
+  }
+}
+
+resource "aws_api_gateway_integration_response" "analytics_options" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  resource_id = aws_api_gateway_resource.analytics.id
+  http_method = aws_api_gateway_method.analytics_options.http_method
+  status_code = aws_api_gateway_method_response.analytics_options.status_code
+
+  response_parameters = local.cors_response_params
+}
+
 resource "aws_api_gateway_deployment" "main" {
   rest_api_id = aws_api_gateway_rest_api.main.id
 
+  # A deployment is a snapshot, redeploy whenever a route, integration or CORS header changes
+  triggers = {
+    redeployment = sha1(jsonencode([
+      aws_api_gateway_authorizer.cognito,
+      aws_api_gateway_resource.api,
+      aws_api_gateway_method.get,
+      aws_api_gateway_integration.getmessages,
+      aws_api_gateway_method.options,
+      aws_api_gateway_integration.options,
+      aws_api_gateway_method_response.options,
+      aws_api_gateway_method_response.get,
+      aws_api_gateway_integration_response.options,
+      aws_api_gateway_integration_response.get,
+      aws_api_gateway_resource.analytics,
+      aws_api_gateway_method.analytics_get,
+      aws_api_gateway_integration.analytics,
+      aws_api_gateway_method.analytics_options,
+      aws_api_gateway_integration.analytics_options,
+      aws_api_gateway_method_response.analytics_options,
+      aws_api_gateway_integration_response.analytics_options,
+    ]))
+  }
+
   lifecycle {
     create_before_destroy = true
   }
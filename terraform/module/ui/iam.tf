@@ -49,6 +49,14 @@ resource "aws_iam_policy" "getmessages" {
           "${var.table.arn}/index/*"
         ]
       },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:GetItem",
+          "dynamodb:Query"
+        ]
+        Resource = var.aggregates_table.arn
+      },
     ]
   })
 }
@@ -1,12 +1,25 @@
+data "archive_file" "getmessages" {
+    type        = "zip"
+    output_path = "${path.root}/.terraform/getmessages.zip"
+    source_file = "${path.module}/../../../code/getmessages/lambda_function.py"
+}
+
 resource "aws_lambda_function" "getmessages" {
-    filename                       = "${path.module}/../../../code/getmessages/getmessages.zip"
+    filename                       = data.archive_file.getmessages.output_path
+    source_code_hash               = data.archive_file.getmessages.output_base64sha256
     function_name                  = "${var.environment}-getmessages"
     role                           = aws_iam_role.getmessages.arn
     runtime                        = "python3.14"
     handler = "lambda_function.lambda_handler"
+    layers = [var.shared_layer]
     environment {
     variables = {
                  "TABLE_NAME" : var.table.name,
+                 "INDEX_NAME" : "email_from-processed_at-index",
+                 "AGGREGATES_TABLE_NAME" : var.aggregates_table.name,
+                 "METRICS_SAMPLE_RATE" : try(var.ui_config.metrics_sample_rate, 1),
+                 "LOG_LEVEL" : try(var.ui_config.log_level, "INFO"),
+                 "VERSION_SETTLE_SECONDS" : try(var.ui_config.version_settle_seconds, 5),
         }
     }
     timeout = 3
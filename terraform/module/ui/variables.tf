@@ -1,5 +1,7 @@
 variable  "environment" {}
 variable "table" {}
+variable "aggregates_table" {}
+variable "shared_layer" {}
 variable "region" {}
 variable "tags" {}
 variable "ui_config" {}
\ No newline at end of file
@@ -7,6 +7,8 @@ cc
 module "ui"{
     source ="./module/ui"
     table = module.processing.table
+    aggregates_table = module.processing.aggregates_table
+    shared_layer = module.processing.shared_layer
     ui_config = var.ui_config
     environment = var.environment
     region  = var.region
@@ -0,0 +1,95 @@
+"""
+Lambda handlers against the in-memory AWS stand-in of the benchmarks.
+
+The handlers read their configuration and build their clients at import
+time, so they are imported once per session after the stand-in is
+installed, and every test starts from empty tables.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+CODE = os.path.join(TESTS, '..', 'code')
+
+TABLE = 'receipts-table'
+INDEX = 'email_from-processed_at-index'
+AGGREGATES_TABLE = 'user-aggregates'
+PROCESSING_QUEUE = 'https://sqs.us-east-1.amazonaws.com/000000000000/processing'
+
+TABLES = {
+    TABLE: {'key': ('receipt_id', None), 'indexes': {INDEX: ('email_from', 'processed_at')}},
+    AGGREGATES_TABLE: {'key': ('email_from', 'aggregate_key')}
+}
+
+
+def load_handler(name, directory, filename):
+    """Import a Lambda module under a unique name, its directory provides sibling modules"""
+    path = os.path.join(CODE, directory)
+    sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(path, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def local_aws():
+    os.environ.update({
+        'BUCKET_NAME': 'test-bucket',
+        'TABLE_NAME': TABLE,
+        'INDEX_NAME': INDEX,
+        'AGGREGATES_TABLE_NAME': AGGREGATES_TABLE,
+        'PROCESSING_QUEUE_URL': PROCESSING_QUEUE,
+        'OPENROUTER_API_KEY': 'test',
+        'OPENROUTER_FAST_MODEL': '',
+        'SENDER_EMAIL': 'receipts@example.com',
+        'CACHE_LRU_SIZE': '0',
+        'VERSION_SETTLE_SECONDS': '0'
+    })
+    sys.path.append(os.path.join(TESTS, '..', 'benchmarks'))
+    from local_aws import LocalAWS
+    # The shared layer is mounted on /opt/python in Lambda
+    sys.path.insert(0, os.path.join(CODE, 'shared'))
+    return LocalAWS(TABLES).install()
+
+
+@pytest.fixture(scope='session')
+def processing_module(local_aws):
+    return load_handler('processing_handler', 'processing', 'lamda_function.py')
+
+
+@pytest.fixture(scope='session')
+def getmessages_module(local_aws):
+    return load_handler('getmessages_handler', 'getmessages', 'lambda_function.py')
+
+
+@pytest.fixture(scope='session')
+def export_module(local_aws):
+    return load_handler('export_handler', 'export', 'lambda_function.py')
+
+
+@pytest.fixture
+def aws(local_aws):
+    for items in local_aws.dynamodb.tables.values():
+        items.clear()
+    local_aws.sqs.drain(PROCESSING_QUEUE)
+    local_aws.s3.objects.clear()
+    return local_aws
+
+
+@pytest.fixture
+def processing(aws, processing_module):
+    return processing_module
+
+
+@pytest.fixture
+def getmessages(aws, getmessages_module):
+    return getmessages_module
+
+
+@pytest.fixture
+def export(aws, export_module):
+    return export_module
@@ -0,0 +1,61 @@
+"""
+Attachments the injection lambda keeps from the model.
+"""
+import os
+import struct
+import sys
+import zlib
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code', 'injection'))
+
+import pytest
+from attachment_filter import PartInspector, skip_reason
+
+
+class Sink:
+    def write(self, data):
+        pass
+
+
+def png(width, height, padding):
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    ihdr = struct.pack('>I', len(header)) + b'IHDR' + header + struct.pack('>I', zlib.crc32(b'IHDR' + header))
+    return b'\x89PNG\r\n\x1a\n' + ihdr + bytes(range(256)) * (padding // 256)
+
+
+PHOTO = png(1200, 1600, 64 * 1024)
+LOGO = png(120, 40, 8 * 1024)
+
+
+def inspect(data, disposition, cid='<photo@mail>'):
+    message = EmailMessage()
+    message.set_content(data, 'image', 'png', cid=cid, disposition=disposition or 'inline')
+    if disposition is None:
+        del message['Content-Disposition']
+    inspector = PartInspector(Sink(), message)
+    inspector.write(data)
+    return skip_reason(inspector, 'image/png', len(data), set(), {'photo@mail'})
+
+
+@pytest.mark.parametrize('data, disposition, expected', [
+    (PHOTO, 'inline', 'inline'),
+    (PHOTO, 'attachment', None),
+    # Receipt photos some clients send with a Content-ID and no disposition
+    (PHOTO, None, None),
+    (LOGO, None, 'small'),
+], ids=['inline', 'attachment', 'no-disposition', 'small-no-disposition'])
+def test_cid_referenced_images(data, disposition, expected):
+    assert inspect(data, disposition) == expected
+
+
+def test_unreferenced_inline_image_is_kept():
+    assert inspect(PHOTO, 'inline', cid='<other@mail>') is None
+
+
+def test_repeated_part_is_skipped():
+    seen = set()
+    inspector = PartInspector(Sink(), EmailMessage())
+    inspector.write(PHOTO)
+    assert skip_reason(inspector, 'image/png', len(PHOTO), seen, set()) is None
+    assert skip_reason(inspector, 'image/png', len(PHOTO), seen, set()) == 'duplicate'
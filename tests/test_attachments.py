@@ -0,0 +1,30 @@
+"""
+Attachment classification shared by the injection and processing lambdas.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code', 'shared'))
+
+import pytest
+from attachments import is_pdf, unique_filename
+
+
+@pytest.mark.parametrize('content_type, filename, expected', [
+    ('application/pdf', 'invoice', True),
+    ('Application/PDF', None, True),
+    ('application/octet-stream', 'Invoice.PDF', True),
+    ('', 'invoice.pdf', True),
+    (None, 'invoice.pdf', True),
+    ('', 'receipt.jpg', False),
+    ('image/jpeg', 'scan.pdf', False),
+    ('application/octet-stream', None, False),
+])
+def test_is_pdf(content_type, filename, expected):
+    assert is_pdf(content_type, filename) is expected
+
+
+def test_unique_filename():
+    taken = set()
+    names = [unique_filename(name, taken) for name in ['image.jpg', 'image.jpg', 'scan', 'image.jpg', 'scan']]
+    assert names == ['image.jpg', 'image (2).jpg', 'scan', 'image (3).jpg', 'scan (2)']
@@ -0,0 +1,69 @@
+"""
+Parquet export of the receipts stream: retried stream batches export
+receipts again, compaction keeps one copy of each receipt per partition.
+"""
+import io
+
+import pyarrow.parquet as pq
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+serializer = TypeSerializer()
+
+
+def stream_record(sequence, receipt_id, merchant='Shop'):
+    item = {
+        'receipt_id': receipt_id,
+        'message_id': 'm1',
+        'email_from': 'user@example.com',
+        'filename': f'{receipt_id}.jpg',
+        'status': 'processed',
+        'processed_at': '2024-05-02T10:00:00Z',
+        'receipt_data': {'merchant_name': merchant, 'date': '2024-05-01', 'total_amount': '12.50'}
+    }
+    return {
+        'eventName': 'INSERT',
+        'dynamodb': {
+            'SequenceNumber': str(sequence),
+            'NewImage': {key: serializer.serialize(value) for key, value in item.items()}
+        }
+    }
+
+
+def partition_rows(aws, export):
+    rows = []
+    for (bucket, key), (data, content_type) in aws.s3.objects.items():
+        if key.startswith(export.EXPORT_PREFIX):
+            rows.extend(pq.read_table(io.BytesIO(data)).to_pylist())
+    return rows
+
+
+@pytest.fixture
+def one_file_per_group(export, monkeypatch):
+    """Every file is compacted in a group of its own, so duplicates sit in different groups"""
+    monkeypatch.setattr(export, 'COMPACT_MIN_FILES', 1)
+    monkeypatch.setattr(export, 'COMPACT_TARGET_BYTES', 1)
+    monkeypatch.setattr(export, 'plan_compaction', lambda files: [[key] for key, size in sorted(files)])
+
+
+def test_retried_batch_is_deduplicated_across_groups(export, aws, one_file_per_group):
+    export.export_records([stream_record(100, 'm1_a.jpg'), stream_record(200, 'm1_b.jpg')])
+    # Retried from the second record, together with a new one
+    export.export_records([stream_record(200, 'm1_b.jpg'), stream_record(300, 'm1_c.jpg')])
+    assert len(partition_rows(aws, export)) == 4
+
+    result = export.compact(None)
+
+    assert result['complete']
+    rows = partition_rows(aws, export)
+    assert sorted(row['receipt_id'] for row in rows) == ['m1_a.jpg', 'm1_b.jpg', 'm1_c.jpg']
+
+
+def test_latest_export_of_a_receipt_wins(export, aws, one_file_per_group):
+    export.export_records([stream_record(100, 'm1_a.jpg', merchant='Old')])
+    export.export_records([stream_record(500, 'm1_a.jpg', merchant='New')])
+
+    export.compact(None)
+
+    rows = partition_rows(aws, export)
+    assert [(row['merchant_name'], row['sequence_number']) for row in rows] == [('New', '500')]
@@ -0,0 +1,149 @@
+"""
+Dashboard API: listings are paged with an opaque cursor bound to the
+caller, responses carry an ETag of the user's data version and
+If-None-Match is answered 304 without a query.
+"""
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from conftest import AGGREGATES_TABLE, TABLE
+
+EMAIL = 'user@example.com'
+VERSION = ('3', '2024-05-02T10:00:00+00:00')
+
+
+def request(params=None, headers=None, resource='/messages', email=EMAIL):
+    return {
+        'httpMethod': 'GET',
+        'resource': resource,
+        'requestContext': {'authorizer': {'claims': {'email': email}}},
+        'queryStringParameters': params,
+        'headers': headers
+    }
+
+
+def put_receipt(receipt_id, processed_at, email=EMAIL):
+    boto3.resource('dynamodb').Table(TABLE).put_item(Item={
+        'receipt_id': receipt_id,
+        'email_from': email,
+        'processed_at': processed_at,
+        'status': 'processed',
+        'file_size': 100,
+        'receipt_data': {'merchant_name': 'Shop', 'total_amount': '12.50'}
+    })
+
+
+def put_version(receipt_count, updated_at, email=EMAIL):
+    boto3.resource('dynamodb').Table(AGGREGATES_TABLE).put_item(Item={
+        'email_from': email,
+        'aggregate_key': 'summary',
+        'receipt_count': receipt_count,
+        'updated_at': updated_at
+    })
+
+
+def test_validators_depend_on_version_resource_and_params(getmessages):
+    validators = getmessages.make_validators(EMAIL, VERSION, '/messages', {'limit': '10'})
+
+    assert validators['Last-Modified'] == 'Thu, 02 May 2024 10:00:00 GMT'
+    assert validators == getmessages.make_validators(EMAIL, VERSION, '/messages', {'limit': '10'})
+    for other in [
+        getmessages.make_validators('other@example.com', VERSION, '/messages', {'limit': '10'}),
+        getmessages.make_validators(EMAIL, ('4', VERSION[1]), '/messages', {'limit': '10'}),
+        getmessages.make_validators(EMAIL, VERSION, '/analytics', {'limit': '10'}),
+        getmessages.make_validators(EMAIL, VERSION, '/messages', {'limit': '20'})
+    ]:
+        assert other['ETag'] != validators['ETag']
+
+
+def test_no_validators_without_settled_version(getmessages, monkeypatch):
+    monkeypatch.setattr(getmessages, 'VERSION_SETTLE_SECONDS', 60)
+    just_now = datetime.now(timezone.utc).isoformat()
+
+    assert getmessages.make_validators(EMAIL, None, '/messages', {}) is None
+    # The index may not have the latest receipt yet
+    assert getmessages.make_validators(EMAIL, ('1', just_now), '/messages', {}) is None
+
+
+@pytest.mark.parametrize('if_none_match', ['{etag}', 'W/{etag}', '"other", {etag}', '*'],
+                         ids=['strong', 'weak', 'list', 'any'])
+def test_matching_if_none_match_is_not_modified(getmessages, aws, if_none_match):
+    put_receipt('m1_a.jpg', '2024-05-02T10:00:00Z')
+    put_version(1, '2024-05-02T10:00:00Z')
+    first = getmessages.lambda_handler(request(), None)
+    etag = first['headers']['ETag']
+    queries = aws.snapshot()['dynamodb.query']
+
+    response = getmessages.lambda_handler(request(headers={'If-None-Match': if_none_match.format(etag=etag)}), None)
+
+    assert first['statusCode'] == 200
+    assert response['statusCode'] == 304
+    assert response['body'] == ''
+    assert response['headers']['ETag'] == etag
+    assert aws.snapshot()['dynamodb.query'] == queries
+
+
+def test_new_receipt_changes_etag(getmessages):
+    put_receipt('m1_a.jpg', '2024-05-02T10:00:00Z')
+    put_version(1, '2024-05-02T10:00:00Z')
+    etag = getmessages.lambda_handler(request(), None)['headers']['ETag']
+
+    put_receipt('m2_a.jpg', '2024-05-03T10:00:00Z')
+    put_version(2, '2024-05-03T10:00:00Z')
+    response = getmessages.lambda_handler(request(headers={'If-None-Match': etag}), None)
+
+    assert response['statusCode'] == 200
+    assert response['headers']['ETag'] != etag
+    assert json.loads(response['body'])['count'] == 2
+
+
+def test_cursor_pages_through_every_receipt(getmessages):
+    for day in range(1, 6):
+        put_receipt(f'm{day}_a.jpg', f'2024-05-0{day}T10:00:00Z')
+    put_receipt('other_a.jpg', '2024-05-03T10:00:00Z', email='other@example.com')
+
+    pages, params = [], {'limit': '2'}
+    while True:
+        body = json.loads(getmessages.lambda_handler(request(params), None)['body'])
+        pages.append([item['receipt_id'] for item in body['items']])
+        if not body['next_token']:
+            break
+        params = {'limit': '2', 'next_token': body['next_token']}
+
+    # Newest first, nothing repeated or skipped
+    assert sum(pages, []) == [f'm{day}_a.jpg' for day in range(5, 0, -1)]
+    assert all(len(page) <= 2 for page in pages)
+
+
+def test_cursor_round_trip(getmessages):
+    key = {'receipt_id': 'm1_a.jpg', 'email_from': EMAIL, 'processed_at': '2024-05-02T10:00:00Z'}
+
+    token = getmessages.encode_token(key)
+
+    assert '=' not in token
+    assert getmessages.decode_token(token, EMAIL) == {name: {'S': value} for name, value in key.items()}
+    assert getmessages.encode_token(None) is None
+
+
+@pytest.mark.parametrize('key', [
+    {'receipt_id': 'm1_a.jpg', 'email_from': 'other@example.com', 'processed_at': '2024-05-02T10:00:00Z'},
+    {'receipt_id': 'm1_a.jpg', 'processed_at': '2024-05-02T10:00:00Z'},
+    {'receipt_id': 1, 'email_from': EMAIL},
+    ['m1_a.jpg']
+], ids=['foreign-email', 'no-email', 'not-a-string', 'not-a-key'])
+def test_foreign_or_malformed_cursor_is_rejected(getmessages, key):
+    token = getmessages.encode_token(key)
+
+    with pytest.raises(getmessages.BadRequest):
+        getmessages.decode_token(token, EMAIL)
+    response = getmessages.lambda_handler(request({'next_token': token}), None)
+    assert response['statusCode'] == 400
+
+
+def test_garbage_cursor_is_rejected(getmessages):
+    response = getmessages.lambda_handler(request({'next_token': 'not base64!'}), None)
+
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': 'Invalid next_token'}
@@ -0,0 +1,123 @@
+"""
+The streaming MIME walker of the injection lambda against the email package.
+
+Every attachment found by email.message_from_bytes(...).walk() must be
+streamed with the same name, type and decoded bytes, whatever the chunking
+of the raw email.
+"""
+import email
+import os
+import sys
+from email import policy
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code', 'injection'))
+
+import pytest
+from mime_stream import stream_attachments
+
+JPEG = b'\xff\xd8\xff\xe0' + bytes(range(256)) * 40 + b'\xff\xd9'
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(255, -1, -1)) * 30
+
+
+class Collector:
+    def __init__(self, found, part):
+        self.found = found
+        self.part = part
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.found.append((self.part.get_filename(), self.part.get_content_type(), bytes(self.data)))
+
+    def abort(self):
+        pass
+
+
+def streamed(raw, chunk_size):
+    found = []
+
+    def open_sink(part):
+        return Collector(found, part) if part.get_filename() else None
+
+    chunks = (raw[start:start + chunk_size] for start in range(0, len(raw), chunk_size))
+    stream_attachments(chunks, open_sink)
+    return found
+
+
+def walked(raw):
+    message = email.message_from_bytes(raw, policy=policy.default)
+    return [
+        (part.get_filename(), part.get_content_type(), part.get_payload(decode=True))
+        for part in message.walk()
+        if not part.is_multipart() and part.get_filename()
+    ]
+
+
+def receipt_email(subject='Receipt'):
+    message = EmailMessage()
+    message['From'] = 'Shop <shop@example.com>'
+    message['To'] = 'receipts@example.com'
+    message['Subject'] = subject
+    message.set_content('Your receipt is attached.')
+    message.add_alternative('<p>Your receipt <img src="cid:logo@shop"></p>', subtype='html')
+    message.get_payload()[1].add_related(PNG, 'image', 'png', cid='<logo@shop>', filename='logo.png')
+    message.add_attachment(JPEG, 'image', 'jpeg', filename='receipt.jpg')
+    return message
+
+
+def nested():
+    return receipt_email().as_bytes()
+
+
+def forwarded():
+    message = EmailMessage()
+    message['From'] = 'user@example.com'
+    message['To'] = 'receipts@example.com'
+    message['Subject'] = 'Fwd: Receipt'
+    message.set_content('See the forwarded email.')
+    message.add_attachment(receipt_email())
+    message.add_attachment(PNG, 'image', 'png', filename='photo.png')
+    return message.as_bytes()
+
+
+def forwarded_single_part():
+    inner = EmailMessage()
+    inner['Subject'] = 'Invoice'
+    inner.set_content(JPEG, 'image', 'jpeg', filename='invoice.jpg')
+    message = EmailMessage()
+    message['Subject'] = 'Fwd: Invoice'
+    message.set_content('Forwarded.')
+    message.add_attachment(inner)
+    return message.as_bytes()
+
+
+def quoted_printable():
+    message = EmailMessage()
+    message['Subject'] = 'Receipt as text'
+    message.set_content('Body')
+    text = 'Total: 12,50 € ' + 'x' * 200 + '\nMerchant=Shop\n'
+    message.add_attachment(text, filename='receipt.txt', cte='quoted-printable')
+    return message.as_bytes()
+
+
+def no_trailing_delimiter():
+    raw = nested()
+    boundary = email.message_from_bytes(raw, policy=policy.default).get_boundary().encode()
+    return raw[:raw.rindex(b'--' + boundary + b'--')]
+
+
+def crlf():
+    return receipt_email().as_bytes(policy=policy.SMTP)
+
+
+@pytest.mark.parametrize('build', [nested, forwarded, forwarded_single_part, quoted_printable,
+                                   no_trailing_delimiter, crlf])
+@pytest.mark.parametrize('chunk_size', [7, 1024, 1 << 20])
+def test_matches_email_walk(build, chunk_size):
+    raw = build()
+    expected = walked(raw)
+    assert expected
+    assert streamed(raw, chunk_size) == expected
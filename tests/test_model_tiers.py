@@ -0,0 +1,88 @@
+"""
+Model tiers of the processing lambda: extractions go to the fast model
+first and only answers failing receipt_problem are escalated.
+"""
+import json
+
+import pytest
+
+FAST = 'fast/model'
+VALID = {'merchant_name': 'Shop', 'date': '2024-05-01', 'total_amount': 12.5, 'currency': 'EUR'}
+INVALID = {'merchant_name': 'Shop', 'date': '05/01/2024', 'total_amount': 12.5, 'currency': 'EUR'}
+CONTENT = [{'type': 'text', 'text': 'prompt'}]
+
+
+@pytest.fixture
+def model(processing, monkeypatch):
+    """Requests by model, answers[model] is returned or raised"""
+    monkeypatch.setattr(processing, 'OPENROUTER_FAST_MODEL', FAST)
+    processing.metrics.reset()
+    calls, answers = [], {}
+
+    def request_completion(message_content, timeout, max_tokens=500, model=None):
+        calls.append(model)
+        answer = answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(processing, 'request_completion', request_completion)
+    return calls, answers
+
+
+def test_valid_fast_answer_is_not_escalated(processing, model):
+    calls, answers = model
+    answers[FAST] = json.dumps(VALID)
+
+    assert processing.call_tiered(CONTENT, 'a.jpg')['merchant_name'] == 'Shop'
+    assert calls == [FAST]
+    assert processing.metrics.counters['Escalations'] == 0
+
+
+@pytest.mark.parametrize('answer', [json.dumps(INVALID), 'not json'], ids=['invalid-date', 'invalid-json'])
+def test_invalid_fast_answer_is_escalated(processing, model, answer):
+    calls, answers = model
+    answers[FAST] = answer
+    answers[processing.OPENROUTER_MODEL] = json.dumps(dict(INVALID, merchant_name='Strong'))
+
+    assert processing.call_tiered(CONTENT, 'a.jpg')['merchant_name'] == 'Strong'
+    assert calls == [FAST, processing.OPENROUTER_MODEL]
+    assert processing.metrics.counters['Escalations'] == 1
+
+
+def test_failed_fast_request_is_not_escalated(processing, model):
+    calls, answers = model
+    answers[FAST] = None
+
+    assert processing.call_tiered(CONTENT, 'a.jpg') is None
+    assert calls == [FAST]
+
+
+def test_unavailable_fast_model_is_not_escalated(processing, model):
+    calls, answers = model
+    answers[FAST] = processing.ModelUnavailableError('503 error from model')
+
+    with pytest.raises(processing.ModelUnavailableError):
+        processing.call_tiered(CONTENT, 'a.jpg')
+    assert calls == [FAST]
+
+
+def test_escalated_image_skips_fast_model(processing, model):
+    calls, answers = model
+    answers[processing.OPENROUTER_MODEL] = json.dumps(VALID)
+
+    assert processing.call_tiered(CONTENT, 'a.jpg', escalated=True) is not None
+    assert calls == [processing.OPENROUTER_MODEL]
+
+
+def test_batch_escalates_only_invalid_answers(processing, model):
+    calls, answers = model
+    answers[FAST] = json.dumps([dict(VALID, filename='a.jpg'), dict(INVALID, filename='b.jpg')])
+    images = [('a.jpg', 'aW1hZ2U=', 'image/png'), ('b.jpg', 'aW1hZ2U=', 'image/png'), ('c.jpg', 'aW1hZ2U=', 'image/png')]
+
+    extracted, escalate = processing.extract_receipt_batch(images)
+
+    assert set(extracted) == {'a.jpg'}
+    # Images the model left out aren't escalated, they get a fast model request of their own
+    assert escalate == {'b.jpg'}
+    assert calls == [FAST]
@@ -0,0 +1,130 @@
+"""
+Receipt claims of the processing lambda: every attachment is claimed
+before the model call, claims of attachments that weren't stored are
+released so the redelivered message can take them again.
+"""
+import base64
+import json
+import time
+import zlib
+
+import pytest
+from conftest import TABLE
+
+RECEIPT = '{"merchant_name": "Shop", "date": "2024-05-01", "total_amount": 12.5, "currency": "EUR", "payment_method": "card"}'
+UNAVAILABLE = b'unavailable photo'
+
+
+class Context:
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def attachment(filename, data):
+    return {
+        'filename': filename,
+        's3_key': f'injected/m1/files/{filename}',
+        'content_type': 'image/jpeg',
+        'size': len(data),
+        'inline': base64.b64encode(zlib.compress(data)).decode('ascii')
+    }
+
+
+def record(attachments, message_id='m1'):
+    return {
+        'messageId': f'record-{message_id}',
+        'receiptHandle': f'handle-{message_id}',
+        'body': json.dumps({
+            'message_id': message_id,
+            'email_from': 'user@example.com',
+            'attachments': attachments
+        })
+    }
+
+
+@pytest.fixture
+def model(processing, monkeypatch):
+    """Answers every request with RECEIPT, the first request for an image starting with UNAVAILABLE fails"""
+    calls = []
+    marker = base64.b64encode(UNAVAILABLE).decode('ascii')
+
+    def request_completion(message_content, timeout, max_tokens=500, model=None):
+        image = message_content[-1]['image_url']['url']
+        failing = marker in image and not any(marker in call for call in calls)
+        calls.append(image)
+        if failing:
+            raise processing.ModelUnavailableError('503 error from model')
+        return RECEIPT
+
+    monkeypatch.setattr(processing, 'request_completion', request_completion)
+    return calls
+
+
+def stored(aws):
+    return {item['receipt_id']: item for item in aws.dynamodb.tables[TABLE].values()}
+
+
+def test_duplicate_filenames_are_stored_separately(processing, aws, model):
+    event = {'Records': [record([attachment('image.jpg', b'first photo'), attachment('image.jpg', b'second photo')])]}
+
+    response = processing.lambda_handler(event, Context())
+
+    assert response['batchItemFailures'] == []
+    items = stored(aws).values()
+    assert sorted(item['filename'] for item in items) == ['image (2).jpg', 'image.jpg']
+    assert all(item['status'] == 'processed' for item in items)
+
+
+def test_redelivery_after_transient_failure_reclaims(processing, aws, model):
+    event = {'Records': [record([attachment('a.jpg', b'a photo'), attachment('b.jpg', UNAVAILABLE)])]}
+
+    first = processing.lambda_handler(event, Context())
+
+    assert first['batchItemFailures'] == [{'itemIdentifier': 'record-m1'}]
+    # The stored receipt stays, the claim of the failed one is gone
+    assert {item['filename']: item['status'] for item in stored(aws).values()} == {'a.jpg': 'processed'}
+
+    second = processing.lambda_handler(event, Context())
+
+    assert second['batchItemFailures'] == []
+    assert {item['filename']: item['status'] for item in stored(aws).values()} == {'a.jpg': 'processed', 'b.jpg': 'processed'}
+
+
+def test_live_claim_of_another_worker_retries_message(processing, aws, model):
+    message = {'message_id': 'm1', 'email_from': 'user@example.com'}
+    assert processing.claim_receipt(message, attachment('a.jpg', b'a'), time.time() + 60, 'other-worker')
+
+    response = processing.lambda_handler({'Records': [record([attachment('a.jpg', b'a photo')])]}, Context())
+
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'record-m1'}]
+    assert model == []
+    # The other worker's claim is left alone
+    assert stored(aws)['m1_a.jpg']['claimed_by'] == 'other-worker'
+
+
+def test_claims_are_owned_and_leased_until_visibility_timeout(processing, aws):
+    message = {'message_id': 'm1', 'email_from': 'user@example.com'}
+    lease_until = time.time() + processing.QUEUE_VISIBILITY_TIMEOUT
+
+    assert processing.claim_receipt(message, attachment('a.jpg', b'a'), lease_until, 'worker')
+    # Taken over by its owner, not by anyone else while the lease runs
+    assert processing.claim_receipt(message, attachment('a.jpg', b'a'), lease_until, 'worker')
+    assert not processing.claim_receipt(message, attachment('a.jpg', b'a'), lease_until, 'other-worker')
+
+    processing.release_claim(message, attachment('a.jpg', b'a'), 'other-worker')
+    assert 'm1_a.jpg' in stored(aws)
+    processing.release_claim(message, attachment('a.jpg', b'a'), 'worker')
+    assert 'm1_a.jpg' not in stored(aws)
+
+
+def test_handler_lease_is_capped_at_visibility_timeout(processing, aws, monkeypatch):
+    leases = []
+    monkeypatch.setattr(processing, 'claim_receipt', lambda message, attachment, lease_until, owner: leases.append(lease_until) or False)
+
+    class LongContext:
+        def get_remaining_time_in_millis(self):
+            return 900000
+
+    processing.lambda_handler({'Records': [record([attachment('a.jpg', b'a photo')])]}, LongContext())
+
+    assert leases and leases[0] <= time.time() + processing.QUEUE_VISIBILITY_TIMEOUT